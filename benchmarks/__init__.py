@@ -0,0 +1,6 @@
+"""性能基准测试
+
+每个模块都可以单独运行，例如::
+
+    python -m benchmarks.login_latency
+"""
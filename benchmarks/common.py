@@ -0,0 +1,122 @@
+"""基准测试公共工具"""
+import json
+import os
+import statistics
+import tempfile
+import time
+from contextlib import asynccontextmanager
+
+# 与测试一致：使用 StubBroker 和内存 JobStore，不依赖外部服务
+os.environ.setdefault("UNIT_TESTS", "1")
+
+from httpx import AsyncClient  # noqa: E402
+
+from scheduler_service import get_scheduler  # noqa: E402
+from scheduler_service.main import close_dbs, create_app, setup_dbs  # noqa: E402
+from scheduler_service.models import User  # noqa: E402
+
+
+def percentile(samples, pct: float) -> float:
+    """计算百分位数（最近秩法）"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples) -> dict:
+    """汇总耗时样本（单位：毫秒）"""
+    return {
+        "count": len(samples),
+        "mean": statistics.fmean(samples) if samples else 0.0,
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "p99": percentile(samples, 99),
+        "max": max(samples) if samples else 0.0,
+    }
+
+
+def save_results(path: str, result: dict):
+    """把结果保存为JSON，两次运行的结果可以用 benchmarks.compare 对比"""
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+
+
+def _flatten(result: dict, prefix: str = "") -> dict:
+    items = {}
+    for key, value in result.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            items.update(_flatten(value, f"{path}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            items[path] = value
+    return items
+
+
+# 越小越好的耗时统计项；以 per_s 结尾的吞吐量越大越好，其他数值（计数、配置）不比较
+LATENCY_KEYS = ("mean", "p50", "p95", "p99", "max")
+
+
+def compare_results(base: dict, new: dict, threshold_pct: float = 10.0) -> list:
+    """
+    对比两次结果中同名的耗时和吞吐量，返回 [(名称, 基准值, 新值, 变化百分比, 是否退化)]。
+    变差超过 threshold_pct 时视为退化。
+    """
+    base_items, new_items = _flatten(base), _flatten(new)
+    rows = []
+    for path, old in base_items.items():
+        key = path.rsplit(".", 1)[-1]
+        higher_better = key.endswith("per_s")
+        if path not in new_items or not (higher_better or key in LATENCY_KEYS):
+            continue
+        value = new_items[path]
+        change = (value - old) / old * 100 if old else 0.0
+        worse = -change if higher_better else change
+        rows.append((path, old, value, change, worse > threshold_pct))
+    return rows
+
+
+class Timer:
+    """记录代码块耗时（毫秒）"""
+
+    def __init__(self, samples: list):
+        self.samples = samples
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.samples.append((time.perf_counter() - self.start) * 1000)
+
+
+@asynccontextmanager
+async def running_app(config: dict = None):
+    """启动一个使用临时SQLite数据库的应用，返回 (app, client)"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app = create_app({
+            "POSTGRES_URL": f"sqlite://{os.path.join(tmpdir, 'bench.db')}",
+            "SECRET_KEY": "bench-secret-key",
+            **(config or {}),
+        })
+        await setup_dbs(app)
+        scheduler = get_scheduler()
+        scheduler.start()
+        try:
+            async with AsyncClient(app=app, base_url="http://bench") as client:
+                yield app, client
+        finally:
+            if scheduler.running:
+                scheduler.shutdown(wait=False)
+            await close_dbs()
+
+
+async def create_user(app, name: str = "bench", password: str = "password") -> dict:
+    """创建用户，返回认证请求头"""
+    user = await User.create(
+        name=name,
+        password_hash=User.hash_password(password),
+        email=f"{name}@bench.local",
+    )
+    return {"Authorization": f"Bearer {user.generate_auth_token(app.config['SECRET_KEY'])}"}
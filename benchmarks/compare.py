@@ -0,0 +1,40 @@
+"""对比两次基准测试的JSON结果
+
+对比同名的耗时统计（mean/p50/p95/p99/max，越小越好）和吞吐量（*_per_s，越大越好），
+有项目变差超过 --threshold 百分比时以非零状态退出，可用于CI::
+
+    python -m benchmarks.pipeline --output base.json
+    python -m benchmarks.pipeline --output new.json
+    python -m benchmarks.compare base.json new.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+from benchmarks.common import compare_results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base", help="基准结果")
+    parser.add_argument("new", help="新结果")
+    parser.add_argument("--threshold", type=float, default=10.0, help="视为退化的变化百分比")
+    parser.add_argument("--all", action="store_true", help="显示所有项，而不只是退化的项")
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    rows = compare_results(base, new, args.threshold)
+    regressions = [row for row in rows if row[4]]
+    for path, old, value, change, regressed in rows:
+        if regressed or args.all:
+            print(f"{'REGRESSION' if regressed else 'ok':<10} {path:<48} {old:>12.3f} -> {value:>12.3f} ({change:+.1f}%)")
+    print(f"{len(rows)} metrics compared, {len(regressions)} regressed by more than {args.threshold}%")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
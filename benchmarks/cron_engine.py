@@ -0,0 +1,193 @@
+"""cron 调度引擎：APScheduler 与 NativeScheduler
+
+生成 --jobs 个cron任务（来自 --expressions 个不同的表达式），分别测量两种调度器：
+
+- add：逐个 add_job 的耗时，与 API 创建任务相同，每个任务单独构造 CronTrigger；
+  NativeScheduler 另外测量从数据库加载任务时使用的 add_jobs；
+- process：所有任务同时到期时，取出到期任务、计算下一次触发时间并提交执行的耗时；
+- fire：从开始处理到所有任务函数执行完的耗时::
+
+    python -m benchmarks.cron_engine --jobs 100000 --expressions 1000
+
+APScheduler 默认使用内存任务存储；指定 --redis-url 时使用与生产相同的 RedisJobStore
+（使用 --key 前缀的键，结束时清空）。NativeScheduler 需要安装 numpy。
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import tracemalloc
+from datetime import datetime
+
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.redis import RedisJobStore
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
+from redis.connection import parse_url
+
+from scheduler_service.utils.cronengine import NativeScheduler
+
+MINUTES = [str(m) for m in range(60)] + ["*/5", "*/15", "*"]
+HOURS = [str(h) for h in range(24)] + ["*", "*/2", "*/6", "9-18"]
+DAYS = ["*", "1", "15"]
+WEEKDAYS = ["*", "mon-fri", "sat,sun"]
+TIMEZONE = "Asia/Shanghai"
+
+
+def generate_expressions(count: int, seed: int) -> list:
+    """生成 count 个不同的cron表达式"""
+    rng = random.Random(seed)
+    count = min(count, len(MINUTES) * len(HOURS) * len(DAYS) * len(WEEKDAYS))
+    expressions = set()
+    while len(expressions) < count:
+        expressions.add(f"{rng.choice(MINUTES)} {rng.choice(HOURS)} {rng.choice(DAYS)} * {rng.choice(WEEKDAYS)}")
+    return sorted(expressions)
+
+
+class Counter:
+    def __init__(self):
+        self.count = 0
+
+    async def fire(self, task_id, user_id, lane):
+        self.count += 1
+
+    async def wait(self, expected: int, timeout: float = 600):
+        deadline = time.monotonic() + timeout
+        while self.count < expected and time.monotonic() < deadline:
+            await asyncio.sleep(0.001)
+
+
+def create_apscheduler(args):
+    if args.redis_url:
+        jobstore = RedisJobStore(jobs_key=f"{args.key}.jobs", run_times_key=f"{args.key}.run_times",
+                                 **parse_url(args.redis_url))
+    else:
+        jobstore = MemoryJobStore()
+    scheduler = AsyncIOScheduler(jobstores={'default': jobstore}, timezone=TIMEZONE,
+                                 job_defaults={'misfire_grace_time': 3600, 'coalesce': True})
+    scheduler.start(paused=True)
+    return scheduler
+
+
+def create_native(args):
+    scheduler = NativeScheduler(job_defaults={'misfire_grace_time': 3600}, timezone=TIMEZONE,
+                                fire_batch_size=args.fire_batch_size)
+    scheduler.start(paused=True)
+    return scheduler
+
+
+def measure_add(create, crons, args) -> dict:
+    """逐个添加任务，返回每个任务的平均耗时（微秒）和内存增量"""
+    counter = Counter()
+    if args.memory:
+        tracemalloc.start()
+    scheduler = create(args)
+    start = time.perf_counter()
+    for i, cron in enumerate(crons):
+        scheduler.add_job(counter.fire, CronTrigger.from_crontab(cron), args=[i, 1, None])
+    elapsed = time.perf_counter() - start
+    result = {"add_us_per_job": elapsed / len(crons) * 1e6}
+    if args.memory:
+        result["memory_mb"] = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+        tracemalloc.stop()
+    if hasattr(scheduler, "remove_all_jobs"):
+        scheduler.remove_all_jobs()
+    scheduler.shutdown(wait=False)
+    return result
+
+
+def measure_add_jobs(crons, args) -> dict:
+    """NativeScheduler 批量加载，相同表达式共用触发器（与 service.cronsync 相同）"""
+    counter = Counter()
+    scheduler = create_native(args)
+    start = time.perf_counter()
+    triggers = {}
+    jobs = []
+    for i, cron in enumerate(crons):
+        if cron not in triggers:
+            triggers[cron] = CronTrigger.from_crontab(cron)
+        jobs.append((str(i), counter.fire, triggers[cron], [i, 1, None]))
+    scheduler.add_jobs(jobs)
+    elapsed = time.perf_counter() - start
+    scheduler.shutdown(wait=False)
+    return {"add_jobs_us_per_job": elapsed / len(crons) * 1e6}
+
+
+async def measure_fire(create, process, crons, args) -> dict:
+    """所有任务同时到期，测量处理一次到期任务和全部执行完的耗时"""
+    counter = Counter()
+    scheduler = create(args)
+    triggers = {}
+    due = datetime.fromtimestamp(time.time() - 1).astimezone()
+    for i, cron in enumerate(crons):
+        if cron not in triggers:
+            triggers[cron] = CronTrigger.from_crontab(cron)
+        scheduler.add_job(counter.fire, triggers[cron], args=[i, 1, None], next_run_time=due)
+
+    start = time.perf_counter()
+    process(scheduler)
+    processed = time.perf_counter()
+    await counter.wait(len(crons))
+    finished = time.perf_counter()
+    if hasattr(scheduler, "remove_all_jobs"):
+        scheduler.remove_all_jobs()
+    scheduler.shutdown(wait=False)
+    return {
+        "process_ms": (processed - start) * 1000,
+        "fire_ms": (finished - start) * 1000,
+        "fired": counter.count,
+    }
+
+
+def process_apscheduler(scheduler):
+    scheduler.resume()
+    scheduler._process_jobs()
+
+
+def process_native(scheduler):
+    jobs = scheduler.run_due()
+    task = asyncio.create_task(scheduler._run_jobs(jobs))
+    scheduler._firing.add(task)
+
+
+async def run(args) -> dict:
+    expressions = generate_expressions(args.expressions, args.seed)
+    rng = random.Random(args.seed)
+    crons = [rng.choice(expressions) for _ in range(args.jobs)]
+    result = {"jobs": args.jobs, "expressions": len(expressions)}
+
+    if not args.skip_apscheduler:
+        result["apscheduler"] = {
+            **measure_add(create_apscheduler, crons, args),
+            **await measure_fire(create_apscheduler, process_apscheduler, crons, args),
+        }
+    result["native"] = {
+        **measure_add(create_native, crons, args),
+        **measure_add_jobs(crons, args),
+        **await measure_fire(create_native, process_native, crons, args),
+    }
+    if "apscheduler" in result:
+        result["speedup"] = {
+            key: result["apscheduler"][key] / max(result["native"][key], 1e-9)
+            for key in ("add_us_per_job", "process_ms", "fire_ms")
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=100000, help="cron任务数")
+    parser.add_argument("--expressions", type=int, default=1000, help="不同的cron表达式数")
+    parser.add_argument("--fire-batch-size", type=int, default=1000, help="NativeScheduler 同时执行的任务数")
+    parser.add_argument("--memory", action="store_true", help="用 tracemalloc 统计添加任务后的内存（更慢）")
+    parser.add_argument("--skip-apscheduler", action="store_true", help="只测量 NativeScheduler（百万级任务时）")
+    parser.add_argument("--redis-url", help="APScheduler 使用 RedisJobStore")
+    parser.add_argument("--key", default="scheduler:bench:apscheduler", help="RedisJobStore 键前缀")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""公平调度对队头阻塞的改善
+
+模拟一个用户先提交大批量任务、其他用户随后各提交少量任务，worker 按固定速率消费。
+对比直接发送到单一 FIFO 队列和经过 FairQueue 加权轮询时，小用户任务的等待时间::
+
+    python -m benchmarks.fair_queue --bulk 50000 --users 20 --tasks-per-user 50
+"""
+import argparse
+import asyncio
+import json
+from collections import deque
+
+from benchmarks.common import summarize
+from scheduler_service.service.fairqueue import FairQueue, MemoryBackend
+
+BULK_USER = 0
+
+
+def simulate_fifo(bulk: int, users: int, per_user: int, throughput: int) -> dict:
+    """所有任务按提交顺序进入同一个队列"""
+    queue = deque((BULK_USER, i) for i in range(bulk))
+    queue.extend((user, i) for user in range(1, users + 1) for i in range(per_user))
+    waits = {"bulk": [], "small": []}
+    tick = 0
+    while queue:
+        tick += 1
+        for _ in range(min(throughput, len(queue))):
+            user, _ = queue.popleft()
+            waits["bulk" if user == BULK_USER else "small"].append(tick)
+    return waits
+
+
+async def simulate_fair(bulk: int, users: int, per_user: int, throughput: int,
+                        target_depth: int, weight: int) -> dict:
+    """任务进入用户子队列，调度器把下游队列积压保持在 target_depth 以内"""
+    downstream = deque()
+
+    async def depth():
+        return len(downstream)
+
+    fair = FairQueue(MemoryBackend(), send=downstream.append, depth=depth,
+                     target_depth=target_depth, default_weight=weight)
+    await fair.push(BULK_USER, [(BULK_USER, i) for i in range(bulk)])
+    for user in range(1, users + 1):
+        await fair.push(user, [(user, i) for i in range(per_user)])
+
+    waits = {"bulk": [], "small": []}
+    total, tick = bulk + users * per_user, 0
+    while sum(len(v) for v in waits.values()) < total:
+        tick += 1
+        # 每个时间片内调度器尽量补满下游队列，worker 消费 throughput 条
+        while await fair.dispatch_round():
+            pass
+        for _ in range(min(throughput, len(downstream))):
+            user, _ = downstream.popleft()
+            waits["bulk" if user == BULK_USER else "small"].append(tick)
+    return waits
+
+
+def report(waits: dict, tick_ms: float) -> dict:
+    return {name: summarize([tick * tick_ms for tick in ticks]) for name, ticks in waits.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bulk", type=int, default=50_000, help="大批量用户的任务数")
+    parser.add_argument("--users", type=int, default=20, help="其他用户数")
+    parser.add_argument("--tasks-per-user", type=int, default=50, help="其他用户每人的任务数")
+    parser.add_argument("--throughput", type=int, default=100, help="每个时间片消费的任务数")
+    parser.add_argument("--tick-ms", type=float, default=100.0, help="时间片长度（毫秒）")
+    parser.add_argument("--target-depth", type=int, default=200, help="FAIR_QUEUE_TARGET_DEPTH")
+    parser.add_argument("--weight", type=int, default=10, help="FAIR_QUEUE_DEFAULT_WEIGHT")
+    args = parser.parse_args()
+
+    fifo = simulate_fifo(args.bulk, args.users, args.tasks_per_user, args.throughput)
+    fair = asyncio.run(simulate_fair(args.bulk, args.users, args.tasks_per_user, args.throughput,
+                                     args.target_depth, args.weight))
+    print(json.dumps({
+        "fifo_wait_ms": report(fifo, args.tick_ms),
+        "fair_wait_ms": report(fair, args.tick_ms),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""调度器领导者故障转移
+
+在一个进程中启动多个候选节点，每个节点有自己的 AsyncIOScheduler，运行同一个固定间隔的任务，
+只有领导者的调度器处于运行状态。定期杀掉当前领导者（默认模拟崩溃：不释放租约），
+统计备用节点的接管时间、接管期间错过的触发次数，以及同一时间片被多个节点触发的次数::
+
+    python -m benchmarks.leader_failover --nodes 3 --kills 5 --ttl-ms 2000 --renew-ms 500
+
+默认使用内存租约；指定 --redis-url 时使用 Redis 租约（会写入 --key 指定的键）。
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from benchmarks.common import summarize
+from scheduler_service.config import Config
+from scheduler_service.utils.leader import LeaderElector, MemoryBackend, RedisBackend
+
+
+class Node:
+    """一个候选节点：选举器 + 只在领导期间运行的调度器"""
+
+    def __init__(self, name: str, backend, args, fires: list, events: list):
+        self.name = name
+        self.fires = fires
+        self.events = events
+        self.interval = args.interval_ms / 1000
+        self.scheduler = AsyncIOScheduler(
+            jobstores={'default': MemoryJobStore()},
+            job_defaults={'misfire_grace_time': Config.SCHEDULER_MISFIRE_GRACE_TIME, 'coalesce': True}
+        )
+        self.elector = LeaderElector(
+            backend, name, ttl_ms=args.ttl_ms, renew_ms=args.renew_ms,
+            on_elected=self.on_elected, on_demoted=self.on_demoted
+        )
+        self.task = None
+
+    async def on_elected(self, token):
+        self.events.append(("elected", self.name, time.monotonic()))
+        self.scheduler.resume()
+
+    async def on_demoted(self):
+        if self.scheduler.running:
+            self.scheduler.pause()
+
+    async def fire(self):
+        # 与 trigger_cron_task 一致：触发前用防护令牌确认领导权
+        if await self.elector.check():
+            self.fires.append((self.name, time.monotonic()))
+
+    def start(self):
+        self.scheduler.add_job(self.fire, 'interval', seconds=self.interval)
+        self.scheduler.start(paused=True)
+        self.task = asyncio.create_task(self.elector.run())
+
+    async def kill(self, graceful: bool):
+        """停止节点；崩溃时不释放租约，备用节点需等待租约过期"""
+        if not graceful:
+            # 崩溃的进程不会再执行任何代码
+            self.elector.backend = _Dead()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.scheduler.shutdown(wait=False)
+
+
+class _Dead:
+    """崩溃节点的后端：所有访问都失败"""
+
+    async def acquire(self, *args):
+        raise ConnectionError("node crashed")
+
+    async def release(self, *args):
+        raise ConnectionError("node crashed")
+
+    async def check(self, *args):
+        return False
+
+
+async def run(args) -> dict:
+    if args.redis_url:
+        Config.REDIS_URL = args.redis_url
+        backend = RedisBackend(args.key)
+    else:
+        backend = MemoryBackend()
+
+    fires, events, kills = [], [], []
+    nodes = {}
+    counter = 0
+
+    def spawn():
+        nonlocal counter
+        counter += 1
+        node = Node(f"node-{counter}", backend, args, fires, events)
+        nodes[node.name] = node
+        node.start()
+
+    for _ in range(args.nodes):
+        spawn()
+
+    start = time.monotonic()
+    await asyncio.sleep(args.warmup)
+    for _ in range(args.kills):
+        leader = next((node for node in nodes.values() if node.elector.is_leader), None)
+        if leader is None:
+            await asyncio.sleep(args.renew_ms / 1000)
+            continue
+        kills.append(time.monotonic())
+        await nodes.pop(leader.name).kill(args.graceful)
+        # 随机错开杀掉领导者的时刻与备用节点的续期周期
+        await asyncio.sleep(args.period + random.uniform(0, args.renew_ms / 1000))
+        # 被杀掉的节点重启后作为备用节点重新加入
+        spawn()
+    end = time.monotonic()
+
+    for node in nodes.values():
+        await node.kill(graceful=True)
+
+    # 接管时间：从杀掉领导者到下一次有节点当选
+    takeovers = []
+    for killed_at in kills:
+        elected = [at for kind, _, at in events if kind == "elected" and at > killed_at]
+        if elected:
+            takeovers.append((min(elected) - killed_at) * 1000)
+
+    # 以任务间隔划分时间片，统计没有触发和被重复触发的时间片
+    interval = args.interval_ms / 1000
+    first_slot = int((args.warmup / 2) / interval)
+    last_slot = int((end - start) / interval) - 1
+    slots = Counter(int((at - start) / interval) for _, at in fires)
+    expected = range(first_slot, last_slot + 1)
+
+    return {
+        "nodes": args.nodes,
+        "mode": "graceful" if args.graceful else "crash",
+        "backend": "redis" if args.redis_url else "memory",
+        "ttl_ms": args.ttl_ms,
+        "renew_ms": args.renew_ms,
+        "interval_ms": args.interval_ms,
+        "kills": len(kills),
+        "takeover_ms": summarize(takeovers),
+        "expected_fires": len(expected),
+        "missed_fires": sum(1 for slot in expected if not slots.get(slot)),
+        "duplicate_fires": sum(1 for slot in expected if slots.get(slot, 0) > 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=3, help="候选节点数")
+    parser.add_argument("--kills", type=int, default=5, help="杀掉领导者的次数")
+    parser.add_argument("--period", type=float, default=5.0, help="两次杀掉领导者之间的秒数")
+    parser.add_argument("--warmup", type=float, default=2.0, help="第一次杀掉领导者前的秒数")
+    parser.add_argument("--interval-ms", type=int, default=100, help="定时任务的间隔")
+    parser.add_argument("--ttl-ms", type=int, default=Config.SCHEDULER_LEADER_TTL_MS)
+    parser.add_argument("--renew-ms", type=int, default=Config.SCHEDULER_LEADER_RENEW_MS)
+    parser.add_argument("--graceful", action="store_true", help="正常退出（释放租约）而不是模拟崩溃")
+    parser.add_argument("--redis-url", help="使用Redis租约")
+    parser.add_argument("--key", default="scheduler:bench:leader", help="Redis租约键")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
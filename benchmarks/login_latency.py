@@ -0,0 +1,69 @@
+"""登录并发时 GET /tasks 的延迟
+
+登录请求会计算 pbkdf2 哈希。对比哈希在执行器中运行和直接在事件循环中运行时，
+同一进程内轮询接口的 p99 延迟::
+
+    python -m benchmarks.login_latency
+    python -m benchmarks.login_latency --inline
+"""
+import argparse
+import asyncio
+import json
+from contextlib import nullcontext
+from unittest import mock
+
+from benchmarks.common import Timer, create_user, running_app, summarize
+from scheduler_service.utils import hashing
+
+TASK_URL = "/api/v1/tasks"
+TOKEN_URL = "/api/v1/users/token"
+
+
+async def _inline_run(func, *args):
+    """直接在事件循环中计算哈希（改造前的行为）"""
+    return func(*args)
+
+
+async def run(logins: int, concurrency: int, inline: bool) -> dict:
+    async with running_app() as (app, client):
+        headers = await create_user(app)
+        stop = asyncio.Event()
+        poll_samples, login_samples = [], []
+
+        async def poll():
+            while not stop.is_set():
+                with Timer(poll_samples):
+                    resp = await client.get(TASK_URL, headers=headers)
+                resp.raise_for_status()
+
+        async def login(count: int):
+            for _ in range(count):
+                with Timer(login_samples):
+                    resp = await client.post(TOKEN_URL, json={"name": "bench", "password": "password"})
+                resp.raise_for_status()
+
+        patcher = mock.patch.object(hashing, "_run", _inline_run) if inline else nullcontext()
+        with patcher:
+            poller = asyncio.create_task(poll())
+            await asyncio.gather(*(login(logins // concurrency) for _ in range(concurrency)))
+            stop.set()
+            await poller
+
+    return {
+        "mode": "inline" if inline else "executor",
+        "get_tasks_ms": summarize(poll_samples),
+        "login_ms": summarize(login_samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200, help="登录请求总数")
+    parser.add_argument("--concurrency", type=int, default=20, help="并发登录数")
+    parser.add_argument("--inline", action="store_true", help="在事件循环中直接计算哈希作为对照")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.logins, args.concurrency, args.inline)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
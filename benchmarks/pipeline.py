@@ -0,0 +1,260 @@
+"""端到端吞吐量：创建任务 -> 入队 -> ping -> 状态写入 -> 回调
+
+在一个进程中运行完整链路，不访问外部网络：应用使用临时SQLite数据库和 StubBroker，
+ping 的目标和回调接收方是进程内的HTTP服务（可配置延迟和错误率），由真实的 Dramatiq worker 执行。
+分阶段统计吞吐量和 p50/p95/p99::
+
+    python -m benchmarks.pipeline --tasks 500 --bulk-batches 20 --latency-ms 5 --error-rate 0.01
+    python -m benchmarks.pipeline --status-mode buffered --output new.json
+    python -m benchmarks.compare base.json new.json
+
+阶段：
+- api_create / api_bulk_create：POST /tasks 和 POST /tasks/bulk；
+- broker_enqueue：ping.send；
+- ping：worker 中每条 ping 消息的处理耗时（请求目标、写状态和执行历史、回调入队）；
+- status_write：record_status（STATUS_WRITE_MODE 决定直接写入还是经过写后缓冲区）；
+- callback：deliver_callback 的处理耗时，以及从 ping 开始到回调到达接收方的端到端耗时。
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+
+import dramatiq
+from dramatiq import Worker
+
+from benchmarks.common import Timer, create_user, running_app, save_results, summarize
+from scheduler_service.config import Config
+from scheduler_service.constants import TaskStatus
+from scheduler_service.service.callback import deliver_callback
+from scheduler_service.service.request import ping
+from scheduler_service.service.status import record_status
+from scheduler_service.utils.buffer import flush_all
+
+TASK_URL = "/api/v1/tasks"
+
+
+class StubTarget:
+    """进程内的HTTP服务：/target 按配置的延迟和错误率响应，/callback/<任务名> 记录回调到达时间"""
+
+    def __init__(self, latency_ms: float, error_rate: float, seed: int = 0):
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.callbacks = {}
+        self.connections = {}
+        self.server = None
+        self.port = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self.server.close()
+        # keep-alive 连接不会随服务关闭，需要逐个关闭
+        for writer in self.connections.values():
+            writer.close()
+        await asyncio.gather(*self.connections)
+        await self.server.wait_closed()
+
+    async def _respond(self, path: str) -> int:
+        if path.startswith("/callback/"):
+            self.callbacks[path[len("/callback/"):]] = time.monotonic()
+            return 200
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            return 500
+        return 200
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # 只实现 keep-alive 的 HTTP/1.1 请求-响应，足够 httpx 使用
+        self.connections[asyncio.current_task()] = writer
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                request_line, *lines = head.decode("latin-1").split("\r\n")
+                path = request_line.split(" ")[1]
+                length = 0
+                for line in lines:
+                    name, _, value = line.partition(":")
+                    if name.strip().lower() == "content-length":
+                        length = int(value)
+                if length:
+                    await reader.readexactly(length)
+                status = await self._respond(path)
+                body = b'{"status": "ok"}'
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections.pop(asyncio.current_task(), None)
+            writer.close()
+
+
+class StageTimer(dramatiq.Middleware):
+    """记录每个actor处理消息的耗时，以及每个任务的 ping 开始时间"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.ping_started = {}
+        self._started = {}
+
+    def before_process_message(self, broker, message):
+        self._started[message.message_id] = time.perf_counter()
+        if message.actor_name == ping.actor_name:
+            self.ping_started[message.args[0]] = time.monotonic()
+
+    def after_process_message(self, broker, message, *, result=None, exception=None):
+        start = self._started.pop(message.message_id, None)
+        if start is not None:
+            self.samples[message.actor_name].append((time.perf_counter() - start) * 1000)
+
+    after_skip_message = after_process_message
+
+
+def stage(samples: list, elapsed: float, count: int = None) -> dict:
+    """阶段结果：吞吐量（每秒）和耗时统计（毫秒）"""
+    count = len(samples) if count is None else count
+    return {"count": count, "per_s": count / elapsed if elapsed else 0.0, "latency_ms": summarize(samples)}
+
+
+async def create_tasks(client, headers, target: StubTarget, args) -> tuple:
+    """单个和批量创建任务，返回 (任务名 -> ID, 两个阶段的结果)"""
+    def task_data(name: str) -> dict:
+        return {
+            "name": name, "start_time": time.time(), "request_url": f"{target.base_url}/target",
+            "callback_url": f"{target.base_url}/callback/{name}",
+        }
+
+    ids = {}
+    samples = []
+    queue = asyncio.Queue()
+    for i in range(args.tasks):
+        queue.put_nowait(f"s{i}")
+
+    async def create_single():
+        while not queue.empty():
+            name = queue.get_nowait()
+            with Timer(samples):
+                resp = await client.post(TASK_URL, headers=headers, json=task_data(name))
+            resp.raise_for_status()
+            ids[name] = resp.json()["task_id"]
+
+    start = time.perf_counter()
+    await asyncio.gather(*(create_single() for _ in range(args.concurrency)))
+    single = stage(samples, time.perf_counter() - start)
+
+    samples = []
+    start = time.perf_counter()
+    for batch in range(args.bulk_batches):
+        names = [f"b{batch}-{i}" for i in range(args.bulk_size)]
+        with Timer(samples):
+            resp = await client.post(f"{TASK_URL}/bulk", headers=headers, json=[task_data(name) for name in names])
+        resp.raise_for_status()
+        ids.update(zip(names, resp.json()["task_ids"]))
+    elapsed = time.perf_counter() - start
+    bulk = stage(samples, elapsed)
+    bulk["tasks_per_s"] = args.bulk_batches * args.bulk_size / elapsed if elapsed else 0.0
+    return ids, single, bulk
+
+
+async def run(args) -> dict:
+    Config.STATUS_WRITE_MODE = args.status_mode
+    target = StubTarget(args.latency_ms, args.error_rate, args.seed)
+    await target.start()
+    result = {"config": {key: value for key, value in vars(args).items() if key != "output"}, "stages": {}}
+    stages = result["stages"]
+
+    async with running_app() as (app, client):
+        broker = dramatiq.get_broker()
+        timer = StageTimer()
+        broker.add_middleware(timer)
+        headers = await create_user(app)
+
+        ids, stages["api_create"], stages["api_bulk_create"] = await create_tasks(client, headers, target, args)
+        # 创建时已发送的消息不计入后面的阶段
+        broker.flush_all()
+
+        task_ids = list(ids.values())[:args.pings or None]
+        samples = []
+        start = time.perf_counter()
+        for task_id in task_ids:
+            with Timer(samples):
+                ping.send(task_id)
+        stages["broker_enqueue"] = stage(samples, time.perf_counter() - start)
+
+        worker = Worker(broker, worker_threads=args.threads, worker_timeout=100)
+        start = time.perf_counter()
+        worker.start()
+        try:
+            await asyncio.to_thread(broker.join, ping.queue_name)
+            ping_elapsed = time.perf_counter() - start
+            await asyncio.to_thread(broker.join, deliver_callback.queue_name)
+            callback_elapsed = time.perf_counter() - start
+        finally:
+            # 停止时刷写写后缓冲区
+            await asyncio.to_thread(worker.stop)
+
+        stages["ping"] = stage(timer.samples[ping.actor_name], ping_elapsed)
+        stages["ping"]["target_errors"] = target.errors
+
+        samples = []
+        start = time.perf_counter()
+        for task_id in task_ids:
+            with Timer(samples):
+                await record_status(task_id, TaskStatus.COMPLETED)
+        await flush_all()
+        stages["status_write"] = stage(samples, time.perf_counter() - start)
+
+        names = {task_id: name for name, task_id in ids.items()}
+        end_to_end = [
+            (target.callbacks[names[task_id]] - started) * 1000
+            for task_id, started in timer.ping_started.items() if names[task_id] in target.callbacks
+        ]
+        stages["callback"] = stage(timer.samples[deliver_callback.actor_name], callback_elapsed)
+        stages["callback"]["end_to_end_ms"] = summarize(end_to_end)
+        stages["callback"]["missing"] = len(task_ids) - len(end_to_end)
+
+    await target.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=500, help="逐个创建的任务数")
+    parser.add_argument("--concurrency", type=int, default=10, help="逐个创建时的并发请求数")
+    parser.add_argument("--bulk-batches", type=int, default=20, help="批量创建的请求数")
+    parser.add_argument("--bulk-size", type=int, default=100, help="每个批量请求的任务数")
+    parser.add_argument("--pings", type=int, default=0, help="执行ping的任务数，0 表示所有创建的任务")
+    parser.add_argument("--threads", type=int, default=8, help="Dramatiq worker 线程数")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="目标服务的响应延迟")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="目标服务返回500的比例")
+    parser.add_argument("--status-mode", choices=("sync", "buffered"), default=Config.STATUS_WRITE_MODE,
+                        help="STATUS_WRITE_MODE")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="把结果保存为JSON")
+    args = parser.parse_args()
+    result = asyncio.run(run(args))
+    if args.output:
+        save_results(args.output, result)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""APScheduler 容量：AsyncIOScheduler 在 1万/10万/100万 个cron任务时的表现
+
+与生产相同，任务函数是 trigger_cron_task，参数为 [task_id, user_id, lane]，每个任务单独构造 CronTrigger。
+分别使用 MemoryJobStore 和 RedisJobStore，对每个任务数测量：
+
+- add / remove：逐个 add_job、remove_job 的吞吐量；
+- wakeup：没有到期任务时一次唤醒（_process_jobs：取出到期任务并计算下一次唤醒时间）的耗时；
+- fire：在已有任务之外再让 --fire-jobs 个任务同时到期，从到期（或恢复调度器）到 trigger_cron_task
+  执行完的延迟，以及超过 misfire_grace_time 被跳过的次数；
+- memory：用 tracemalloc 统计前 --memory-jobs 个任务的进程内存，RedisJobStore 连接真实服务时另外统计
+  Redis 的 used_memory 增量::
+
+    python -m benchmarks.scheduler_jobs --jobs 10000,100000,1000000 --output scheduler.json
+
+已有任务的下一次触发时间设在一天之后，测量期间不会到期。RedisJobStore 使用 --redis-url 指定的服务
+（--key 前缀的键，结束时清空）；连接不上时使用 fakeredis（需要单独安装），也没有 fakeredis 时跳过。
+trigger_cron_task 在使用 StubBroker 和临时SQLite数据库的进程内应用中执行。
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_MISSED
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.redis import RedisJobStore
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
+from redis.connection import parse_url
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from benchmarks.common import running_app, save_results, summarize
+from benchmarks.cron_engine import TIMEZONE, generate_expressions
+from scheduler_service.config import Config
+from scheduler_service.service.request import trigger_cron_task
+
+
+def create_jobstore(store: str, args):
+    """返回 (任务存储, Redis服务名称)，Redis不可用且没有 fakeredis 时返回 (None, 原因)"""
+    if store == "memory":
+        return MemoryJobStore(), None
+    jobstore = RedisJobStore(jobs_key=f"{args.key}.jobs", run_times_key=f"{args.key}.run_times",
+                             **parse_url(args.redis_url))
+    try:
+        jobstore.redis.ping()
+        return jobstore, "redis"
+    except RedisConnectionError:
+        pass
+    try:
+        import fakeredis
+    except ImportError:
+        return None, f"Redis at {args.redis_url} is not reachable and fakeredis is not installed"
+    jobstore.redis = fakeredis.FakeStrictRedis()
+    return jobstore, "fakeredis"
+
+
+def create_scheduler(jobstore) -> AsyncIOScheduler:
+    # 与 scheduler_service 创建的调度器使用相同的任务默认值和时区
+    scheduler = AsyncIOScheduler(
+        jobstores={'default': jobstore}, timezone=TIMEZONE,
+        job_defaults={'misfire_grace_time': Config.SCHEDULER_MISFIRE_GRACE_TIME, 'coalesce': True},
+    )
+    scheduler.start(paused=True)
+    return scheduler
+
+
+def add_jobs(scheduler, crons, offset: int = 0, next_run_time=None) -> list:
+    """逐个添加cron任务，返回任务ID"""
+    return [
+        scheduler.add_job(trigger_cron_task, CronTrigger.from_crontab(cron, timezone=TIMEZONE),
+                          args=[offset + i, 1, None], next_run_time=next_run_time).id
+        for i, cron in enumerate(crons)
+    ]
+
+
+def measure_memory(store: str, crons, args) -> dict:
+    """添加任务后的进程内存增量（每个任务的字节数）"""
+    jobstore, server = create_jobstore(store, args)
+    scheduler = create_scheduler(jobstore)
+    later = datetime.now(scheduler.timezone) + timedelta(days=1)
+    redis_before = jobstore.redis.info("memory")["used_memory"] if server == "redis" else None
+    tracemalloc.start()
+    try:
+        add_jobs(scheduler, crons, next_run_time=later)
+        traced = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    result = {"memory_bytes_per_job": traced / len(crons)}
+    if redis_before is not None:
+        result["redis_bytes_per_job"] = (jobstore.redis.info("memory")["used_memory"] - redis_before) / len(crons)
+    scheduler.remove_all_jobs()
+    scheduler.shutdown(wait=False)
+    return result
+
+
+def measure_wakeups(scheduler, count: int) -> dict:
+    """没有到期任务时的唤醒耗时（毫秒）"""
+    samples = []
+    scheduler.resume()
+    for _ in range(count):
+        start = time.perf_counter()
+        scheduler._process_jobs()
+        samples.append((time.perf_counter() - start) * 1000)
+    scheduler.pause()
+    return summarize(samples)
+
+
+async def measure_fire(scheduler, count: int, args) -> dict:
+    """恢复调度器，统计已添加的一批任务从到期到执行完的延迟（毫秒）"""
+    lags = []
+    missed = []
+    resumed = time.time()
+
+    def listener(event):
+        if event.code == EVENT_JOB_MISSED:
+            missed.append(event.job_id)
+            return
+        # 添加任务比 --fire-delay 慢时，从恢复调度器开始计算
+        due = max(event.scheduled_run_time.timestamp(), resumed)
+        lags.append((time.time() - due) * 1000)
+
+    scheduler.add_listener(listener, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+    scheduler.resume()
+    deadline = time.monotonic() + args.fire_delay + args.fire_timeout
+    while len(lags) + len(missed) < count and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    scheduler.pause()
+    scheduler.remove_listener(listener)
+    return {**summarize(lags), "fired": len(lags), "missed": len(missed)}
+
+
+async def run_size(store: str, crons, args) -> dict:
+    jobstore, server = create_jobstore(store, args)
+    scheduler = create_scheduler(jobstore)
+    result = {"jobstore": server or store, "jobs": len(crons)}
+    # 已有任务一天后才到期，wakeup 和 fire 只受任务数量影响
+    later = datetime.now(scheduler.timezone) + timedelta(days=1)
+    try:
+        start = time.perf_counter()
+        job_ids = add_jobs(scheduler, crons, next_run_time=later)
+        elapsed = time.perf_counter() - start
+        result["add"] = {"per_s": len(crons) / elapsed, "us_per_job": elapsed / len(crons) * 1e6}
+
+        result["wakeup_ms"] = measure_wakeups(scheduler, args.wakeups)
+        fire_crons = crons[:args.fire_jobs]
+        due = datetime.now(scheduler.timezone) + timedelta(seconds=args.fire_delay)
+        job_ids.extend(add_jobs(scheduler, fire_crons, len(crons), next_run_time=due))
+        result["fire_lag_ms"] = await measure_fire(scheduler, len(fire_crons), args)
+
+        start = time.perf_counter()
+        for job_id in job_ids:
+            scheduler.remove_job(job_id)
+        elapsed = time.perf_counter() - start
+        result["remove"] = {"per_s": len(job_ids) / elapsed, "us_per_job": elapsed / len(job_ids) * 1e6}
+    finally:
+        scheduler.remove_all_jobs()
+        scheduler.shutdown(wait=False)
+
+    result.update(measure_memory(store, crons[:args.memory_jobs], args))
+    return result
+
+
+async def run(args) -> dict:
+    expressions = generate_expressions(args.expressions, args.seed)
+    rng = random.Random(args.seed)
+    sizes = [int(size) for size in args.jobs.split(",")]
+    crons = [rng.choice(expressions) for _ in range(max(sizes))]
+    result = {"config": {key: value for key, value in vars(args).items() if key != "output"}}
+
+    async with running_app():
+        for store in args.stores.split(","):
+            jobstore, reason = create_jobstore(store, args)
+            if jobstore is None:
+                print(f"Skipping {store}: {reason}", file=sys.stderr)
+                result[store] = {"skipped": reason}
+                continue
+            result[store] = {str(size): await run_size(store, crons[:size], args) for size in sizes}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", default="10000,100000", help="逗号分隔的任务数")
+    parser.add_argument("--stores", default="memory,redis", help="逗号分隔的任务存储：memory、redis")
+    parser.add_argument("--expressions", type=int, default=1000, help="不同的cron表达式数")
+    parser.add_argument("--wakeups", type=int, default=20, help="测量唤醒耗时的次数")
+    parser.add_argument("--fire-jobs", type=int, default=1000, help="同时到期的任务数")
+    parser.add_argument("--fire-delay", type=float, default=1.0, help="添加后多少秒到期")
+    parser.add_argument("--fire-timeout", type=float, default=120.0, help="等待执行完的最长秒数")
+    parser.add_argument("--memory-jobs", type=int, default=10000, help="统计内存时添加的任务数")
+    parser.add_argument("--redis-url", default=Config.REDIS_URL, help="RedisJobStore 使用的Redis")
+    parser.add_argument("--key", default="scheduler:bench:jobs", help="RedisJobStore 键前缀")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="把结果保存为JSON")
+    args = parser.parse_args()
+    result = asyncio.run(run(args))
+    if args.output:
+        save_results(args.output, result)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
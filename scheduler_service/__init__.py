@@ -13,6 +13,8 @@ from tortoise.exceptions import ConfigurationError
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.jobstores.redis import RedisJobStore
 from apscheduler.jobstores.memory import MemoryJobStore
+from scheduler_service.utils.buffer import BufferFlushMiddleware
+from scheduler_service.utils.cronengine import NativeScheduler
 from scheduler_service.utils.logger import logger
 from scheduler_service.config import Config
 
@@ -50,6 +52,7 @@ def generate_broker(config):
         broker.emit_after("process_boot")
         # Add AsyncIO middleware (needed for async actors)
         broker.add_middleware(AsyncIO())
+        broker.add_middleware(BufferFlushMiddleware(), before=AsyncIO)
         # Test mode typically doesn't need Abortable unless mocking backend
         return broker
     else:
@@ -67,6 +70,8 @@ def generate_broker(config):
 
         # Add Middleware
         broker.add_middleware(AsyncIO())
+        # 在事件循环停止前刷写写后缓冲区
+        broker.add_middleware(BufferFlushMiddleware(), before=AsyncIO)
 
         # Abortable Middleware
         try:
@@ -90,13 +95,30 @@ scheduler: AsyncIOScheduler = None
 
 
 def get_scheduler() -> AsyncIOScheduler:
-    """获取APScheduler实例，如果未初始化则抛出错误"""
+    """获取调度器实例（APScheduler 或 NativeScheduler），如果未初始化则抛出错误"""
     global scheduler
     if scheduler is None:
         raise RuntimeError("APScheduler has not been initialized. Call setup_dramatiq first.")
     return scheduler
 
 
+def _job_defaults() -> dict:
+    # 调度器暂停（领导者切换）期间错过的触发，在宽限时间内恢复后合并补发一次
+    return {'misfire_grace_time': Config.SCHEDULER_MISFIRE_GRACE_TIME, 'coalesce': True}
+
+
+def _create_scheduler(config, jobstores: dict = None):
+    """按 SCHEDULER_ENGINE 创建调度器，NativeScheduler 的任务由 service.cronsync 从数据库加载"""
+    if config.get("SCHEDULER_ENGINE", Config.SCHEDULER_ENGINE) == "native":
+        return NativeScheduler(
+            job_defaults=_job_defaults(), timezone="Asia/Shanghai",
+            fire_batch_size=config.get("CRON_ENGINE_FIRE_BATCH_SIZE", Config.CRON_ENGINE_FIRE_BATCH_SIZE)
+        )
+    if jobstores:
+        return AsyncIOScheduler(jobstores=jobstores, job_defaults=_job_defaults(), timezone="Asia/Shanghai")
+    return AsyncIOScheduler(job_defaults=_job_defaults(), timezone="Asia/Shanghai")
+
+
 # --- Setup Functions ---
 def setup_dramatiq(config):
     """
@@ -107,8 +129,7 @@ def setup_dramatiq(config):
 
     if os.getenv("UNIT_TESTS") == "1":
         # --- [测试模式] ---
-        jobstores = {'default': MemoryJobStore()}
-        scheduler = AsyncIOScheduler(jobstores=jobstores, timezone="Asia/Shanghai")
+        scheduler = _create_scheduler(config, {'default': MemoryJobStore()})
 
     else:
         # --- [生产模式] ---
@@ -117,11 +138,8 @@ def setup_dramatiq(config):
         broker = current_broker # 更新模块级变量
 
         redis_url = config.get("REDIS_URL")
-        if redis_url:
-            jobstores = {'default': _get_redis_job_store(redis_url)}
-            scheduler = AsyncIOScheduler(jobstores=jobstores, timezone="Asia/Shanghai")
-        else:
-            scheduler = AsyncIOScheduler(timezone="Asia/Shanghai")
+        jobstores = {'default': _get_redis_job_store(redis_url)} if redis_url else None
+        scheduler = _create_scheduler(config, jobstores)
 
 
 def close_dramatiq():
@@ -1,7 +1,7 @@
 """API模块初始化"""
 from fastapi import APIRouter
 
-from scheduler_service.api.v1 import task, user
+from scheduler_service.api.v1 import metrics, task, user
 
 
 def setup_routes(app):
@@ -12,6 +12,7 @@ def setup_routes(app):
     # 注册v1版本路由
     api_router.include_router(task.router, prefix="/tasks", tags=["tasks"])
     api_router.include_router(user.router, prefix="/users", tags=["users"])
+    api_router.include_router(metrics.router, prefix="/metrics", tags=["metrics"])
 
     # 将API路由器注册到应用
     app.include_router(api_router, prefix="/api/v1")
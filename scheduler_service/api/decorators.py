@@ -3,6 +3,7 @@ from typing import Optional
 from fastapi import Depends, HTTPException, Request, status  # Added Request
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
+from scheduler_service.api.user_cache import get_user
 from scheduler_service.models import User
 
 # 创建Bearer认证方案
@@ -22,11 +23,13 @@ async def login_require(
         )
     token = credentials.credentials
     secret_key = request.app.config.get("SECRET_KEY") # Retrieve secret_key
-    print(f"DEBUG: get_current_user using secret_key: {secret_key}") # Temporary print for debugging
 
-    # 从token中验证用户
-    # 这里需要调整User.verify_auth_token方法以适应FastAPI
-    user = await User.verify_auth_token(token, secret_key) # Pass secret_key
+    # 从token中验证用户，已验证的用户优先从缓存读取
+    if request.app.config.get("USER_CACHE_ENABLED", True):
+        user_id = User.decode_auth_token(token, secret_key)
+        user = await get_user(user_id, token) if user_id is not None else None
+    else:
+        user = await User.verify_auth_token(token, secret_key) # Pass secret_key
 
     if not user:
         raise HTTPException(
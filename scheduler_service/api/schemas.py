@@ -3,6 +3,8 @@ from typing import Literal, Optional
 
 from pydantic import BaseModel, ConfigDict, field_validator
 
+from scheduler_service.config import Config
+
 # 定义有效的HTTP方法
 VALID_HTTP_METHODS = ['GET', 'POST', 'PUT', 'DELETE', 'PATCH', 'HEAD', 'OPTIONS']
 
@@ -19,6 +21,15 @@ class RequestTaskCreate(BaseModel):
     callback_token: Optional[str] = None  # 用于callback_url登录的token
     body: Optional[dict] = None  # HTTP请求体
     cron: Optional[str] = None # cron 表达式
+    lane: Optional[str] = None  # 执行通道，见 Config.PING_LANES
+
+    @field_validator('lane')
+    @classmethod
+    def validate_lane(cls, v):
+        lanes = ['default', *Config.PING_LANES]
+        if v is not None and v not in lanes:
+            raise ValueError(f"Invalid lane: {v}. Must be one of {lanes}")
+        return v
 
     @field_validator('method')
     @classmethod
@@ -45,5 +56,6 @@ class RequestTaskResponse(BaseModel):
     job_id: Optional[str] = None # APScheduler Job ID
     status: str = "PENDING"
     error_message: Optional[str] = None
+    lane: Optional[str] = None
 
     model_config = ConfigDict(from_attributes=True)
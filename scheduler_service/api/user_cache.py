@@ -0,0 +1,94 @@
+"""已认证用户的进程内缓存
+
+login_require 每次请求都要根据token查一次用户表，这里按 (用户ID, token指纹)
+缓存校验通过的用户。用户信息变更或删除时，通过 Redis pub/sub 通知所有
+uvicorn worker 丢弃对应的缓存。
+
+缓存中保存的是用户字段值的不可变快照，每次命中都构造新的 User 实例，
+并发请求之间不会共享同一个可修改的模型对象。
+"""
+import asyncio
+import hashlib
+import os
+from typing import Optional
+
+from scheduler_service.config import Config
+from scheduler_service.models import User
+from scheduler_service.utils.cache import TTLCache
+from scheduler_service.utils.logger import logger
+from scheduler_service.utils.metrics import register_collector
+from scheduler_service.utils.redis import get_redis
+
+user_cache = TTLCache(maxsize=Config.USER_CACHE_SIZE, ttl=Config.USER_CACHE_TTL)
+register_collector("user_cache", user_cache.stats)
+
+
+def setup_user_cache(config: dict):
+    """应用启动时按应用配置设置缓存容量和过期时间，并清空缓存（数据库重新初始化后缓存的用户可能已失效）"""
+    user_cache.maxsize = config.get("USER_CACHE_SIZE", Config.USER_CACHE_SIZE)
+    user_cache.ttl = config.get("USER_CACHE_TTL", Config.USER_CACHE_TTL)
+    user_cache.clear()
+
+
+def token_fingerprint(token: str) -> str:
+    """token指纹，避免在内存中以明文作为key保存token"""
+    return hashlib.sha256(token.encode()).hexdigest()[:32]
+
+
+def _snapshot(user: User) -> tuple:
+    return tuple((name, getattr(user, name)) for name in User._meta.fields_db_projection)
+
+
+async def get_user(user_id: int, token: str) -> Optional[User]:
+    """按用户ID获取用户，优先读取缓存；每次返回新的实例"""
+    key = (user_id, token_fingerprint(token))
+    snapshot = user_cache.get(key)
+    if snapshot is not None:
+        return User._init_from_db(**dict(snapshot))
+
+    user = await User.get_or_none(id=user_id)
+    if user is not None:
+        user_cache.set(key, _snapshot(user))
+    return user
+
+
+def invalidate_user(user_id: int) -> int:
+    """丢弃本进程内该用户的所有缓存"""
+    return user_cache.evict(lambda key: key[0] == user_id)
+
+
+async def publish_user_invalidation(user_id: int):
+    """丢弃本进程缓存，并通知其他进程丢弃该用户的缓存"""
+    invalidate_user(user_id)
+    if os.getenv("UNIT_TESTS") == "1":
+        return
+    try:
+        await get_redis().publish(Config.USER_CACHE_CHANNEL, str(user_id))
+    except Exception as e:
+        # 通知失败时其他进程的缓存最多在TTL后过期
+        logger.warning("Failed to publish user invalidation for %s: %s", user_id, e)
+
+
+async def listen_user_invalidation():
+    """订阅用户缓存失效通知，断线后自动重连"""
+    while True:
+        try:
+            pubsub = get_redis().pubsub()
+            await pubsub.subscribe(Config.USER_CACHE_CHANNEL)
+            try:
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    try:
+                        invalidate_user(int(message["data"]))
+                    except (TypeError, ValueError):
+                        logger.warning("Invalid user invalidation message: %r", message["data"])
+            finally:
+                await pubsub.aclose()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("User invalidation listener error: %s", e)
+            # 断线期间无法收到通知，清空缓存以免使用过期数据
+            user_cache.clear()
+            await asyncio.sleep(1)
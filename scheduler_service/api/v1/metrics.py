@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Depends
+
+from scheduler_service.api.decorators import login_require
+from scheduler_service.models import User
+from scheduler_service.utils.metrics import collect
+
+
+async def get_metrics(current_user: User = Depends(login_require)):
+    """获取当前进程的运行指标（包含按用户和按主机的统计，需要登录）"""
+    return await collect()
+
+
+router = APIRouter()
+
+router.add_api_route("", get_metrics, methods=["GET"])
@@ -1,17 +1,87 @@
+import json
 import time
+import uuid
+import zlib
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.jobstores.base import JobLookupError
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from dramatiq_abort import abort
+from tortoise.transactions import in_transaction
 
 from scheduler_service import get_scheduler
 from scheduler_service.api.decorators import login_require
 from scheduler_service.api.schemas import RequestTaskCreate
-from scheduler_service.models import RequestTask, User
-from scheduler_service.service.request import ping, trigger_cron_task
+from scheduler_service.config import Config, CustomJsonEncoder
+from scheduler_service.models import RUN_FIELDS, TASK_FIELDS, RequestTask, TaskRun, User
+from scheduler_service.service.counters import merge_cron_counts
+from scheduler_service.service.crongroup import add_tasks as add_cron_tasks
+from scheduler_service.service.crongroup import is_group_job
+from scheduler_service.service.crongroup import remove_tasks as remove_cron_tasks
+from scheduler_service.service.cronsync import publish_removed
+from scheduler_service.service.delayqueue import cancel_pings, is_delayed, schedule_pings
+from scheduler_service.service.fairqueue import QueueQuotaExceeded, enqueue_pings
+from scheduler_service.service.leader import registers_jobs
+from scheduler_service.service.request import DEFAULT_LANE, lane_actor, ping, trigger_cron_task
+
+
+def _build_trigger(cron: str) -> CronTrigger:
+    """验证并创建cron触发器"""
+    try:
+        return CronTrigger.from_crontab(cron)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid cron expression: {str(e)}"
+        )
+
+
+def _new_task(task_data: RequestTaskCreate, user_id: int) -> RequestTask:
+    """根据请求数据构造任务（未保存）"""
+    return RequestTask(
+        name=task_data.name,
+        user_id=user_id,
+        start_time=datetime.fromtimestamp(task_data.start_time),
+        request_url=task_data.request_url,
+        callback_url=task_data.callback_url,
+        callback_token=task_data.callback_token,
+        header=task_data.header,
+        method=task_data.method,
+        body=task_data.body if task_data.body is not None else {},
+        cron=task_data.cron,
+        lane=task_data.lane
+    )
+
+
+def _is_due(start_time: float) -> bool:
+    return int(start_time * 1000) <= int(time.time() * 1000)
+
+
+def _is_fair_queued(task: RequestTask, start_time: float) -> bool:
+    """开启公平调度时，默认通道中立即执行的一次性任务进入用户子队列"""
+    return (Config.FAIR_QUEUE_ENABLED and not task.cron and _is_due(start_time)
+            and (task.lane or DEFAULT_LANE) == DEFAULT_LANE)
+
+
+def _send_ping(task_id: int, start_time: float, lane: str = None):
+    """发送一次性任务到其通道，start_time 在未来时延迟发送"""
+    actor = lane_actor(lane) if lane else ping
+    if not _is_due(start_time):
+        # 如果是未来时间，使用 eta 延迟发送
+        return actor.send_with_options(args=[task_id], eta=int(start_time * 1000))
+    # 否则立即发送
+    return actor.send(task_id)
+
+
+def _add_cron_job(scheduler, trigger: CronTrigger, args: list):
+    """注册cron任务，返回 (调度任务, job_id)；本进程不注册任务时（见 registers_jobs）只分配 job_id"""
+    if not registers_jobs(scheduler):
+        return None, uuid.uuid4().hex
+    job = scheduler.add_job(trigger_cron_task, trigger, args=args)
+    return job, job.id
 
 
 async def _create_single_task(task_data: RequestTaskCreate, user_id: int) -> RequestTask:
@@ -27,50 +97,179 @@ async def _create_single_task(task_data: RequestTaskCreate, user_id: int) -> Req
         header=task_data.header,
         method=task_data.method,
         body=task_data.body if task_data.body is not None else {},
-        cron=task_data.cron
+        cron=task_data.cron,
+        lane=task_data.lane
     )
 
     # 如果设置了cron，添加到调度器
     if task.cron:
         try:
-            scheduler = get_scheduler()
-            # 验证并创建cron触发器
-            trigger = CronTrigger.from_crontab(task.cron)
-            job = scheduler.add_job(trigger_cron_task, trigger, args=[task.id])
-            task.job_id = job.id
-        except ValueError as e:
+            trigger = _build_trigger(task.cron)
+        except HTTPException:
             # 如果cron表达式无效，删除已创建的任务并抛出异常
             await task.delete()
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Invalid cron expression: {str(e)}"
-            )
+            raise
+        scheduler = get_scheduler()
+        if Config.CRON_GROUPED:
+            # 加入相同表达式的分组，不单独注册调度任务
+            task.job_id = (await add_cron_tasks(scheduler, [task], [trigger]))[0]
+        else:
+            _, task.job_id = _add_cron_job(scheduler, trigger, [task.id, user_id, task.lane])
+    elif _is_fair_queued(task, task_data.start_time):
+        # 立即执行的任务进入用户子队列，由公平调度器发送
+        try:
+            await enqueue_pings(user_id, [task.id])
+        except QueueQuotaExceeded:
+            await task.delete()
+            raise
+    elif is_delayed(task_data.start_time):
+        # 远期任务进入延迟队列，临近执行时才发送到Dramatiq
+        await schedule_pings([(task.id, task.lane, task_data.start_time)])
     else:
         # 如果没有设置cron，则检查 start_time 是否在未来
-        eta_ms = int(task_data.start_time * 1000)
-        current_ms = int(time.time() * 1000)
-        
-        if eta_ms > current_ms:
-            # 如果是未来时间，使用 eta 延迟发送
-            message = ping.send_with_options(args=[task.id], eta=eta_ms)
-        else:
-            # 否则立即发送
-            message = ping.send(task.id)
-            
+        message = _send_ping(task.id, task_data.start_time, task.lane)
         task.message_id = message.message_id
 
     await task.save()
     return task
 
 
-async def get_tasks(current_user: User = Depends(login_require)):
-    """获取当前用户的所有请求任务"""
-    tasks = await RequestTask.filter(user_id=current_user.id)
+async def _rollback_bulk(tasks: List[RequestTask], jobs: list, messages: list, delayed: list = ()):
+    """批量创建失败时撤销已注册的定时任务、已发送的消息、延迟队列中的任务和已插入的记录"""
+    scheduler = get_scheduler()
+    for job in jobs:
+        try:
+            scheduler.remove_job(job.id)
+        except Exception:
+            pass
+    try:
+        await remove_cron_tasks([task for task in tasks if is_group_job(task.job_id)])
+    except Exception:
+        pass
+    for message in messages:
+        try:
+            abort(message.message_id)
+        except Exception:
+            pass
+    try:
+        await cancel_pings([(task_id, lane) for task_id, lane, _ in delayed])
+    except Exception:
+        pass
+    await RequestTask.filter(id__in=[task.id for task in tasks]).delete()
+
+
+def _parse_fields(fields: Optional[str]) -> List[str]:
+    """解析字段投影参数，结果总是包含用作游标的 id"""
+    if not fields:
+        return list(TASK_FIELDS)
+
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    invalid = [name for name in names if name not in TASK_FIELDS]
+    if invalid:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid fields: {', '.join(invalid)}"
+        )
+    if 'id' not in names:
+        names.insert(0, 'id')
+    return names
+
+
+def _filter_tasks(user_id: int, task_status: Optional[str] = None, has_cron: Optional[bool] = None,
+                  start_time_from: Optional[float] = None, start_time_to: Optional[float] = None):
+    """构造当前用户任务的查询条件"""
+    queryset = RequestTask.filter(user_id=user_id)
+    if task_status:
+        queryset = queryset.filter(status=task_status.upper())
+    if has_cron is not None:
+        queryset = queryset.filter(cron__isnull=not has_cron)
+    if start_time_from is not None:
+        queryset = queryset.filter(start_time__gte=datetime.fromtimestamp(start_time_from))
+    if start_time_to is not None:
+        queryset = queryset.filter(start_time__lt=datetime.fromtimestamp(start_time_to))
+    return queryset
+
+
+async def get_tasks(
+    cursor: Optional[int] = Query(None, description="上一页返回的 next_cursor"),
+    limit: int = Query(100, ge=1, le=1000),
+    task_status: Optional[str] = Query(None, alias="status"),
+    has_cron: Optional[bool] = Query(None, description="true 只返回cron任务，false 只返回一次性任务"),
+    start_time_from: Optional[float] = Query(None, description="start_time 下限（含），时间戳"),
+    start_time_to: Optional[float] = Query(None, description="start_time 上限（不含），时间戳"),
+    fields: Optional[str] = Query(None, description="逗号分隔的返回字段"),
+    fetch_all: bool = Query(False, alias="all", description="不分页，返回所有匹配的任务"),
+    current_user: User = Depends(login_require)
+):
+    """获取当前用户的请求任务（按 id 游标分页）"""
+    names = _parse_fields(fields)
+    queryset = _filter_tasks(current_user.id, task_status, has_cron, start_time_from, start_time_to)
+
+    if fetch_all:
+        return {
+            "tasks": await merge_cron_counts(await queryset.order_by('id').values(*names)),
+            "next_cursor": None
+        }
+
+    if cursor is not None:
+        queryset = queryset.filter(id__gt=cursor)
+    # 多取一条用于判断是否还有下一页
+    tasks = await queryset.order_by('id').limit(limit + 1).values(*names)
+    next_cursor = None
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        next_cursor = tasks[-1]['id']
+
     return {
-        "tasks": [t.to_dict() for t in tasks]
+        "tasks": await merge_cron_counts(tasks),
+        "next_cursor": next_cursor
     }
 
 
+async def _iter_task_chunks(queryset, names: List[str], chunk_size: int):
+    """按 id 游标分块读取任务，每次只在内存中保留一块"""
+    last_id = None
+    while True:
+        chunk_queryset = queryset if last_id is None else queryset.filter(id__gt=last_id)
+        rows = await chunk_queryset.order_by('id').limit(chunk_size).values(*names)
+        if rows:
+            yield await merge_cron_counts(rows)
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1]['id']
+
+
+async def export_tasks(
+    task_status: Optional[str] = Query(None, alias="status"),
+    has_cron: Optional[bool] = None,
+    start_time_from: Optional[float] = None,
+    start_time_to: Optional[float] = None,
+    fields: Optional[str] = None,
+    chunk_size: int = Query(1000, ge=1, le=10000, description="每次从数据库读取的行数"),
+    gzip: bool = Query(False, description="使用gzip压缩响应"),
+    current_user: User = Depends(login_require)
+):
+    """以NDJSON流式导出当前用户的所有任务"""
+    names = _parse_fields(fields)
+    queryset = _filter_tasks(current_user.id, task_status, has_cron, start_time_from, start_time_to)
+
+    async def generate():
+        compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if gzip else None
+        async for rows in _iter_task_chunks(queryset, names, chunk_size):
+            data = "".join(
+                json.dumps(row, cls=CustomJsonEncoder, ensure_ascii=False) + "\n" for row in rows
+            ).encode("utf-8")
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                yield data
+        if compressor:
+            yield compressor.flush()
+
+    headers = {"Content-Encoding": "gzip"} if gzip else None
+    return StreamingResponse(generate(), media_type="application/x-ndjson", headers=headers)
+
+
 async def create_task(task_data: RequestTaskCreate, current_user: User = Depends(login_require)):
     """创建新请求任务"""
     task = await _create_single_task(task_data, current_user.id)
@@ -80,16 +279,73 @@ async def create_task(task_data: RequestTaskCreate, current_user: User = Depends
 
 
 async def bulk_create_task(tasks_data: List[RequestTaskCreate], current_user: User = Depends(login_require)):
-    """批量创建请求任务"""
-    task_ids = []
-    # 简单的循环创建。如果需要更高的性能，可以考虑 Tortoise 的 bulk_create，
-    # 但因为每个任务都需要单独处理调度和消息队列，简单的循环更容易维护且逻辑正确。
-    for task_data in tasks_data:
-        task = await _create_single_task(task_data, current_user.id)
-        task_ids.append(task.id)
-    
+    """
+    批量创建请求任务。
+
+    1. 校验所有任务并用一条多行INSERT写入数据库
+    2. 注册cron任务到调度器，在同一个事务中用一条批量UPDATE回写 job_id
+    3. 提交后发送一次性任务消息（开启公平调度时立即执行的任务整批进入用户子队列，远期任务整批进入延迟队列）
+    4. 用一条批量UPDATE回写 message_id
+
+    cron任务先于消息注册：调度器中的任务可以无副作用地撤销，而消息一旦被消费则无法撤销。
+    消息在提交之后发送，worker 认领时任务一定已经可见。
+    任一阶段失败都会撤销之前的阶段。进程在提交前崩溃时不会留下 job_id 为空的任务，
+    只可能在任务存储中留下多余的调度任务，由对账（`scheduler reconcile`）删除。
+    """
+    if not tasks_data:
+        return {'task_ids': []}
+
+    triggers = [_build_trigger(task_data.cron) if task_data.cron else None for task_data in tasks_data]
+    tasks = [_new_task(task_data, current_user.id) for task_data in tasks_data]
+    jobs, messages, delayed = [], [], []
+    try:
+        async with in_transaction() as connection:
+            # 阶段1：校验并批量插入
+            await RequestTask.bulk_insert(tasks, using_db=connection)
+
+            # 阶段2：注册cron任务并回写 job_id
+            scheduler = get_scheduler()
+            if Config.CRON_GROUPED:
+                cron_tasks = [(task, trigger) for task, trigger in zip(tasks, triggers) if trigger]
+                job_ids = await add_cron_tasks(scheduler, *zip(*cron_tasks)) if cron_tasks else []
+                for (task, _), job_id in zip(cron_tasks, job_ids):
+                    task.job_id = job_id
+            else:
+                for task, trigger in zip(tasks, triggers):
+                    if trigger:
+                        job, task.job_id = _add_cron_job(scheduler, trigger, [task.id, current_user.id, task.lane])
+                        if job:
+                            jobs.append(job)
+            assigned = [task for task in tasks if task.job_id]
+            if assigned:
+                await RequestTask.bulk_update(assigned, fields=['job_id'], using_db=connection)
+
+        # 阶段3：发送一次性任务
+        fair_ids = [task.id for task, task_data in zip(tasks, tasks_data)
+                    if _is_fair_queued(task, task_data.start_time)]
+        await enqueue_pings(current_user.id, fair_ids)
+        fair_ids = set(fair_ids)
+        for task, task_data in zip(tasks, tasks_data):
+            if task.cron or task.id in fair_ids:
+                continue
+            if is_delayed(task_data.start_time):
+                delayed.append((task.id, task.lane, task_data.start_time))
+            else:
+                message = _send_ping(task.id, task_data.start_time, task.lane)
+                messages.append(message)
+                task.message_id = message.message_id
+        await schedule_pings(delayed)
+
+        # 阶段4：回写 message_id
+        sent = [task for task in tasks if task.message_id]
+        if sent:
+            await RequestTask.bulk_update(sent, fields=['message_id'])
+    except Exception:
+        await _rollback_bulk(tasks, jobs, messages, delayed)
+        raise
+
     return {
-        'task_ids': task_ids
+        'task_ids': [task.id for task in tasks]
     }
 
 
@@ -103,7 +359,44 @@ async def get_task(task_id: int, current_user: User = Depends(login_require)):
             detail="请求任务不存在"
         )
 
-    return task.to_dict()
+    # 加上尚未写回数据库的循环计数
+    return (await merge_cron_counts([task.to_dict()]))[0]
+
+
+async def get_task_runs(
+    task_id: int,
+    cursor: Optional[int] = Query(None, description="上一页返回的 next_cursor"),
+    limit: int = Query(100, ge=1, le=1000),
+    started_from: Optional[float] = Query(None, description="started_at 下限（含），时间戳"),
+    started_to: Optional[float] = Query(None, description="started_at 上限（不含），时间戳"),
+    current_user: User = Depends(login_require)
+):
+    """获取任务的执行历史（从新到旧，按 id 游标分页）"""
+    if not await RequestTask.exists(id=task_id, user_id=current_user.id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="请求任务不存在"
+        )
+
+    queryset = TaskRun.filter(task_id=task_id)
+    # 指定时间范围时 PostgreSQL 只扫描相关的分区
+    if started_from is not None:
+        queryset = queryset.filter(started_at__gte=datetime.fromtimestamp(started_from))
+    if started_to is not None:
+        queryset = queryset.filter(started_at__lt=datetime.fromtimestamp(started_to))
+    if cursor is not None:
+        queryset = queryset.filter(id__lt=cursor)
+
+    runs = await queryset.order_by('-id').limit(limit + 1).values(*RUN_FIELDS)
+    next_cursor = None
+    if len(runs) > limit:
+        runs = runs[:limit]
+        next_cursor = runs[-1]['id']
+
+    return {
+        "runs": runs,
+        "next_cursor": next_cursor
+    }
 
 
 async def delete_task(task_id: int, current_user: User = Depends(login_require)):
@@ -123,9 +416,20 @@ async def delete_task(task_id: int, current_user: User = Depends(login_require))
         except Exception:
             # 忽略中止失败
             pass
+    elif not task.cron:
+        # 延迟队列中的远期任务
+        try:
+            await cancel_pings([(task.id, task.lane)])
+        except Exception:
+            pass
 
-    # 尝试从调度器移除循环任务
-    if task.job_id:
+    # 尝试从调度器移除循环任务（分组的任务只移出分组）
+    if is_group_job(task.job_id):
+        try:
+            await remove_cron_tasks([task])
+        except Exception:
+            pass
+    elif task.job_id:
         try:
             scheduler = get_scheduler()
             scheduler.remove_job(task.job_id)
@@ -137,6 +441,9 @@ async def delete_task(task_id: int, current_user: User = Depends(login_require))
             pass
 
     await task.delete()
+    # NativeScheduler 的任务在执行任务的进程内存中，通知其移除
+    if task.job_id and not is_group_job(task.job_id):
+        await publish_removed(get_scheduler(), [task.job_id])
     return None
 
 router = APIRouter()
@@ -144,5 +451,7 @@ router = APIRouter()
 router.add_api_route("", get_tasks, methods=["GET"])
 router.add_api_route("", create_task, methods=["POST"])
 router.add_api_route("/bulk", bulk_create_task, methods=["POST"])
+router.add_api_route("/export", export_tasks, methods=["GET"])
 router.add_api_route("/{task_id}", get_task, methods=["GET"])
+router.add_api_route("/{task_id}/runs", get_task_runs, methods=["GET"])
 router.add_api_route("/{task_id}", delete_task, methods=["DELETE"])
@@ -3,6 +3,7 @@ from pydantic import BaseModel, EmailStr
 from tortoise.exceptions import DoesNotExist, IntegrityError
 
 from scheduler_service.api.decorators import login_require
+from scheduler_service.api.user_cache import publish_user_invalidation
 from scheduler_service.models import User
 
 
@@ -53,7 +54,7 @@ async def create_user(user_data: UserCreate):
     """创建新用户"""
     try:
         # 创建用户
-        password_hash = User.hash_password(user_data.password)
+        password_hash = await User.hash_password_async(user_data.password)
         user = await User.create(
             name=user_data.name,
             password_hash=password_hash,
@@ -89,7 +90,7 @@ async def update_user(user_data: UserUpdate, current_user: User = Depends(login_
 
     # 处理密码更新
     if user_data.password:
-        update_data['password_hash'] = User.hash_password(user_data.password)
+        update_data['password_hash'] = await User.hash_password_async(user_data.password)
 
     # 处理其他字段更新
     if user_data.name:
@@ -100,6 +101,7 @@ async def update_user(user_data: UserUpdate, current_user: User = Depends(login_
     # 执行更新
     if update_data:
         await User.filter(id=current_user.id).update(**update_data)
+        await publish_user_invalidation(current_user.id)
         # 重新获取更新后的用户信息
         updated_user = await User.get(id=current_user.id)
         return updated_user.to_dict()
@@ -110,6 +112,7 @@ async def update_user(user_data: UserUpdate, current_user: User = Depends(login_
 async def delete_user(current_user: User = Depends(login_require)):
     """删除当前用户"""
     await current_user.delete()
+    await publish_user_invalidation(current_user.id)
     return {"message": "用户已删除"}
 
 
@@ -136,7 +139,7 @@ async def get_token(token_data: TokenRequest, request: Request):
         )
 
     # 验证密码
-    if not user.verify_password(token_data.password):
+    if not await user.verify_password_async(token_data.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="用户名或密码错误",
@@ -0,0 +1,91 @@
+"""独立的定时任务进程（`scheduler beat`）
+
+API 进程设置 SCHEDULER_RUN_JOBS = False 后，调度器以暂停状态启动，只向任务存储添加和删除任务，
+不执行任务。beat 进程运行唯一一个执行任务的调度器，API 可以任意扩容而不会重复触发。
+需要热备时开启 SCHEDULER_HA_ENABLED 并运行多个 beat 进程，由选举决定哪个进程执行任务。
+
+APScheduler 只在启动、本进程添加任务或下一次运行时间到达时检查任务存储，
+其他进程添加的任务需要定期唤醒（SCHEDULER_BEAT_POLL_MS）才能被发现。
+开启 FAIR_QUEUE_ENABLED 时公平调度的调度器也在 beat 中运行，多个 beat 进程由租约保证只有一个调度；
+延迟队列的调度器（DELAY_QUEUE_ENABLED）和cron循环计数的刷写（CRON_COUNT_MODE = "redis"）同样在 beat 中运行。
+SCHEDULER_ENGINE = "native" 时任务只在内存中，beat 每 CRON_ENGINE_SYNC_MS 从数据库加载新任务；
+否则启动时与数据库对账一次（CRON_RECONCILE_ON_STARTUP）。
+"""
+import asyncio
+import signal
+
+from scheduler_service import (close_dramatiq, close_tortoise, get_scheduler,
+                               setup_dramatiq, setup_tortoise)
+from scheduler_service.config import Config
+from scheduler_service.service.counters import run_flusher
+from scheduler_service.service.cronsync import start_sync
+from scheduler_service.service.delayqueue import run_dispatcher as run_delay_dispatcher
+from scheduler_service.service.fairqueue import run_dispatcher
+from scheduler_service.service.leader import start_scheduler
+from scheduler_service.service.reconcile import start_reconcile
+from scheduler_service.service.status import schedule_run_partitions
+from scheduler_service.utils.logger import logger
+from scheduler_service.utils.redis import close_redis
+
+
+async def beat_loop(scheduler, stop: asyncio.Event, poll_ms: int):
+    """定期唤醒调度器重新读取任务存储，直到 stop 被设置"""
+    while not stop.is_set():
+        scheduler.wakeup()
+        try:
+            await asyncio.wait_for(stop.wait(), poll_ms / 1000)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_beat(config: dict = None):
+    """初始化数据库和消息队列，运行调度器直到收到 SIGINT/SIGTERM"""
+    config = config or Config.to_dict()
+    await setup_tortoise(config)
+    setup_dramatiq(config)
+    scheduler = get_scheduler()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    # 开启高可用时多个beat进程中只有领导者执行任务
+    election = start_scheduler(scheduler)
+    # NativeScheduler 从数据库加载任务并定期同步
+    sync = start_sync(scheduler)
+    # 执行历史分区维护随任务在 beat 中执行（NativeScheduler 的任务不会从API进程共享过来）
+    schedule_run_partitions(scheduler)
+    # 修复任务存储中缺少或多余的cron任务
+    reconcile = None
+    if config.get("CRON_RECONCILE_ON_STARTUP", Config.CRON_RECONCILE_ON_STARTUP):
+        reconcile = start_reconcile(scheduler)
+    # 公平调度的调度器，多个进程中只有持有租约的一个调度
+    dispatcher = None
+    if config.get("FAIR_QUEUE_ENABLED", Config.FAIR_QUEUE_ENABLED):
+        dispatcher = asyncio.create_task(run_dispatcher())
+    # 延迟队列中即将到期的远期任务
+    delay_dispatcher = None
+    if config.get("DELAY_QUEUE_ENABLED", Config.DELAY_QUEUE_ENABLED):
+        delay_dispatcher = asyncio.create_task(run_delay_dispatcher())
+    # Redis中累计的cron循环计数
+    flusher = None
+    if config.get("CRON_COUNT_MODE", Config.CRON_COUNT_MODE) == "redis":
+        flusher = asyncio.create_task(run_flusher())
+    logger.info("Scheduler beat started with %d jobs", len(scheduler.get_jobs()))
+    try:
+        await beat_loop(scheduler, stop, config.get("SCHEDULER_BEAT_POLL_MS", Config.SCHEDULER_BEAT_POLL_MS))
+    finally:
+        logger.info("Scheduler beat stopping")
+        for task in (election, sync, reconcile, dispatcher, delay_dispatcher, flusher):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        if scheduler.running:
+            scheduler.shutdown()
+        close_dramatiq()
+        await close_redis()
+        await close_tortoise()
@@ -6,10 +6,13 @@ import click
 from aerich import Command
 from tortoise import Tortoise
 
-from scheduler_service import close_tortoise, setup_tortoise
+from scheduler_service import (close_dramatiq, close_tortoise, get_scheduler, setup_dramatiq,
+                               setup_tortoise)
 from scheduler_service.main import create_app
 from scheduler_service.config import Config, TORTOISE_ORM
-from scheduler_service.models import User
+from scheduler_service.models import TASK_INDEXES, RequestTask, User
+from scheduler_service.models.run import maintain_partitions, setup_partitioning
+from scheduler_service.models.sql import build_indexes_concurrently
 
 
 @click.group()
@@ -58,7 +61,11 @@ def runserver(host, port, workers, debug, access_log):
 @scheduler.command()
 @click.option('-v', '--verbose', is_flag=True, help='启用详细输出')
 @click.option('-p', '--processes', default=1, type=int, help='worker进程数量')
-def worker(verbose, processes):
+@click.option('-t', '--threads', default=None, type=int, help='每个进程的worker线程数量')
+@click.option('-Q', '--queues', multiple=True, help='只消费指定队列，可重复，例如 -Q callbacks')
+@click.option('-l', '--lane', 'lanes', multiple=True,
+              help='按通道启动独立的worker：通道[:进程数[:线程数]]，可重复，例如 -l default:4 -l cron:1:8')
+def worker(verbose, processes, threads, queues, lanes):
     """启动dramatiq worker"""
     # 配置日志
     if verbose:
@@ -69,6 +76,10 @@ def worker(verbose, processes):
     # 确保应用已初始化 (加载配置和注册任务)
     _ = create_app()
 
+    if lanes:
+        _run_lane_workers(lanes, verbose)
+        return
+
     # 运行dramatiq worker
     from dramatiq.cli import main
 
@@ -76,6 +87,10 @@ def worker(verbose, processes):
     original_argv = sys.argv.copy()
     try:
         sys.argv = [sys.argv[0], 'scheduler_service.service', '--processes', str(processes)]
+        if threads:
+            sys.argv += ['--threads', str(threads)]
+        if queues:
+            sys.argv += ['--queues', *queues]
         main()
     except KeyboardInterrupt:
         print("Worker stopped")
@@ -83,6 +98,85 @@ def worker(verbose, processes):
         sys.argv = original_argv
 
 
+@scheduler.command()
+@click.option('-v', '--verbose', is_flag=True, help='启用详细输出')
+def beat(verbose):
+    """启动定时任务进程，只运行APScheduler（API进程需设置 SCHEDULER_RUN_JOBS = false）"""
+    from scheduler_service.beat import run_beat
+
+    logging.basicConfig(level=logging.INFO if verbose else logging.WARNING)
+    if Config.SCHEDULER_RUN_JOBS:
+        click.echo("Warning: SCHEDULER_RUN_JOBS is enabled, API processes will also run scheduled jobs")
+    asyncio.run(run_beat())
+
+
+@scheduler.command()
+@click.option('-b', '--batch-size', default=Config.CRON_RECONCILE_BATCH_SIZE, type=int, help='每批读取的任务数')
+def reconcile(batch_size):
+    """对比数据库中的cron任务与任务存储，只补上缺少的、删除多余的调度任务"""
+    from scheduler_service.service.reconcile import reconcile_jobs
+    from scheduler_service.utils.cronengine import NativeScheduler
+    from scheduler_service.utils.redis import close_redis
+
+    async def run():
+        config = Config.to_dict()
+        await setup_tortoise(config)
+        setup_dramatiq(config)
+        try:
+            scheduler = get_scheduler()
+            if isinstance(scheduler, NativeScheduler):
+                click.echo("SCHEDULER_ENGINE is native: jobs are loaded from the database, nothing to reconcile")
+                return
+            stats = await reconcile_jobs(scheduler, batch_size)
+            click.echo(", ".join(f"{key}: {value}" for key, value in stats.items()))
+            if stats["deferred"]:
+                click.echo(f"{stats['deferred']} tasks without job_id may still be being created, "
+                           f"run again after {Config.CRON_RECONCILE_ASSIGN_GRACE_MS} ms to assign them")
+        finally:
+            close_dramatiq()
+            await close_redis()
+            await close_tortoise()
+    asyncio.run(run())
+
+
+def _run_lane_workers(lanes, verbose):
+    """每个通道启动一组独立的dramatiq进程，只消费该通道的队列"""
+    import subprocess
+
+    from scheduler_service.service.request import lane_queues
+
+    queues = lane_queues()
+    commands = []
+    for spec in lanes:
+        lane, _, rest = spec.partition(':')
+        if lane not in queues:
+            raise click.BadParameter(f"Unknown lane {lane}, must be one of {list(queues)}", param_hint='--lane')
+        lane_processes, _, lane_threads = rest.partition(':')
+        cmd = [sys.executable, '-m', 'dramatiq', 'scheduler_service.service',
+               '--processes', lane_processes or '1', '--queues', queues[lane]]
+        if lane_threads:
+            cmd += ['--threads', lane_threads]
+        if verbose:
+            cmd.append('--verbose')
+        commands.append(cmd)
+
+    children = []
+    try:
+        for cmd in commands:
+            click.echo(f"Starting: {' '.join(cmd)}")
+            children.append(subprocess.Popen(cmd))
+        for child in children:
+            child.wait()
+    except KeyboardInterrupt:
+        print("Worker stopped")
+    finally:
+        for child in children:
+            if child.poll() is None:
+                child.terminate()
+        for child in children:
+            child.wait()
+
+
 @scheduler.command()
 def init_db():
     """初始化数据库 (使用 Aerich)"""
@@ -190,6 +284,35 @@ def heads():
     asyncio.run(run())
 
 
+@migrate.command()
+def build_indexes():
+    """在线创建任务表索引 (CREATE INDEX CONCURRENTLY，仅 PostgreSQL)"""
+    async def run():
+        await Tortoise.init(config=TORTOISE_ORM)
+        try:
+            await build_indexes_concurrently(RequestTask, TASK_INDEXES, echo=click.echo)
+            click.echo("Indexes built")
+        finally:
+            await Tortoise.close_connections()
+    asyncio.run(run())
+
+
+@migrate.command()
+@click.option("--days-ahead", default=Config.TASK_RUN_PARTITION_DAYS_AHEAD, type=int, help="预建未来几天的分区")
+@click.option("--retention-days", default=Config.TASK_RUN_RETENTION_DAYS, type=int, help="执行历史保留天数")
+def partition_runs(days_ahead, retention_days):
+    """将执行历史表转换为按天分区，并预建分区、删除过期分区 (仅 PostgreSQL)"""
+    async def run():
+        await Tortoise.init(config=TORTOISE_ORM)
+        try:
+            await setup_partitioning(echo=click.echo)
+            await maintain_partitions(days_ahead, retention_days, echo=click.echo)
+            click.echo("Task run partitions ready")
+        finally:
+            await Tortoise.close_connections()
+    asyncio.run(run())
+
+
 @scheduler.command()
 @click.option('--path', '-p', help='要测试的路径，默认为tests/')
 @click.option('--coverage', '-c', is_flag=True, help='生成覆盖率报告')
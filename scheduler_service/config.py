@@ -31,6 +31,100 @@ class Config:
     RESTFUL_JSON = {"cls": CustomJsonEncoder}
     LOG_LEVEL = logging.DEBUG
     REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    USER_CACHE_ENABLED = True
+    USER_CACHE_SIZE = 10000
+    USER_CACHE_TTL = 60
+    USER_CACHE_CHANNEL = "scheduler:user_invalidate"
+    HASH_EXECUTOR = "thread"  # thread 或 process
+    HASH_WORKERS = 4
+    HASH_QUEUE_SIZE = 64
+    STATUS_WRITE_MODE = "sync"  # sync 或 buffered
+    STATUS_FLUSH_INTERVAL_MS = 200
+    STATUS_FLUSH_MAX_ITEMS = 500
+    STATUS_FLUSH_MAX_PENDING = 5000  # 刷写失败时最多保留的状态数，超出时丢弃最旧的
+    HTTP_TIMEOUT = 60.0
+    HTTP_MAX_CONNECTIONS = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+    HTTP_KEEPALIVE_EXPIRY = 5.0
+    HTTP2 = False  # 需要安装 h2
+    HTTP_POOL_PER_HOST = False
+    HTTP_HOST_MAX_CONNECTIONS = 10
+    HTTP_HOST_MAX_KEEPALIVE_CONNECTIONS = 5
+    HTTP_MAX_HOST_POOLS = 256
+    PING_RESPONSE_MODE = "body"  # "body" 或 "headers"（只保留状态码和响应头）
+    PING_MAX_RESPONSE_BYTES = 1024 * 1024
+    # ping actor 的执行时间上限，也是运行中任务的认领租约：超过后视为worker已退出，任务可以被重新认领
+    PING_TIME_LIMIT_MS = 10 * 60 * 1000
+    TASK_RUN_ENABLED = True
+    TASK_RUN_FLUSH_INTERVAL_MS = 1000
+    TASK_RUN_FLUSH_MAX_ITEMS = 500
+    TASK_RUN_PARTITION_DAYS_AHEAD = 3
+    TASK_RUN_RETENTION_DAYS = 30
+    CALLBACK_QUEUE = "callbacks"
+    CALLBACK_TIMEOUT = 10.0
+    CALLBACK_MAX_RETRIES = 8
+    CALLBACK_MIN_BACKOFF_MS = 1000
+    CALLBACK_MAX_BACKOFF_MS = 5 * 60 * 1000
+    CALLBACK_TIME_LIMIT_MS = 60 * 1000
+    CALLBACK_BATCH_ENABLED = False
+    CALLBACK_BATCH_INTERVAL_MS = 1000
+    CALLBACK_BATCH_MAX_ITEMS = 100
+    # URL前缀 -> {"enabled", "interval_ms", "max_items"}，覆盖上面的默认值
+    CALLBACK_BATCH_POLICIES = {}
+    CALLBACK_BATCH_REJECT_TTL = 3600  # 接收方拒绝批量格式后多久内不再尝试（秒）
+    RATE_LIMIT_ENABLED = False
+    # 主机名通配符 -> {"rate": 每秒请求数, "burst": 突发上限, "max_in_flight": 最大并发}
+    RATE_LIMITS = {}
+    RATE_LIMIT_LEASE_SIZE = 10  # 每次从Redis租借的令牌数
+    RATE_LIMIT_LEASE_MS = 1000  # 租借的令牌在本地的有效期
+    RATE_LIMIT_RETRY_DELAY_MS = 200  # 并发已满时重新入队的延迟
+    RATE_LIMIT_KEY_PREFIX = "scheduler:ratelimit"
+    # 执行通道 -> Dramatiq队列，一次性任务默认在 "default" 通道，cron任务默认在 "cron" 通道
+    PING_LANES = {"cron": "cron", "priority": "priority"}
+    FAIR_QUEUE_ENABLED = False
+    FAIR_QUEUE_TARGET_DEPTH = 200  # Dramatiq ping队列中最多积压的消息数
+    FAIR_QUEUE_DEFAULT_WEIGHT = 10  # 每轮每个用户最多发送的任务数
+    FAIR_QUEUE_WEIGHTS = {}  # 用户ID -> 权重
+    FAIR_QUEUE_DEFAULT_QUOTA = 0  # 每个用户子队列最多积压的任务数，0 表示不限制
+    FAIR_QUEUE_QUOTAS = {}  # 用户ID -> 配额
+    FAIR_QUEUE_POLL_MS = 50
+    FAIR_QUEUE_KEY_PREFIX = "scheduler:fairqueue"
+    # 为 False 时 API 进程只添加和删除定时任务，由 `scheduler beat` 进程执行
+    SCHEDULER_RUN_JOBS = True
+    SCHEDULER_BEAT_POLL_MS = 1000  # beat 进程检查其他进程新增任务的间隔
+    # 多个执行定时任务的进程通过Redis租约选举领导者，只有领导者触发任务
+    SCHEDULER_HA_ENABLED = False
+    SCHEDULER_LEADER_KEY = "scheduler:leader"
+    SCHEDULER_LEADER_TTL_MS = 2000  # 领导者失联后最长的接管时间
+    SCHEDULER_LEADER_RENEW_MS = 500  # 续期和备用节点尝试获取租约的间隔
+    SCHEDULER_MISFIRE_GRACE_TIME = 30  # 秒，接管期间错过的触发在此时间内补发
+    # "apscheduler" 或 "native"（位掩码批量计算的cron引擎，任务只在内存中、从数据库加载；需要安装 numpy）
+    SCHEDULER_ENGINE = "apscheduler"
+    CRON_ENGINE_SYNC_MS = 5000  # 加载其他进程新建的cron任务的间隔
+    CRON_ENGINE_FULL_SYNC_MS = 300000  # 与数据库全量对比、删除已删除任务的间隔
+    CRON_ENGINE_FIRE_BATCH_SIZE = 1000  # 同时执行的到期任务数
+    CRON_ENGINE_REMOVE_CHANNEL = "scheduler:cron_removed"  # 通知执行任务的进程移除已删除任务
+    # 执行任务的进程启动时对比数据库与任务存储，补上缺少的cron任务、删除多余的（也可运行 `scheduler reconcile`）
+    CRON_RECONCILE_ON_STARTUP = True
+    CRON_RECONCILE_BATCH_SIZE = 10000  # 对账时每批读取的任务数
+    CRON_RECONCILE_ASSIGN_GRACE_MS = 60000  # job_id 为空的任务从首次发现起超过该时间仍为空才分配调度任务
+    CRON_RECONCILE_UNASSIGNED_KEY = "scheduler:reconcile:unassigned"  # 记录首次发现 job_id 为空的时间
+    # 为 True 时相同cron表达式（和通道）的任务共用一个调度任务，成员保存在Redis集合中
+    CRON_GROUPED = False
+    CRON_GROUP_BATCH_SIZE = 1000  # 分组触发时每批发送的任务数
+    CRON_GROUP_KEY_PREFIX = "scheduler:crongroup"
+    # start_time 晚于 DELAY_QUEUE_THRESHOLD_MS 的一次性任务先写入Redis延迟队列，不在worker中预取
+    DELAY_QUEUE_ENABLED = True
+    DELAY_QUEUE_THRESHOLD_MS = 300000
+    DELAY_QUEUE_LOOKAHEAD_MS = 5000  # 提前发送到Dramatiq的时间（消息仍带eta）
+    DELAY_QUEUE_BATCH_SIZE = 1000
+    DELAY_QUEUE_POLL_MS = 500
+    DELAY_QUEUE_LEASE_MS = 60000  # 取出后未确认的任务在此时间后重新发送
+    DELAY_QUEUE_KEY = "scheduler:delayed"
+    # "redis": cron循环计数先累计在Redis中，定期批量写回；"sync": 每次触发直接更新数据库
+    CRON_COUNT_MODE = "redis"
+    CRON_COUNT_FLUSH_INTERVAL_MS = 5000
+    CRON_COUNT_KEY = "scheduler:cron_count"
 
     @classmethod
     def load(cls):
@@ -1,4 +1,6 @@
 """FastAPI主应用文件"""
+import asyncio
+import os
 from contextlib import asynccontextmanager
 from typing import Any, AsyncGenerator
 
@@ -10,7 +12,17 @@ from tortoise.exceptions import DoesNotExist, IntegrityError
 
 from scheduler_service import close_dramatiq, close_tortoise, setup_dramatiq, get_scheduler
 from scheduler_service.api import setup_routes
+from scheduler_service.api.user_cache import listen_user_invalidation, setup_user_cache
 from scheduler_service.config import Config
+from scheduler_service.service.counters import run_flusher
+from scheduler_service.service.cronsync import start_sync
+from scheduler_service.service.delayqueue import run_dispatcher as run_delay_dispatcher
+from scheduler_service.service.fairqueue import QueueQuotaExceeded, run_dispatcher
+from scheduler_service.service.leader import start_scheduler
+from scheduler_service.service.reconcile import start_reconcile
+from scheduler_service.service.status import schedule_run_partitions
+from scheduler_service.utils.hashing import HashingBusy, setup_hashing, shutdown_hashing
+from scheduler_service.utils.redis import close_redis
 
 
 @asynccontextmanager
@@ -19,12 +31,55 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     # 启动时执行
     await setup_dbs(app)
     
-    # 启动调度器
+    # 启动调度器；SCHEDULER_RUN_JOBS 为 False 时只维护任务存储，由 `scheduler beat` 执行任务
+    background = []
     scheduler = get_scheduler()
-    scheduler.start()
+    run_jobs = app.config.get("SCHEDULER_RUN_JOBS", True)
+    election = start_scheduler(scheduler, run_jobs=run_jobs)
+    if election:
+        background.append(election)
+
+    # NativeScheduler 的任务只在内存中，执行任务的进程从数据库加载
+    if run_jobs and os.getenv("UNIT_TESTS") != "1":
+        sync = start_sync(scheduler)
+        if sync:
+            background.append(sync)
+
+    # 修复任务存储中缺少或多余的cron任务
+    if run_jobs and app.config.get("CRON_RECONCILE_ON_STARTUP", True) and os.getenv("UNIT_TESTS") != "1":
+        reconcile = start_reconcile(scheduler)
+        if reconcile:
+            background.append(reconcile)
+
+    # 每小时维护执行历史分区；不执行任务时由 beat 注册
+    if run_jobs and os.getenv("UNIT_TESTS") != "1":
+        schedule_run_partitions(scheduler)
+
+    # 订阅用户缓存失效通知
+    if app.config.get("USER_CACHE_ENABLED", True) and os.getenv("UNIT_TESTS") != "1":
+        background.append(asyncio.create_task(listen_user_invalidation()))
+
+    # 公平调度：从用户子队列向Dramatiq队列发送任务，只在执行定时任务的进程中运行
+    if run_jobs and app.config.get("FAIR_QUEUE_ENABLED") and os.getenv("UNIT_TESTS") != "1":
+        background.append(asyncio.create_task(run_dispatcher()))
+
+    # 把延迟队列中即将到期的远期任务发送到Dramatiq，只在执行定时任务的进程中运行
+    if run_jobs and app.config.get("DELAY_QUEUE_ENABLED") and os.getenv("UNIT_TESTS") != "1":
+        background.append(asyncio.create_task(run_delay_dispatcher()))
+
+    # 定期把Redis中累计的cron循环计数写回数据库，只在执行定时任务的进程中运行
+    if run_jobs and app.config.get("CRON_COUNT_MODE") == "redis" and os.getenv("UNIT_TESTS") != "1":
+        background.append(asyncio.create_task(run_flusher()))
     
     # Dramatiq will be set up by the app fixture in tests or via external config in production
     yield
+
+    for task in background:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
     
     # 关闭调度器
     if scheduler.running:
@@ -82,6 +137,21 @@ def create_app(config: Any = None) -> FastAPI:
             content={"detail": [{"loc": [], "msg": str(exc), "type": "IntegrityError"}]},
         )
 
+    @app.exception_handler(HashingBusy)
+    async def hashing_busy_exception_handler(request: Request, exc: HashingBusy):
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"detail": str(exc)},
+            headers={"Retry-After": "1"},
+        )
+
+    @app.exception_handler(QueueQuotaExceeded)
+    async def queue_quota_exceeded_exception_handler(request: Request, exc: QueueQuotaExceeded):
+        return JSONResponse(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            content={"detail": str(exc)},
+        )
+
     # 跨域配置
     app.add_middleware(
         CORSMiddleware,
@@ -113,6 +183,12 @@ async def setup_dbs(app: FastAPI):
     # 初始化 Dramatiq
     setup_dramatiq(app.config)
 
+    # 初始化密码哈希执行器
+    setup_hashing(app.config)
+
+    # 按应用配置设置用户缓存；数据库重新初始化后，缓存的用户可能已失效
+    setup_user_cache(app.config)
+
 
 async def close_dbs():
     """关闭所有数据库连接"""
@@ -120,3 +196,7 @@ async def close_dbs():
     await close_tortoise()
     # 关闭Dramatiq连接
     close_dramatiq()
+    # 关闭Redis连接
+    await close_redis()
+    # 关闭密码哈希执行器
+    shutdown_hashing()
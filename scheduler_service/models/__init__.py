@@ -1,8 +1,10 @@
 # Tortoise-ORM models initialization
 
-from .task import RequestTask
+from .counter import CronCountFlush
+from .run import RUN_FIELDS, TaskRun
+from .task import TASK_FIELDS, TASK_INDEXES, RequestTask
 from .user import User
 
 __all__ = [
-    'User', 'RequestTask'
+    'User', 'RequestTask', 'TASK_FIELDS', 'TASK_INDEXES', 'TaskRun', 'RUN_FIELDS', 'CronCountFlush'
 ]
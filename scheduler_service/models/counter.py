@@ -0,0 +1,35 @@
+"""已写回数据库的cron计数批次
+
+flush_cron_counts 在同一个事务中插入批次ID并更新 cron_count。
+Redis 中的批次在写库后未能删除（或锁过期后被另一个进程重复刷写）时，
+再次写回同一批次会因为批次ID已存在而跳过，增量不会被重复累加。
+"""
+from datetime import timedelta
+
+from tortoise import fields, timezone
+from tortoise.models import Model
+
+from scheduler_service.models.sql import get_db, placeholders, quote
+
+# 批次ID的保留时间，远大于一个批次从写库到删除的间隔
+FLUSH_RETENTION = timedelta(days=1)
+
+
+class CronCountFlush(Model):
+    flush_id = fields.CharField(max_length=32, pk=True)
+    applied_at = fields.DatetimeField(index=True)
+
+    @classmethod
+    async def mark_applied(cls, flush_id: str, using_db=None) -> bool:
+        """记录批次ID，批次已经写回过时返回False"""
+        db = get_db(cls, using_db)
+        now = timezone.now()
+        params = placeholders(db, 1, 2)
+        _, rows = await db.execute_query(
+            f"INSERT INTO {quote(cls._meta.db_table)} ({quote('flush_id')}, {quote('applied_at')}) "
+            f"VALUES ({params[0]}, {params[1]}) ON CONFLICT DO NOTHING RETURNING {quote('flush_id')}",
+            [flush_id, cls._meta.fields_map['applied_at'].to_db_value(now, cls)]
+        )
+        # 顺便删除过期的批次ID
+        await cls.filter(applied_at__lt=now - FLUSH_RETENTION).using_db(db).delete()
+        return bool(rows)
@@ -0,0 +1,148 @@
+"""任务执行历史
+
+每次 ping 执行追加一行，不修改 RequestTask。PostgreSQL 上该表按 started_at
+按天分区（`scheduler migrate partition-runs`），过期数据通过删除整个分区清理。
+"""
+from datetime import date, datetime, timedelta, timezone
+
+from tortoise import fields
+from tortoise.indexes import Index
+from tortoise.models import Model
+
+from scheduler_service.models.sql import (bulk_insert_returning_ids, get_db,
+                                          index_sql, is_postgres, quote)
+
+RUN_FIELDS = (
+    'id', 'task_id', 'started_at', 'finished_at', 'status', 'status_code', 'latency_ms',
+    'error_message'
+)
+
+
+class TaskRun(Model):
+    id = fields.BigIntField(pk=True)
+    # 不使用外键，删除任务时保留历史，也避免分区表上的外键约束
+    task_id = fields.IntField()
+    started_at = fields.DatetimeField()
+    finished_at = fields.DatetimeField()
+    status = fields.CharField(max_length=20)
+    status_code = fields.IntField(null=True)  # 请求失败时为空
+    latency_ms = fields.FloatField()
+    error_message = fields.TextField(null=True)
+
+    class Meta:
+        indexes = (
+            Index(fields=("task_id", "id"), name="idx_taskrun_task_id_id"),
+        )
+
+    @classmethod
+    async def bulk_insert(cls, runs, using_db=None):
+        """批量插入执行记录（单条多行INSERT）"""
+        return await bulk_insert_returning_ids(cls, runs, using_db=using_db)
+
+
+def partition_name(day: date) -> str:
+    return f"{TaskRun._meta.db_table}_p{day:%Y%m%d}"
+
+
+def _partition_day(name: str):
+    """从分区表名解析日期，不是按天分区的表返回None"""
+    prefix = f"{TaskRun._meta.db_table}_p"
+    if not name.startswith(prefix):
+        return None
+    try:
+        return datetime.strptime(name[len(prefix):], "%Y%m%d").date()
+    except ValueError:
+        return None
+
+
+async def _relkind(db):
+    _, rows = await db.execute_query(
+        "SELECT c.relkind FROM pg_class c WHERE c.oid = to_regclass($1)", [TaskRun._meta.db_table])
+    return rows[0]["relkind"] if rows else None
+
+
+async def is_partitioned() -> bool:
+    db = get_db(TaskRun)
+    return is_postgres(db) and await _relkind(db) == "p"
+
+
+async def setup_partitioning(echo=print):
+    """
+    将执行历史表创建为按 started_at 分区的表（仅 PostgreSQL）。
+    generate_schemas/aerich 创建的普通表为空时会被替换，有数据时拒绝转换。
+    """
+    db = get_db(TaskRun)
+    if not is_postgres(db):
+        raise RuntimeError("Table partitioning requires PostgreSQL")
+
+    table = TaskRun._meta.db_table
+    relkind = await _relkind(db)
+    if relkind == "p":
+        return
+    if relkind is not None:
+        _, count = await db.execute_query(f"SELECT count(*) AS n FROM {quote(table)}")
+        if count[0]["n"]:
+            raise RuntimeError(f"{table} is not partitioned and contains rows, migrate it manually")
+        echo(f"Dropping unpartitioned table {table}")
+        await db.execute_script(f"DROP TABLE {quote(table)}")
+
+    echo(f"Creating partitioned table {table}")
+    # 分区表的主键必须包含分区键
+    await db.execute_script(
+        f"CREATE TABLE {quote(table)} ("
+        '"id" BIGSERIAL NOT NULL, '
+        '"task_id" INT NOT NULL, '
+        '"started_at" TIMESTAMPTZ NOT NULL, '
+        '"finished_at" TIMESTAMPTZ NOT NULL, '
+        '"status" VARCHAR(20) NOT NULL, '
+        '"status_code" INT, '
+        '"latency_ms" DOUBLE PRECISION NOT NULL, '
+        '"error_message" TEXT, '
+        'PRIMARY KEY ("id", "started_at")'
+        ') PARTITION BY RANGE ("started_at")'
+    )
+    # 兜底分区，避免维护任务未及时执行时写入失败
+    await db.execute_script(
+        f"CREATE TABLE IF NOT EXISTS {quote(table + '_default')} PARTITION OF {quote(table)} DEFAULT")
+    for index in TaskRun._meta.indexes:
+        await db.execute_script(index_sql(TaskRun, index, concurrently=False))
+
+
+async def create_partitions(days_ahead: int, today: date = None):
+    """创建从今天起 days_ahead 天内的每日分区"""
+    db = get_db(TaskRun)
+    table = TaskRun._meta.db_table
+    today = today or datetime.now(timezone.utc).date()
+    for offset in range(days_ahead + 1):
+        day = today + timedelta(days=offset)
+        await db.execute_script(
+            f"CREATE TABLE IF NOT EXISTS {quote(partition_name(day))} PARTITION OF {quote(table)} "
+            f"FOR VALUES FROM ('{day.isoformat()} 00:00:00+00') "
+            f"TO ('{(day + timedelta(days=1)).isoformat()} 00:00:00+00')"
+        )
+
+
+async def drop_expired_partitions(retention_days: int, today: date = None, echo=print) -> list:
+    """删除所有数据都早于保留期的每日分区，返回被删除的分区名"""
+    db = get_db(TaskRun)
+    today = today or datetime.now(timezone.utc).date()
+    cutoff = today - timedelta(days=retention_days)
+    _, rows = await db.execute_query(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass($1)",
+        [TaskRun._meta.db_table]
+    )
+    dropped = []
+    for row in rows:
+        day = _partition_day(row["relname"])
+        if day is not None and day < cutoff:
+            echo(f"Dropping partition {row['relname']}")
+            await db.execute_script(f"DROP TABLE IF EXISTS {quote(row['relname'])}")
+            dropped.append(row["relname"])
+    return sorted(dropped)
+
+
+async def maintain_partitions(days_ahead: int, retention_days: int, echo=print):
+    """预建未来的分区并删除过期分区，可重复执行"""
+    await create_partitions(days_ahead)
+    return await drop_expired_partitions(retention_days, echo=echo)
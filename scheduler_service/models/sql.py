@@ -0,0 +1,142 @@
+"""Tortoise 未直接提供的批量SQL语句
+
+这里的语句同时兼容 PostgreSQL（生产环境）和 SQLite（测试环境）。
+"""
+from typing import List, Sequence, Type
+
+from tortoise.models import Model
+
+# 单条语句的最大行数，避免超出数据库的参数数量上限
+DEFAULT_BATCH_SIZE = 1000
+
+
+def get_db(model: Type[Model], using_db=None):
+    """获取模型对应的数据库连接"""
+    return using_db or model._meta.db
+
+
+def is_postgres(db) -> bool:
+    return db.capabilities.dialect == "postgres"
+
+
+def quote(name: str) -> str:
+    return f'"{name}"'
+
+
+def placeholders(db, start: int, count: int) -> List[str]:
+    """生成从第start个参数开始的count个占位符"""
+    if is_postgres(db):
+        return [f"${i}" for i in range(start, start + count)]
+    return ["?"] * count
+
+
+def chunks(items: Sequence, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+async def bulk_insert_returning_ids(model: Type[Model], instances: Sequence[Model],
+                                    using_db=None, batch_size: int = DEFAULT_BATCH_SIZE) -> List[int]:
+    """
+    使用多行 INSERT ... RETURNING 批量插入，并回填自增主键。
+    Tortoise 的 bulk_create 不会回填主键，且会拆成逐行执行。
+    """
+    db = get_db(model, using_db)
+    meta = model._meta
+    fields = [name for name in meta.fields_db_projection if name != meta.pk_attr]
+    columns = ", ".join(quote(meta.fields_db_projection[name]) for name in fields)
+
+    ids = []
+    for chunk in chunks(instances, batch_size):
+        rows, values = [], []
+        for instance in chunk:
+            rows.append(f"({', '.join(placeholders(db, len(values) + 1, len(fields)))})")
+            values.extend(
+                meta.fields_map[name].to_db_value(getattr(instance, name), instance)
+                for name in fields
+            )
+
+        sql = (f"INSERT INTO {quote(meta.db_table)} ({columns}) VALUES {', '.join(rows)} "
+               f"RETURNING {quote(meta.db_pk_column)}")
+        _, result = await db.execute_query(sql, values)
+        # 同一条语句中自增主键按 VALUES 顺序分配
+        chunk_ids = sorted(row[meta.db_pk_column] for row in result)
+        for instance, pk in zip(chunk, chunk_ids):
+            instance.pk = pk
+            instance._saved_in_db = True
+        ids.extend(chunk_ids)
+    return ids
+
+
+def index_sql(model: Type[Model], index, concurrently: bool = True) -> str:
+    """生成模型上某个索引的建索引语句"""
+    columns = ", ".join(
+        quote(model._meta.fields_db_projection.get(name, name)) for name in index.fields
+    )
+    return (f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS "
+            f"{quote(index.name)} ON {quote(model._meta.db_table)} ({columns})")
+
+
+async def build_indexes_concurrently(model: Type[Model], indexes: Sequence, echo=print):
+    """
+    在线创建模型的索引（仅 PostgreSQL）。
+    CREATE INDEX CONCURRENTLY 不能在事务中执行，也不会长时间锁表；
+    中断后残留的无效索引会先被删除再重建。
+    """
+    db = get_db(model)
+    if not is_postgres(db):
+        raise RuntimeError("CREATE INDEX CONCURRENTLY requires PostgreSQL")
+
+    names = [index.name for index in indexes]
+    _, invalid = await db.execute_query(
+        "SELECT c.relname FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+        "WHERE NOT i.indisvalid AND c.relname = ANY($1::text[])",
+        [names]
+    )
+    for row in invalid:
+        echo(f"Dropping invalid index {row['relname']}")
+        await db.execute_script(f"DROP INDEX CONCURRENTLY IF EXISTS {quote(row['relname'])}")
+
+    for index in indexes:
+        echo(f"Building index {index.name}")
+        await db.execute_script(index_sql(model, index))
+
+
+async def bulk_update_from_values(model: Type[Model], columns: Sequence[tuple], rows: Sequence[Sequence],
+                                  assignments: dict = None, where: str = None, using_db=None,
+                                  batch_size: int = DEFAULT_BATCH_SIZE):
+    """
+    使用一条 UPDATE ... FROM (VALUES ...) 语句批量更新多行。
+
+    :param columns: [(列名, SQL类型), ...]，第一列为用于匹配的主键
+    :param rows: 与 columns 对应的值
+    :param assignments: {列名: SQL表达式}，表达式中用 v."列名" 引用传入的值，
+                        默认把除主键外的所有列设置为传入的值
+    :param where: 主键之外的附加匹配条件，同样用 v."列名" 引用传入的值
+    """
+    db = get_db(model, using_db)
+    table = quote(model._meta.db_table)
+    key = columns[0][0]
+    if assignments is None:
+        assignments = {name: f'v.{quote(name)}' for name, _ in columns[1:]}
+    set_clause = ", ".join(f"{quote(name)} = {expr}" for name, expr in assignments.items())
+    # VALUES 的列默认命名为 column1、column2...（PostgreSQL 与 SQLite 一致）
+    select_clause = ", ".join(
+        f"column{i} AS {quote(name)}" for i, (name, _) in enumerate(columns, start=1)
+    )
+
+    for chunk in chunks(rows, batch_size):
+        values_sql, values = [], []
+        for row in chunk:
+            params = placeholders(db, len(values) + 1, len(columns))
+            values_sql.append("(" + ", ".join(
+                f"CAST({param} AS {sql_type})" for param, (_, sql_type) in zip(params, columns)
+            ) + ")")
+            values.extend(row)
+
+        sql = (f"UPDATE {table} SET {set_clause} "
+               f"FROM (SELECT {select_clause} FROM (VALUES {', '.join(values_sql)}) AS vals) AS v "
+               f"WHERE {table}.{quote(key)} = v.{quote(key)}")
+        if where:
+            sql += f" AND {where}"
+        await db.execute_query(sql, values)
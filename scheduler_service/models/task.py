@@ -1,11 +1,33 @@
-from tortoise import fields
+from datetime import timedelta
+
+from tortoise import fields, timezone
+from tortoise.indexes import Index
 from tortoise.models import Model
 
 from scheduler_service.constants import TaskStatus
+from scheduler_service.models.sql import (bulk_insert_returning_ids,
+                                          bulk_update_from_values, get_db,
+                                          is_postgres, placeholders, quote)
 
 # 定义有效的HTTP方法列表
 VALID_HTTP_METHODS = ['GET', 'POST', 'PUT', 'DELETE', 'PATCH', 'HEAD', 'OPTIONS']
 
+# to_dict 输出的字段，也是接口允许投影的字段
+TASK_FIELDS = (
+    'id', 'name', 'start_time', 'user_id', 'request_url', 'callback_url', 'callback_token',
+    'header', 'method', 'body', 'message_id', 'cron', 'cron_count', 'job_id', 'status',
+    'error_message', 'lane'
+)
+
+# 任务表的查询索引，只由 `scheduler migrate build-indexes` 在线创建（CREATE INDEX CONCURRENTLY）。
+# 不放在 Meta.indexes 中：启动时的 generate_schemas 会用普通的 CREATE INDEX 锁住已有数据的表。
+TASK_INDEXES = (
+    Index(fields=("user_id", "id"), name="idx_requesttask_user_id_id"),
+    Index(fields=("status", "start_time"), name="idx_requesttask_status_start"),
+    Index(fields=("job_id",), name="idx_requesttask_job_id"),
+    Index(fields=("message_id",), name="idx_requesttask_message_id"),
+)
+
 
 class RequestTask(Model):
     id = fields.IntField(pk=True)
@@ -23,6 +45,8 @@ class RequestTask(Model):
     job_id = fields.CharField(max_length=64, null=True)  # APScheduler Job ID
     status = fields.CharField(max_length=20, default=TaskStatus.PENDING)
     error_message = fields.TextField(null=True) # 任务执行失败时的错误信息
+    lane = fields.CharField(max_length=16, null=True)  # 执行通道，为空时一次性任务走默认通道、cron任务走cron通道
+    claimed_at = fields.DatetimeField(null=True)  # 最近一次被worker认领的时间，运行中任务的租约从此开始计算
 
     # 定义与User的外键关系
     user = fields.ForeignKeyField(
@@ -38,6 +62,96 @@ class RequestTask(Model):
         self.method = self.method.upper()
         await super().save(*args, **kwargs)
 
+    @classmethod
+    async def bulk_insert(cls, tasks, using_db=None):
+        """批量插入任务（单条多行INSERT），并回填任务ID"""
+        for task in tasks:
+            if task.method and task.method.upper() not in VALID_HTTP_METHODS:
+                raise ValueError(
+                    f"Invalid HTTP method: {task.method}. Must be one of {VALID_HTTP_METHODS}")
+            task.method = task.method.upper()
+        return await bulk_insert_returning_ids(cls, tasks, using_db=using_db)
+
+    @classmethod
+    async def claim(cls, task_id: int, lease_ms: int):
+        """
+        将任务标记为运行中并记录认领时间，在同一条 UPDATE ... RETURNING 语句中取回任务。
+        任务不存在、已取消或正在被其他worker执行时返回None。
+        运行中的任务超过 lease_ms 仍未结束时（worker崩溃、被超时终止或状态写入丢失）可以被重新认领，
+        没有认领时间的运行中任务同样视为租约已过期。
+        """
+        db = get_db(cls)
+        claimed_at = cls._meta.fields_map['claimed_at']
+        now = timezone.now()
+        params = placeholders(db, 1, 7)
+        sql = (f"UPDATE {quote(cls._meta.db_table)} "
+               f"SET {quote('status')} = {params[0]}, {quote('error_message')} = NULL, "
+               f"{quote('claimed_at')} = {params[1]} "
+               f"WHERE {quote(cls._meta.db_pk_column)} = {params[2]} "
+               f"AND ({quote('status')} NOT IN ({params[3]}, {params[4]}) "
+               f"OR ({quote('status')} = {params[5]} AND "
+               f"({quote('claimed_at')} IS NULL OR {quote('claimed_at')} < {params[6]}))) RETURNING *")
+        _, rows = await db.execute_query(sql, [
+            TaskStatus.RUNNING, claimed_at.to_db_value(now, cls), task_id,
+            TaskStatus.RUNNING, TaskStatus.CANCELLED,
+            TaskStatus.RUNNING, claimed_at.to_db_value(now - timedelta(milliseconds=lease_ms), cls),
+        ])
+        if not rows:
+            return None
+        return cls._init_from_db(**dict(rows[0]))
+
+    @classmethod
+    async def finish(cls, task_id: int, status: str, error_message: str = None, claimed_at=None):
+        """
+        只更新任务的状态和错误信息。
+        传入 claimed_at 时只在认领时间未变时更新：租约过期后任务已被重新认领，旧的执行结果不能覆盖新的运行中状态。
+        """
+        query = cls.filter(id=task_id)
+        if claimed_at is not None:
+            query = query.filter(claimed_at=claimed_at)
+        await query.update(status=status, error_message=error_message)
+
+    @classmethod
+    async def bulk_finish(cls, results):
+        """
+        用一条UPDATE批量更新多个任务的状态和错误信息，results 为 [(task_id, status, error_message, claimed_at)]。
+        与 finish 相同，claimed_at 不为空时只更新认领时间仍等于 claimed_at 的任务。
+        """
+        db = get_db(cls)
+        claimed_at = cls._meta.fields_map['claimed_at']
+        # SQLite 中时间按文本保存，按文本比较才能与认领时写入的值完全一致
+        claimed_type = 'TIMESTAMPTZ' if is_postgres(db) else 'TEXT'
+        await bulk_update_from_values(
+            cls,
+            [('id', 'INTEGER'), ('status', 'VARCHAR(20)'), ('error_message', 'TEXT'),
+             ('claimed_at', claimed_type)],
+            [(task_id, status, error_message, claimed_at.to_db_value(claimed, cls))
+             for task_id, status, error_message, claimed in results],
+            assignments={'status': f"v.{quote('status')}", 'error_message': f"v.{quote('error_message')}"},
+            where=f"(v.{quote('claimed_at')} IS NULL OR "
+                  f"{quote(cls._meta.db_table)}.{quote('claimed_at')} = v.{quote('claimed_at')})"
+        )
+
+    @classmethod
+    async def set_message_ids(cls, pairs):
+        """用一条UPDATE写回多个任务的消息ID，pairs 为 [(task_id, message_id)]"""
+        await bulk_update_from_values(
+            cls,
+            [('id', 'INTEGER'), ('message_id', 'VARCHAR(64)')],
+            pairs
+        )
+
+    @classmethod
+    async def add_cron_counts(cls, deltas, using_db=None):
+        """用一条UPDATE给多个任务的 cron_count 加上增量，deltas 为 [(task_id, delta)]"""
+        await bulk_update_from_values(
+            cls,
+            [('id', 'INTEGER'), ('delta', 'INTEGER')],
+            deltas,
+            assignments={'cron_count': f"{quote('cron_count')} + v.{quote('delta')}"},
+            using_db=using_db
+        )
+
     def to_dict(self) -> dict:
         return {
             "id": self.id,
@@ -55,5 +169,6 @@ class RequestTask(Model):
             "cron_count": self.cron_count,
             "job_id": self.job_id,
             "status": self.status,
-            "error_message": self.error_message
+            "error_message": self.error_message,
+            "lane": self.lane
         }
@@ -6,6 +6,7 @@ from tortoise import fields
 from tortoise.exceptions import DoesNotExist
 from tortoise.models import Model
 
+from scheduler_service.utils import hashing
 from scheduler_service.utils.logger import logger
 
 
@@ -37,31 +38,45 @@ class User(Model):
     def verify_password(self, password: str) -> bool:
         return pbkdf2_sha256.verify(password, self.password_hash)
 
+    @staticmethod
+    async def hash_password_async(password: str) -> str:
+        """在哈希执行器中计算密码哈希，不阻塞事件循环"""
+        return await hashing.hash_password(password)
+
+    async def verify_password_async(self, password: str) -> bool:
+        """在哈希执行器中验证密码，不阻塞事件循环"""
+        return await hashing.verify_password(password, self.password_hash)
+
     def generate_auth_token(self, secret_key: str) -> str:
         return jwt.encode({'id': self.id, 'flag': 'auth'},
                           secret_key,
                           algorithm='HS256')
 
-    @classmethod
-    async def verify_auth_token(cls, token: str, secret_key: str):
-        # Temporary print for debugging
-        print(f"DEBUG: verify_auth_token received secret_key: {secret_key}")
+    @staticmethod
+    def decode_auth_token(token: str, secret_key: str):
+        """解析token，返回其中的用户ID，无效时返回None"""
         try:
             data = jwt.decode(token,
                               secret_key,
                               algorithms=['HS256'])
         except Exception as e:
             logger.debug(f"Token verification error (jwt.decode): {e}")
+            return None
+        if data.get('flag') != 'auth':
+            logger.debug("Token verification error: Invalid flag")
+            return None
+        return data.get('id')
+
+    @classmethod
+    async def verify_auth_token(cls, token: str, secret_key: str):
+        user_id = cls.decode_auth_token(token, secret_key)
+        if user_id is None:
+            return False
+        try:
+            return await cls.get(id=user_id)
+        except DoesNotExist:
+            logger.debug("Token verification error: User does not exist for ID")
             return False
-        else:
-            if data['flag'] != 'auth':
-                logger.debug("Token verification error: Invalid flag")
-                return False
-            try:
-                return await cls.get(id=data['id'])
-            except DoesNotExist:
-                logger.debug("Token verification error: User does not exist for ID")
-                return False
 
     def to_dict(self) -> dict:
         return {
@@ -1,3 +1,5 @@
+from scheduler_service.service.callback import (deliver_callback,
+                                                deliver_callback_batch)
 from scheduler_service.service.request import (close_session, get_session,
                                                ping, shutdown_worker,
                                                startup_worker)
@@ -6,6 +8,8 @@ __all__ = [
     'get_session',
     'close_session',
     'ping',
+    'deliver_callback',
+    'deliver_callback_batch',
     'startup_worker',
     'shutdown_worker'
 ]
@@ -0,0 +1,167 @@
+"""回调投递
+
+ping 执行结束后只把回调放入独立的队列，由 deliver_callback 投递。
+回调接收方响应慢或不可用时只占用回调队列的 worker，不影响 ping 的吞吐；
+失败时按指数退避重试。
+
+开启 CALLBACK_BATCH_ENABLED（或在 CALLBACK_BATCH_POLICIES 中为某个URL前缀开启）后，
+发往同一URL的回调在 ping worker 中累积，满 max_items 条或 interval_ms 毫秒后
+以JSON数组一次POST。接收方拒绝数组格式时退回逐条投递。
+"""
+from functools import partial
+from typing import Dict, Optional
+
+import dramatiq
+
+from scheduler_service.config import Config
+from scheduler_service.service.http import get_session, hold_session
+from scheduler_service.utils.buffer import WriteBehindBuffer
+from scheduler_service.utils.cache import TTLCache
+from scheduler_service.utils.logger import logger
+from scheduler_service.utils.metrics import register_collector
+
+# 接收方不支持批量格式时返回的状态码
+BATCH_REJECTED_CODES = (400, 404, 405, 413, 415, 422)
+
+# (url, token) -> 该URL待发送的回调，刷写后即移除
+_batch_buffers: Dict[tuple, WriteBehindBuffer] = {}
+# 拒绝过批量格式的URL，过期前直接逐条投递
+_batch_rejected = TTLCache(maxsize=1024, ttl=Config.CALLBACK_BATCH_REJECT_TTL)
+_batch_stats = {"batches": 0, "items": 0, "fallbacks": 0}
+
+
+class CallbackError(Exception):
+    """回调接收方返回了可重试的错误"""
+
+
+def _auth_headers(token: Optional[str]) -> dict:
+    return {"Authorization": f"Bearer {token}"} if token else {}
+
+
+def _raise_for_retry(url: str, status_code: int):
+    if status_code >= 500 or status_code == 429:
+        raise CallbackError(f"Callback to {url} returned {status_code}")
+
+
+async def post_callback(url: str, data: dict, token: str = None):
+    """
+    发送一次回调，callback_token 作为 Bearer token。
+    网络错误、5xx 和 429 抛出异常以触发重试，其他 4xx 不重试。
+    """
+    session = get_session(url)
+    async with hold_session(session):
+        response = await session.post(
+            url, json=data, headers=_auth_headers(token), timeout=Config.CALLBACK_TIMEOUT)
+    _raise_for_retry(url, response.status_code)
+    if response.status_code >= 400:
+        logger.warning("Callback to %s rejected with %s, not retrying", url, response.status_code)
+
+
+def _fan_out(url: str, items: list, token: str = None):
+    """退回逐条投递"""
+    _batch_stats["fallbacks"] += 1
+    for item in items:
+        data = dict(item)
+        data.pop("task_id", None)
+        deliver_callback.send(url, data, token)
+
+
+async def post_callback_batch(url: str, items: list, token: str = None):
+    """以JSON数组发送一批回调，接收方拒绝数组格式时退回逐条投递"""
+    if _batch_rejected.get(url):
+        _fan_out(url, items, token)
+        return
+
+    session = get_session(url)
+    async with hold_session(session):
+        response = await session.post(
+            url, json=items, headers=_auth_headers(token), timeout=Config.CALLBACK_TIMEOUT)
+    _raise_for_retry(url, response.status_code)
+    if response.status_code in BATCH_REJECTED_CODES:
+        logger.info("Callback receiver %s rejected a batch with %s, delivering one by one",
+                    url, response.status_code)
+        _batch_rejected.set(url, True)
+        _fan_out(url, items, token)
+    elif response.status_code >= 400:
+        logger.warning("Callback batch to %s rejected with %s, not retrying", url, response.status_code)
+
+
+@dramatiq.actor(
+    queue_name=Config.CALLBACK_QUEUE,
+    max_retries=Config.CALLBACK_MAX_RETRIES,
+    min_backoff=Config.CALLBACK_MIN_BACKOFF_MS,
+    max_backoff=Config.CALLBACK_MAX_BACKOFF_MS,
+    time_limit=Config.CALLBACK_TIME_LIMIT_MS
+)
+async def deliver_callback(url: str, data: dict, token: str = None):
+    """投递任务回调"""
+    await post_callback(url, data, token)
+
+
+@dramatiq.actor(
+    queue_name=Config.CALLBACK_QUEUE,
+    max_retries=Config.CALLBACK_MAX_RETRIES,
+    min_backoff=Config.CALLBACK_MIN_BACKOFF_MS,
+    max_backoff=Config.CALLBACK_MAX_BACKOFF_MS,
+    time_limit=Config.CALLBACK_TIME_LIMIT_MS
+)
+async def deliver_callback_batch(url: str, items: list, token: str = None):
+    """投递一批发往同一URL的任务回调"""
+    await post_callback_batch(url, items, token)
+
+
+def batch_policy(url: str) -> Optional[dict]:
+    """
+    返回URL的批量投递策略 {"interval_ms", "max_items"}，未开启批量时返回None。
+    CALLBACK_BATCH_POLICIES 按URL前缀覆盖默认值，最长的前缀优先。
+    """
+    policy = {
+        "enabled": Config.CALLBACK_BATCH_ENABLED,
+        "interval_ms": Config.CALLBACK_BATCH_INTERVAL_MS,
+        "max_items": Config.CALLBACK_BATCH_MAX_ITEMS,
+    }
+    prefixes = [prefix for prefix in Config.CALLBACK_BATCH_POLICIES if url.startswith(prefix)]
+    if prefixes:
+        policy.update(Config.CALLBACK_BATCH_POLICIES[max(prefixes, key=len)])
+    return policy if policy["enabled"] else None
+
+
+async def _flush_batch(url: str, token: Optional[str], items: list):
+    deliver_callback_batch.send(url, items, token)
+    _batch_stats["batches"] += 1
+    _batch_stats["items"] += len(items)
+    # 刷写期间没有await，不会有新的回调进入，缓冲区可以直接移除
+    buffer = _batch_buffers.pop((url, token), None)
+    if buffer is not None:
+        buffer.discard()
+
+
+async def send_callback(url: str, data: dict, token: str = None, task_id: int = None):
+    """投递回调：该URL开启批量时先进入缓冲区，否则立即入队"""
+    policy = batch_policy(url)
+    if policy is None:
+        deliver_callback.send(url, data, token)
+        return
+
+    key = (url, token)
+    buffer = _batch_buffers.get(key)
+    if buffer is None:
+        buffer = _batch_buffers[key] = WriteBehindBuffer(
+            "callback_batch",
+            partial(_flush_batch, url, token),
+            interval_ms=policy["interval_ms"],
+            max_items=policy["max_items"],
+            metrics=False
+        )
+    await buffer.add({"task_id": task_id, **data})
+
+
+def batch_stats() -> dict:
+    return {
+        **_batch_stats,
+        "pending_urls": len(_batch_buffers),
+        "pending": sum(buffer.stats()["pending"] for buffer in _batch_buffers.values()),
+    }
+
+
+register_collector("callback_batch", batch_stats)
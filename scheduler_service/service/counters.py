@@ -0,0 +1,307 @@
+"""cron 任务的循环计数
+
+CRON_COUNT_MODE = "redis" 时，每次触发只在 Redis 哈希上 HINCRBY，不更新 RequestTask。
+API 进程每 CRON_COUNT_FLUSH_INTERVAL_MS 把累计的增量取出，用一条批量UPDATE
+（cron_count = cron_count + delta）写回数据库；读取任务时把尚未写回的增量加到 cron_count 上。
+
+刷写时增量整体转移到 flushing 哈希并分配批次ID，写库成功后按批次ID删除。
+写库与记录批次ID（CronCountFlush）在同一个事务中，同一批次只会写回一次：
+写库后删除失败、进程崩溃或锁过期后另一个进程重复刷写时，再次写回会被跳过。
+写库失败的批次在下次刷写时原样重试，之后再刷写新的增量；
+读取时同时计入两个哈希，因此刷写过程中接口返回的计数不会变小。
+"sync" 模式下每次触发直接更新数据库。
+"""
+import asyncio
+import os
+import uuid
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from tortoise.transactions import in_transaction
+
+from scheduler_service.config import Config
+from scheduler_service.models import CronCountFlush, RequestTask
+from scheduler_service.utils.logger import logger
+from scheduler_service.utils.metrics import register_collector
+from scheduler_service.utils.redis import get_redis
+
+# 返回 {批次ID, flushing 的全部内容, 是否为上次未删除的批次}，没有增量时返回空。
+# 上次的批次仍在 flushing 中时原样返回，不合并新的增量，同一批次ID的内容不会改变
+BEGIN_FLUSH_LUA = """
+local id = redis.call('GET', KEYS[3])
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    if not id then
+        id = ARGV[1]
+        redis.call('SET', KEYS[3], id)
+    end
+    return {id, redis.call('HGETALL', KEYS[2]), 1}
+end
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return {}
+end
+redis.call('RENAME', KEYS[1], KEYS[2])
+redis.call('SET', KEYS[3], ARGV[1])
+return {ARGV[1], redis.call('HGETALL', KEYS[2]), 0}
+"""
+
+# 只删除仍是该批次的 flushing，锁过期后其他进程开始的新批次不受影响
+COMMIT_FLUSH_LUA = """
+if redis.call('GET', KEYS[2]) == ARGV[1] then
+    redis.call('DEL', KEYS[1], KEYS[2])
+end
+if redis.call('GET', KEYS[3]) == ARGV[2] then
+    redis.call('DEL', KEYS[3])
+end
+"""
+
+RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+EXTEND_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# 刷写锁的有效期，避免多个 API 进程同时写回同一批增量
+FLUSH_LOCK_MS = 30000
+
+
+class FlushLockLost(Exception):
+    """写库期间刷写锁已过期，回滚本次写库"""
+
+
+class MemoryBackend:
+    """进程内实现，用于测试和单进程部署"""
+
+    def __init__(self):
+        self._pending: Dict[int, int] = {}
+        self._flushing: Dict[int, int] = {}
+        self._flush_id: Optional[str] = None
+
+    async def incr(self, task_ids: Iterable[int]):
+        for task_id in task_ids:
+            self._pending[task_id] = self._pending.get(task_id, 0) + 1
+
+    async def get_many(self, task_ids: List[int]) -> Dict[int, int]:
+        counts = {}
+        for task_id in task_ids:
+            count = self._pending.get(task_id, 0) + self._flushing.get(task_id, 0)
+            if count:
+                counts[task_id] = count
+        return counts
+
+    async def begin_flush(self) -> Optional[Tuple[str, Dict[int, int], bool]]:
+        if self._flushing:
+            return self._flush_id, dict(self._flushing), True
+        if not self._pending:
+            return None, {}, False
+        self._flushing, self._pending = self._pending, {}
+        self._flush_id = uuid.uuid4().hex
+        return self._flush_id, dict(self._flushing), False
+
+    async def extend_lock(self) -> bool:
+        return True
+
+    async def commit_flush(self, flush_id: Optional[str]):
+        if flush_id == self._flush_id:
+            self._flushing, self._flush_id = {}, None
+
+    async def abort_flush(self):
+        pass
+
+
+class RedisBackend:
+    """所有进程共享的Redis实现"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.flushing_key = f"{key}:flushing"
+        self.flush_id_key = f"{key}:flushing:id"
+        self.lock_key = f"{key}:lock"
+        self._lock_token = None
+
+    async def incr(self, task_ids: Iterable[int]):
+        pipe = get_redis().pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.hincrby(self.key, task_id, 1)
+        await pipe.execute()
+
+    async def get_many(self, task_ids: List[int]) -> Dict[int, int]:
+        if not task_ids:
+            return {}
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.hmget(self.key, task_ids)
+        pipe.hmget(self.flushing_key, task_ids)
+        pending, flushing = await pipe.execute()
+        counts = {}
+        for task_id, a, b in zip(task_ids, pending, flushing):
+            count = int(a or 0) + int(b or 0)
+            if count:
+                counts[task_id] = count
+        return counts
+
+    async def begin_flush(self) -> Optional[Tuple[str, Dict[int, int], bool]]:
+        """取得刷写锁并返回 (批次ID, 待写回的增量, 是否为上次未删除的批次)，其他进程正在刷写时返回None"""
+        client = get_redis()
+        token = uuid.uuid4().hex
+        if not await client.set(self.lock_key, token, nx=True, px=FLUSH_LOCK_MS):
+            return None
+        self._lock_token = token
+        script = client.register_script(BEGIN_FLUSH_LUA)
+        result = await script(keys=[self.key, self.flushing_key, self.flush_id_key], args=[uuid.uuid4().hex])
+        if not result:
+            return None, {}, False
+        flush_id, items, leftover = result
+        deltas = {int(items[i]): int(items[i + 1]) for i in range(0, len(items), 2)}
+        return flush_id.decode(), deltas, bool(leftover)
+
+    async def extend_lock(self) -> bool:
+        """延长刷写锁，锁已过期或被其他进程取得时返回False"""
+        if self._lock_token is None:
+            return False
+        script = get_redis().register_script(EXTEND_LOCK_LUA)
+        return bool(await script(keys=[self.lock_key], args=[self._lock_token, FLUSH_LOCK_MS]))
+
+    async def commit_flush(self, flush_id: Optional[str]):
+        script = get_redis().register_script(COMMIT_FLUSH_LUA)
+        await script(keys=[self.flushing_key, self.flush_id_key, self.lock_key],
+                     args=[flush_id or "", self._lock_token or ""])
+        self._lock_token = None
+
+    async def abort_flush(self):
+        # flushing 中的批次保留到下次刷写
+        await self._release()
+
+    async def _release(self):
+        if self._lock_token is None:
+            return
+        script = get_redis().register_script(RELEASE_LOCK_LUA)
+        await script(keys=[self.lock_key], args=[self._lock_token])
+        self._lock_token = None
+
+
+_backend = None
+_stats = {"increments": 0, "fallbacks": 0, "flushes": 0, "flushed_tasks": 0, "failures": 0, "duplicates": 0}
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        if os.getenv("UNIT_TESTS") == "1":
+            _backend = MemoryBackend()
+        else:
+            _backend = RedisBackend(Config.CRON_COUNT_KEY)
+    return _backend
+
+
+async def incr_cron_count(task_id: int):
+    """记录一次cron触发"""
+    await incr_cron_counts([task_id])
+
+
+async def incr_cron_counts(task_ids: List[int]):
+    """记录一批任务各触发一次，Redis 不可用时直接更新数据库"""
+    if not task_ids:
+        return
+    if Config.CRON_COUNT_MODE == "redis":
+        try:
+            await get_backend().incr(task_ids)
+            _stats["increments"] += len(task_ids)
+            return
+        except Exception as e:
+            logger.warning("Failed to count %d cron runs in Redis: %s", len(task_ids), e)
+            _stats["fallbacks"] += 1
+    await RequestTask.add_cron_counts([(task_id, 1) for task_id in task_ids])
+
+
+async def pending_cron_counts(task_ids: Iterable[int]) -> Dict[int, int]:
+    """尚未写回数据库的增量，读取失败时返回空字典"""
+    if Config.CRON_COUNT_MODE != "redis":
+        return {}
+    try:
+        return await get_backend().get_many(list(task_ids))
+    except Exception as e:
+        logger.warning("Failed to read pending cron counts: %s", e)
+        return {}
+
+
+async def merge_cron_counts(rows: List[dict]) -> List[dict]:
+    """把尚未写回的增量加到 rows（to_dict/values 的结果）的 cron_count 上"""
+    rows_with_count = [row for row in rows if "cron_count" in row and "id" in row]
+    if not rows_with_count:
+        return rows
+    pending = await pending_cron_counts(row["id"] for row in rows_with_count)
+    for row in rows_with_count:
+        row["cron_count"] += pending.get(row["id"], 0)
+    return rows
+
+
+async def _apply_flush(backend, flush_id: str, deltas: Dict[int, int]) -> bool:
+    """在一个事务中记录批次ID并写回增量，批次已经写回过时返回False"""
+    async with in_transaction() as connection:
+        if not await CronCountFlush.mark_applied(flush_id, using_db=connection):
+            return False
+        await RequestTask.add_cron_counts(list(deltas.items()), using_db=connection)
+        # 提交前确认仍持有刷写锁；锁已过期时回滚，批次留给取得锁的进程
+        if not await backend.extend_lock():
+            raise FlushLockLost(f"Cron count flush lock expired before committing batch {flush_id}")
+    return True
+
+
+async def flush_cron_counts() -> int:
+    """把累计的增量用一条批量UPDATE写回数据库，返回更新的任务数"""
+    backend = get_backend()
+    flushed = set()
+    # 上次未删除的批次写回后，再刷写之后新增的增量
+    for _ in range(2):
+        batch = await backend.begin_flush()
+        if batch is None:
+            break
+        flush_id, deltas, leftover = batch
+        if not deltas:
+            await backend.commit_flush(flush_id)
+            break
+        try:
+            applied = await _apply_flush(backend, flush_id, deltas)
+        except Exception:
+            _stats["failures"] += 1
+            await backend.abort_flush()
+            raise
+        await backend.commit_flush(flush_id)
+        if applied:
+            _stats["flushes"] += 1
+        else:
+            _stats["duplicates"] += 1
+        flushed.update(deltas)
+        if not leftover:
+            break
+    _stats["flushed_tasks"] += len(flushed)
+    return len(flushed)
+
+
+async def run_flusher():
+    """定期刷写循环，在 API 进程中运行，退出时再刷写一次"""
+    try:
+        while True:
+            await asyncio.sleep(Config.CRON_COUNT_FLUSH_INTERVAL_MS / 1000)
+            try:
+                await flush_cron_counts()
+            except Exception as e:
+                logger.warning("Failed to flush cron counts: %s", e)
+    finally:
+        try:
+            await flush_cron_counts()
+        except Exception as e:
+            logger.warning("Failed to flush cron counts on shutdown: %s", e)
+
+
+def cron_count_stats() -> dict:
+    return dict(_stats)
+
+
+register_collector("cron_count", cron_count_stats)
@@ -0,0 +1,209 @@
+"""按 cron 表达式分组的定时任务
+
+CRON_GROUPED = True 时，cron 任务不再各自注册一个 APScheduler 任务，而是按
+（规范化的表达式, 通道）分组：每组只有一个调度任务，成员任务ID保存在 Redis 集合中。
+创建和删除任务只是 SADD / SREM，任务存储的大小取决于不同表达式的数量而不是任务数。
+
+分组任务触发时用 SSCAN 分批读取成员，每批 CRON_GROUP_BATCH_SIZE 个任务发送到队列，
+不会一次把整个集合读入内存，也不会长时间阻塞 Redis。
+"""
+import asyncio
+import hashlib
+import os
+from collections import defaultdict
+from typing import AsyncIterator, Dict, List, Sequence, Set, Tuple
+
+from apscheduler.jobstores.base import ConflictingIdError
+
+from scheduler_service.config import Config
+from scheduler_service.service.counters import incr_cron_counts
+from scheduler_service.service.fairqueue import QueueQuotaExceeded, enqueue_pings
+from scheduler_service.service.leader import check_leader, registers_jobs
+from scheduler_service.service.request import CRON_LANE, DEFAULT_LANE, lane_actor
+from scheduler_service.utils.logger import logger
+from scheduler_service.utils.metrics import register_collector
+from scheduler_service.utils.redis import get_redis
+
+GROUP_JOB_PREFIX = "cron-group:"
+
+
+def normalize_cron(expr: str) -> str:
+    """统一空白和大小写，等价写法（如 "0  *  * * MON"）归入同一组"""
+    return " ".join(expr.split()).lower()
+
+
+def group_id(expr: str, lane: str = None) -> str:
+    key = f"{normalize_cron(expr)}|{lane or ''}"
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def group_job_id(gid: str) -> str:
+    return f"{GROUP_JOB_PREFIX}{gid}"
+
+
+def is_group_job(job_id: str) -> bool:
+    return bool(job_id) and job_id.startswith(GROUP_JOB_PREFIX)
+
+
+def member(task_id: int, user_id: int) -> str:
+    # 默认通道开启公平调度时需要按用户入队
+    return f"{task_id}:{user_id}"
+
+
+def parse_member(value) -> Tuple[int, int]:
+    if isinstance(value, bytes):
+        value = value.decode()
+    task_id, _, user_id = value.partition(":")
+    return int(task_id), int(user_id) if user_id else None
+
+
+class MemoryBackend:
+    """进程内实现，用于测试"""
+
+    def __init__(self):
+        self._groups: Dict[str, Set[str]] = defaultdict(set)
+
+    async def add(self, gid: str, members: Sequence[str]):
+        self._groups[gid].update(members)
+
+    async def remove(self, gid: str, members: Sequence[str]):
+        self._groups[gid].difference_update(members)
+
+    async def count(self, gid: str) -> int:
+        return len(self._groups.get(gid, ()))
+
+    async def scan(self, gid: str, batch_size: int) -> AsyncIterator[List[str]]:
+        items = sorted(self._groups.get(gid, ()))
+        for i in range(0, len(items), batch_size):
+            yield items[i:i + batch_size]
+
+
+class RedisBackend:
+    """所有进程共享的 Redis 集合"""
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+
+    def _key(self, gid: str) -> str:
+        return f"{self.prefix}:{gid}"
+
+    async def add(self, gid: str, members: Sequence[str]):
+        await get_redis().sadd(self._key(gid), *members)
+
+    async def remove(self, gid: str, members: Sequence[str]):
+        await get_redis().srem(self._key(gid), *members)
+
+    async def count(self, gid: str) -> int:
+        return await get_redis().scard(self._key(gid))
+
+    async def scan(self, gid: str, batch_size: int) -> AsyncIterator[List[str]]:
+        client = get_redis()
+        cursor = 0
+        while True:
+            cursor, items = await client.sscan(self._key(gid), cursor, count=batch_size)
+            if items:
+                yield items
+            if cursor == 0:
+                return
+
+
+_backend = None
+_stats = {"fires": 0, "sent": 0, "skipped": 0}
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        if os.getenv("UNIT_TESTS") == "1":
+            _backend = MemoryBackend()
+        else:
+            _backend = RedisBackend(Config.CRON_GROUP_KEY_PREFIX)
+    return _backend
+
+
+def ensure_group_job(scheduler, gid: str, trigger, lane: str = None) -> str:
+    """分组的调度任务不存在时注册，返回任务ID"""
+    job_id = group_job_id(gid)
+    if registers_jobs(scheduler) and scheduler.get_job(job_id) is None:
+        try:
+            scheduler.add_job(trigger_cron_group, trigger, args=[gid, lane], id=job_id)
+        except ConflictingIdError:
+            # 其他进程同时注册了同一分组
+            pass
+    return job_id
+
+
+async def add_tasks(scheduler, tasks: Sequence, triggers: Sequence) -> List[str]:
+    """把cron任务加入各自的分组，返回与 tasks 对应的调度任务ID"""
+    members = defaultdict(list)
+    job_ids = []
+    for task, trigger in zip(tasks, triggers):
+        gid = group_id(task.cron, task.lane)
+        job_ids.append(ensure_group_job(scheduler, gid, trigger, task.lane))
+        members[gid].append(member(task.id, task.user_id))
+    backend = get_backend()
+    for gid, group_members in members.items():
+        await backend.add(gid, group_members)
+    return job_ids
+
+
+async def remove_tasks(tasks: Sequence):
+    """把cron任务移出分组；分组的调度任务保留，空分组触发时没有开销"""
+    members = defaultdict(list)
+    for task in tasks:
+        members[group_id(task.cron, task.lane)].append(member(task.id, task.user_id))
+    backend = get_backend()
+    for gid, group_members in members.items():
+        await backend.remove(gid, group_members)
+
+
+async def _send_batch(members: List[Tuple[int, int]], lane: str) -> List[int]:
+    """发送一批任务，返回已发送的任务ID"""
+    if lane == DEFAULT_LANE and Config.FAIR_QUEUE_ENABLED:
+        by_user = defaultdict(list)
+        for task_id, user_id in members:
+            by_user[user_id].append(task_id)
+        sent = []
+        for user_id, task_ids in by_user.items():
+            try:
+                await enqueue_pings(user_id, task_ids)
+                sent.extend(task_ids)
+            except QueueQuotaExceeded as e:
+                logger.warning("Skipping %d cron runs of user %s: %s", len(task_ids), user_id, e)
+                _stats["skipped"] += len(task_ids)
+        return sent
+    actor = lane_actor(lane)
+    for task_id, _ in members:
+        actor.send(task_id)
+    return [task_id for task_id, _ in members]
+
+
+async def trigger_cron_group(gid: str, lane: str = None):
+    """由APScheduler调用：分批发送分组中的所有任务并更新循环计数"""
+    if not await check_leader():
+        logger.warning("Skipping cron group %s: not the scheduler leader", gid)
+        return
+
+    lane = lane or CRON_LANE
+    _stats["fires"] += 1
+    # SSCAN 在集合扩容期间可能重复返回成员
+    seen = set()
+    async for batch in get_backend().scan(gid, Config.CRON_GROUP_BATCH_SIZE):
+        members = []
+        for value in batch:
+            task_id, user_id = parse_member(value)
+            if task_id not in seen:
+                seen.add(task_id)
+                members.append((task_id, user_id))
+        sent = await _send_batch(members, lane)
+        await incr_cron_counts(sent)
+        _stats["sent"] += len(sent)
+        # 大分组分批让出事件循环
+        await asyncio.sleep(0)
+
+
+def cron_group_stats() -> dict:
+    return dict(_stats)
+
+
+register_collector("cron_group", cron_group_stats)
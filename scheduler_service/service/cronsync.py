@@ -0,0 +1,211 @@
+"""从数据库加载 NativeScheduler 的任务
+
+NativeScheduler 只在内存中保存任务，RequestTask 的 cron 和 job_id 是唯一的持久化来源。
+执行任务的进程启动时分批加载全部cron任务，之后每 CRON_ENGINE_SYNC_MS 加载ID更大的任务
+（其他 API 进程新建的任务）；API 先插入记录再保存 job_id，加载时 job_id 还是空的任务记下ID，
+之后每次同步重新检查。每 CRON_ENGINE_FULL_SYNC_MS 与数据库全量对比一次，
+删除已不存在的任务并补上遗漏的任务（例如晚提交的事务中ID较小的任务）。
+API 删除任务后通过 CRON_ENGINE_REMOVE_CHANNEL 通知执行任务的进程立即移除，全量对比只是兜底。
+分组任务（job_id 以 cron-group: 开头）按 (表达式, 通道) 注册一个调度任务，成员仍在Redis集合中。
+"""
+import asyncio
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from apscheduler.triggers.cron import CronTrigger
+
+from scheduler_service.config import Config
+from scheduler_service.models import RequestTask
+from scheduler_service.service.crongroup import group_id, is_group_job, trigger_cron_group
+from scheduler_service.service.request import trigger_cron_task
+from scheduler_service.utils.cronengine import NativeScheduler
+from scheduler_service.utils.logger import logger
+from scheduler_service.utils.metrics import register_collector
+from scheduler_service.utils.redis import get_redis
+
+LOAD_CHUNK_SIZE = 10000
+CRON_FIELDS = ("id", "user_id", "cron", "lane", "job_id")
+
+# 上次对比时数据库中没有的任务ID；本进程刚添加、job_id 尚未保存的任务不会被误删
+_suspects = set()
+# 加载时 job_id 尚未保存的任务ID，每次增量同步重新检查
+_pending = set()
+
+
+def _jobs(rows: Iterable[tuple], triggers: Dict[str, Optional[CronTrigger]]) -> List[Tuple]:
+    """把任务行转换为 NativeScheduler.add_jobs 的参数，相同表达式共用一个触发器"""
+    jobs = []
+    for task_id, user_id, cron, lane, job_id in rows:
+        if not job_id:
+            continue
+        if cron not in triggers:
+            try:
+                triggers[cron] = CronTrigger.from_crontab(cron)
+            except ValueError as e:
+                logger.warning("Skipping cron task %s: %s", task_id, e)
+                triggers[cron] = None
+        trigger = triggers[cron]
+        if trigger is None:
+            continue
+        if is_group_job(job_id):
+            jobs.append((job_id, trigger_cron_group, trigger, [group_id(cron, lane), lane]))
+        else:
+            jobs.append((job_id, trigger_cron_task, trigger, [task_id, user_id, lane]))
+    return jobs
+
+
+def _add_rows(scheduler: NativeScheduler, rows: List[tuple], triggers: Dict[str, Optional[CronTrigger]]) -> int:
+    """添加任务行对应的调度任务，job_id 为空的任务记入 _pending"""
+    for row in rows:
+        if row[4]:
+            _pending.discard(row[0])
+        else:
+            _pending.add(row[0])
+    return scheduler.add_jobs(_jobs(rows, triggers))
+
+
+async def load_pending_jobs(scheduler: NativeScheduler) -> int:
+    """重新检查上次加载时 job_id 为空的任务，返回新添加的任务数"""
+    if not _pending:
+        return 0
+    task_ids = list(_pending)
+    added = 0
+    triggers = {}
+    for i in range(0, len(task_ids), LOAD_CHUNK_SIZE):
+        chunk = task_ids[i:i + LOAD_CHUNK_SIZE]
+        rows = await RequestTask.filter(id__in=chunk).values_list(*CRON_FIELDS)
+        # 已删除的任务不再检查
+        _pending.difference_update(set(chunk) - {row[0] for row in rows})
+        added += _add_rows(scheduler, rows, triggers)
+    return added
+
+
+async def load_cron_jobs(scheduler: NativeScheduler, after_id: int = 0) -> int:
+    """分批加载ID大于 after_id 的cron任务，已存在的任务跳过，返回加载到的最大ID。
+    job_id 尚未保存的任务由 load_pending_jobs 在之后的同步中加载。"""
+    triggers = {}
+    while True:
+        rows = await RequestTask.filter(cron__not_isnull=True, id__gt=after_id).order_by("id") \
+            .limit(LOAD_CHUNK_SIZE).values_list(*CRON_FIELDS)
+        if not rows:
+            return after_id
+        _add_rows(scheduler, rows, triggers)
+        after_id = rows[-1][0]
+        # 大量任务时让出事件循环，不阻塞正在触发的任务
+        await asyncio.sleep(0)
+
+
+async def reconcile_cron_jobs(scheduler: NativeScheduler) -> Tuple[int, int]:
+    """与数据库全量对比，返回 (补上的任务数, 删除的任务数)。
+    连续两次对比都不在数据库中的任务才删除。"""
+    global _suspects
+    rows = await RequestTask.filter(cron__not_isnull=True).values_list("id", "job_id")
+    task_ids = {}
+    for task_id, job_id in rows:
+        if job_id:
+            task_ids.setdefault(job_id, task_id)
+
+    removed = 0
+    suspects = set()
+    for job in scheduler.get_jobs():
+        if job.func in (trigger_cron_task, trigger_cron_group) and job.id not in task_ids:
+            if job.id in _suspects:
+                scheduler.remove_job(job.id)
+                removed += 1
+            else:
+                suspects.add(job.id)
+    _suspects = suspects
+
+    # 每个缺少的调度任务（分组只需其中一个成员）重新加载
+    missing = [task_id for job_id, task_id in task_ids.items() if scheduler.get_job(job_id) is None]
+    added = 0
+    triggers = {}
+    for i in range(0, len(missing), LOAD_CHUNK_SIZE):
+        rows = await RequestTask.filter(id__in=missing[i:i + LOAD_CHUNK_SIZE]).values_list(*CRON_FIELDS)
+        added += scheduler.add_jobs(_jobs(rows, triggers))
+    if added or removed:
+        logger.info("Reconciled cron jobs: %d added, %d removed", added, removed)
+    return added, removed
+
+
+def remove_jobs(scheduler: NativeScheduler, job_ids: Iterable[str]) -> int:
+    """移除已删除任务的调度任务，返回移除的任务数"""
+    removed = 0
+    for job_id in job_ids:
+        _suspects.discard(job_id)
+        if scheduler.get_job(job_id) is not None:
+            scheduler.remove_job(job_id)
+            removed += 1
+    return removed
+
+
+async def publish_removed(scheduler, job_ids: List[str]):
+    """通知执行任务的进程移除已删除任务的调度任务。
+    必须在删除数据库记录之后调用，否则同步可能把任务重新加载回来。"""
+    # APScheduler 的任务存储是共享的，本进程移除即可
+    if not job_ids or not isinstance(scheduler, NativeScheduler) or os.getenv("UNIT_TESTS") == "1":
+        return
+    try:
+        await get_redis().publish(Config.CRON_ENGINE_REMOVE_CHANNEL, "\n".join(job_ids))
+    except Exception as e:
+        # 通知失败时由全量对比删除
+        logger.warning("Failed to publish removed cron jobs %s: %s", job_ids, e)
+
+
+async def listen_removed(scheduler: NativeScheduler):
+    """订阅删除通知并移除对应的调度任务，断线后自动重连"""
+    while True:
+        try:
+            pubsub = get_redis().pubsub()
+            await pubsub.subscribe(Config.CRON_ENGINE_REMOVE_CHANNEL)
+            try:
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    data = message["data"]
+                    if isinstance(data, bytes):
+                        data = data.decode()
+                    remove_jobs(scheduler, data.split("\n"))
+            finally:
+                await pubsub.aclose()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 断线期间的删除由全量对比处理
+            logger.warning("Cron removal listener error: %s", e)
+            await asyncio.sleep(1)
+
+
+async def run_sync(scheduler: NativeScheduler):
+    """加载全部cron任务，之后定期增量加载和全量对比"""
+    listener = asyncio.create_task(listen_removed(scheduler))
+    last_id = 0
+    last_full = time.monotonic()
+    loaded = False
+    try:
+        while True:
+            try:
+                if loaded and (time.monotonic() - last_full) * 1000 >= Config.CRON_ENGINE_FULL_SYNC_MS:
+                    await reconcile_cron_jobs(scheduler)
+                    last_full = time.monotonic()
+                await load_pending_jobs(scheduler)
+                last_id = await load_cron_jobs(scheduler, last_id)
+                if not loaded:
+                    loaded = True
+                    logger.info("Loaded %d cron jobs into the native scheduler", len(scheduler.get_jobs()))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Failed to sync cron jobs: %s", e)
+            await asyncio.sleep(Config.CRON_ENGINE_SYNC_MS / 1000)
+    finally:
+        listener.cancel()
+
+
+def start_sync(scheduler) -> Optional[asyncio.Task]:
+    """调度器是 NativeScheduler 时启动同步任务，由调用方在退出时取消"""
+    if not isinstance(scheduler, NativeScheduler):
+        return None
+    register_collector("cron_engine", scheduler.stats)
+    return asyncio.create_task(run_sync(scheduler))
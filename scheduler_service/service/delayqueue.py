@@ -0,0 +1,218 @@
+"""远期一次性任务的延迟队列
+
+Dramatiq worker 会预取带 eta 的消息并在内存中保存到执行时间，几天后才执行的大量任务会让
+worker 内存持续增长，重启时还会被重新投递。开启 DELAY_QUEUE_ENABLED 后，start_time 晚于
+DELAY_QUEUE_THRESHOLD_MS 的一次性任务只写入按执行时间排序的 Redis ZSET，
+API 进程中的调度循环在执行前 DELAY_QUEUE_LOOKAHEAD_MS 内把到期任务批量发送到各自通道的队列
+（仍带 eta，保证准时），删除任务时 ZREM 即可取消。
+
+取出到期任务时不删除，而是把分数改为租约到期时间（DELAY_QUEUE_LEASE_MS 之后），发送成功后才 ZREM，
+并把消息ID写回任务，之后删除任务仍可中止消息。进程在发送前崩溃时，任务在租约到期后被重新取出；
+发送后、确认前崩溃时可能重复发送，确认时发现任务已被删除或已被其他进程确认的消息会被中止。
+"""
+import asyncio
+import os
+import time
+from typing import Dict, List, Sequence, Tuple
+
+from dramatiq_abort import abort
+
+from scheduler_service.config import Config
+from scheduler_service.models import RequestTask
+from scheduler_service.service.request import DEFAULT_LANE, lane_actor
+from scheduler_service.utils.logger import logger
+from scheduler_service.utils.metrics import register_collector
+from scheduler_service.utils.redis import get_redis
+
+# 租借最多 ARGV[2] 个分数不大于 ARGV[1] 的成员：分数改为租约到期时间 ARGV[3]，返回原来的分数，
+# 多个调度进程不会在租约期内取到同一个任务
+LEASE_DUE_LUA = """
+local items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, ARGV[2])
+for i = 1, #items, 2 do
+    redis.call('ZADD', KEYS[1], 'XX', ARGV[3], items[i])
+end
+return items
+"""
+
+PUSH_CHUNK_SIZE = 1000
+
+
+def member(task_id: int, lane: str = None) -> str:
+    """ZSET 成员，包含发送时需要的通道"""
+    return f"{task_id}:{lane or DEFAULT_LANE}"
+
+
+def parse_member(value) -> Tuple[int, str]:
+    if isinstance(value, bytes):
+        value = value.decode()
+    task_id, _, lane = value.partition(":")
+    return int(task_id), lane or DEFAULT_LANE
+
+
+class MemoryBackend:
+    """进程内实现，用于测试"""
+
+    def __init__(self):
+        self._items: Dict[str, int] = {}
+
+    async def push(self, items: Sequence[Tuple[str, int]]):
+        self._items.update(items)
+
+    async def remove(self, members: Sequence[str]) -> int:
+        return sum(self._items.pop(m, None) is not None for m in members)
+
+    async def lease_due(self, max_score: int, limit: int, lease_score: int) -> List[Tuple[str, int]]:
+        due = sorted((score, m) for m, score in self._items.items() if score <= max_score)[:limit]
+        for _, m in due:
+            self._items[m] = lease_score
+        return [(m, score) for score, m in due]
+
+    async def release(self, items: Sequence[Tuple[str, int]]):
+        for m, score in items:
+            if m in self._items:
+                self._items[m] = score
+
+    async def ack(self, members: Sequence[str]) -> List[bool]:
+        return [self._items.pop(m, None) is not None for m in members]
+
+    async def size(self) -> int:
+        return len(self._items)
+
+
+class RedisBackend:
+    """所有 API 进程共享的 Redis ZSET"""
+
+    def __init__(self, key: str):
+        self.key = key
+
+    async def push(self, items: Sequence[Tuple[str, int]]):
+        pipe = get_redis().pipeline(transaction=False)
+        for i in range(0, len(items), PUSH_CHUNK_SIZE):
+            pipe.zadd(self.key, dict(items[i:i + PUSH_CHUNK_SIZE]))
+        await pipe.execute()
+
+    async def remove(self, members: Sequence[str]) -> int:
+        return await get_redis().zrem(self.key, *members)
+
+    async def lease_due(self, max_score: int, limit: int, lease_score: int) -> List[Tuple[str, int]]:
+        script = get_redis().register_script(LEASE_DUE_LUA)
+        items = await script(keys=[self.key], args=[max_score, limit, lease_score])
+        return [(items[i], int(float(items[i + 1]))) for i in range(0, len(items), 2)]
+
+    async def release(self, items: Sequence[Tuple[str, int]]):
+        """恢复原来的分数，已被删除的任务不会重新加入"""
+        pipe = get_redis().pipeline(transaction=False)
+        for m, score in items:
+            pipe.zadd(self.key, {m: score}, xx=True)
+        await pipe.execute()
+
+    async def ack(self, members: Sequence[str]) -> List[bool]:
+        """逐个删除已发送的任务，返回每个任务是否仍在延迟队列中"""
+        pipe = get_redis().pipeline(transaction=False)
+        for m in members:
+            pipe.zrem(self.key, m)
+        return [bool(removed) for removed in await pipe.execute()]
+
+    async def size(self) -> int:
+        return await get_redis().zcard(self.key)
+
+
+_backend = None
+_stats = {"scheduled": 0, "dispatched": 0, "cancelled": 0, "failures": 0, "aborted": 0}
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        if os.getenv("UNIT_TESTS") == "1":
+            _backend = MemoryBackend()
+        else:
+            _backend = RedisBackend(Config.DELAY_QUEUE_KEY)
+    return _backend
+
+
+def is_delayed(start_time: float) -> bool:
+    """start_time（时间戳）是否远到需要进入延迟队列"""
+    return (Config.DELAY_QUEUE_ENABLED
+            and int(start_time * 1000) - int(time.time() * 1000) > Config.DELAY_QUEUE_THRESHOLD_MS)
+
+
+async def schedule_pings(items: Sequence[Tuple[int, str, float]]):
+    """把 [(task_id, 通道, start_time)] 写入延迟队列"""
+    if not items:
+        return
+    await get_backend().push([(member(task_id, lane), int(start_time * 1000))
+                              for task_id, lane, start_time in items])
+    _stats["scheduled"] += len(items)
+
+
+async def cancel_pings(items: Sequence[Tuple[int, str]]) -> int:
+    """从延迟队列中删除 [(task_id, 通道)]，返回删除的数量"""
+    if not items:
+        return 0
+    removed = await get_backend().remove([member(task_id, lane) for task_id, lane in items])
+    _stats["cancelled"] += removed
+    return removed
+
+
+async def dispatch_due(now_ms: int = None) -> int:
+    """把即将到期的任务发送到各自通道的队列，返回发送的数量"""
+    now_ms = now_ms or int(time.time() * 1000)
+    backend = get_backend()
+    items = await backend.lease_due(now_ms + Config.DELAY_QUEUE_LOOKAHEAD_MS, Config.DELAY_QUEUE_BATCH_SIZE,
+                                    now_ms + Config.DELAY_QUEUE_LEASE_MS)
+    sent = []
+    try:
+        for value, eta in items:
+            task_id, lane = parse_member(value)
+            if eta > now_ms:
+                message = lane_actor(lane).send_with_options(args=[task_id], eta=eta)
+            else:
+                message = lane_actor(lane).send(task_id)
+            sent.append((value, task_id, message.message_id))
+    except Exception:
+        # 发送失败的任务恢复原来的分数，下一轮重试
+        _stats["failures"] += 1
+        await backend.release(items[len(sent):])
+        raise
+    finally:
+        if sent:
+            await _ack(backend, sent)
+    _stats["dispatched"] += len(sent)
+    return len(sent)
+
+
+async def _ack(backend, sent: Sequence[Tuple[str, int, str]]):
+    """确认已发送的任务并写回消息ID；确认时已不在延迟队列中的任务（已被删除或重复发送）中止消息"""
+    acked = await backend.ack([value for value, _, _ in sent])
+    for (_, _, message_id), ok in zip(sent, acked):
+        if not ok:
+            abort(message_id)
+            _stats["aborted"] += 1
+    await RequestTask.set_message_ids(
+        [(task_id, message_id) for (_, task_id, message_id), ok in zip(sent, acked) if ok])
+
+
+async def run_dispatcher():
+    """调度循环，在 API 进程中运行"""
+    while True:
+        try:
+            if await dispatch_due() < Config.DELAY_QUEUE_BATCH_SIZE:
+                await asyncio.sleep(Config.DELAY_QUEUE_POLL_MS / 1000)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Delay queue dispatch failed: %s", e)
+            await asyncio.sleep(1)
+
+
+async def delay_queue_stats() -> dict:
+    stats = dict(_stats)
+    try:
+        stats["pending"] = await get_backend().size()
+    except Exception:
+        stats["pending"] = None
+    return stats
+
+
+register_collector("delay_queue", delay_queue_stats)
@@ -0,0 +1,333 @@
+"""按用户公平调度 ping
+
+开启 FAIR_QUEUE_ENABLED 后，立即执行的 ping 不直接发送到 Dramatiq 队列，
+而是进入各用户的子队列。调度器（dispatcher）按加权轮询从各子队列取出任务发送，
+并把 Dramatiq 队列的积压保持在 FAIR_QUEUE_TARGET_DEPTH 以内，
+这样一个用户的大批量任务只会占用自己的子队列，不会阻塞其他用户。
+
+- FAIR_QUEUE_WEIGHTS: {用户ID: 每轮最多发送的任务数}，默认 FAIR_QUEUE_DEFAULT_WEIGHT
+- FAIR_QUEUE_QUOTAS: {用户ID: 子队列最多积压的任务数}，默认 FAIR_QUEUE_DEFAULT_QUOTA，0 表示不限制
+
+调度器在执行定时任务的进程（beat，或 SCHEDULER_RUN_JOBS 为 True 的 API 进程）中运行。
+无论是否开启高可用，各进程的调度器都竞争同一个租约（FAIR_QUEUE_KEY_PREFIX:dispatcher），
+同一时间只有持有租约的调度器调度，多个进程不会各自按 target_depth 计算可发送数量而超出积压上限。
+取出的任务先移到处理中列表，发送后再确认；发送失败的任务放回子队列头部。
+调度器获得租约时，把上一个持有者遗留在处理中列表的任务放回，已发送但未确认的任务可能被重复发送一次。
+"""
+import asyncio
+import os
+import socket
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Sequence, Tuple
+
+import dramatiq
+
+from scheduler_service.config import Config
+from scheduler_service.utils.leader import LeaderElector
+from scheduler_service.utils.leader import MemoryBackend as MemoryLeaseBackend
+from scheduler_service.utils.leader import RedisBackend as RedisLeaseBackend
+from scheduler_service.utils.logger import logger
+from scheduler_service.utils.metrics import register_collector
+from scheduler_service.utils.queues import queue_depth
+from scheduler_service.utils.redis import get_redis
+
+# 从子队列取出任务并移到处理中列表（元素为 "用户ID:任务ID"），子队列为空时同时从活跃用户集合中移除
+POP_LUA = """
+local items = redis.call('LPOP', KEYS[1], ARGV[1])
+if redis.call('LLEN', KEYS[1]) == 0 then
+    redis.call('SREM', KEYS[2], ARGV[2])
+end
+if not items then
+    return {}
+end
+for _, item in ipairs(items) do
+    redis.call('RPUSH', KEYS[3], ARGV[2] .. ':' .. item)
+end
+return items
+"""
+
+# 把未发送的任务从处理中列表放回子队列头部，保持原来的顺序
+REQUEUE_LUA = """
+for i = #ARGV, 2, -1 do
+    redis.call('LREM', KEYS[3], 1, ARGV[1] .. ':' .. ARGV[i])
+    redis.call('LPUSH', KEYS[1], ARGV[i])
+end
+redis.call('SADD', KEYS[2], ARGV[1])
+"""
+
+PUSH_CHUNK_SIZE = 1000
+
+
+class QueueQuotaExceeded(Exception):
+    """用户子队列积压超过配额"""
+
+
+class MemoryBackend:
+    """进程内子队列，用于测试和基准测试"""
+
+    def __init__(self):
+        self._queues: Dict[int, deque] = {}
+        self._processing: List[Tuple[int, int]] = []
+
+    async def backlog(self, user_id: int) -> int:
+        return len(self._queues.get(user_id, ()))
+
+    async def push(self, user_id: int, task_ids: Sequence[int]):
+        self._queues.setdefault(user_id, deque()).extend(task_ids)
+
+    async def pop(self, user_id: int, count: int) -> List[int]:
+        queue = self._queues.get(user_id)
+        if not queue:
+            return []
+        items = [queue.popleft() for _ in range(min(count, len(queue)))]
+        if not queue:
+            del self._queues[user_id]
+        self._processing.extend((user_id, task_id) for task_id in items)
+        return items
+
+    async def ack(self, user_id: int, task_ids: Sequence[int]):
+        for task_id in task_ids:
+            self._processing.remove((user_id, task_id))
+
+    async def requeue(self, user_id: int, task_ids: Sequence[int]):
+        await self.ack(user_id, task_ids)
+        self._queues.setdefault(user_id, deque()).extendleft(reversed(task_ids))
+
+    async def processing(self) -> List[Tuple[int, int]]:
+        return list(self._processing)
+
+    async def active_users(self) -> List[int]:
+        return sorted(self._queues)
+
+
+class RedisBackend:
+    """所有 API 进程共享的 Redis 子队列"""
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.active_key = f"{prefix}:active"
+        self.processing_key = f"{prefix}:processing"
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.prefix}:user:{user_id}"
+
+    async def backlog(self, user_id: int) -> int:
+        return await get_redis().llen(self._key(user_id))
+
+    async def push(self, user_id: int, task_ids: Sequence[int]):
+        pipe = get_redis().pipeline(transaction=True)
+        for i in range(0, len(task_ids), PUSH_CHUNK_SIZE):
+            pipe.rpush(self._key(user_id), *task_ids[i:i + PUSH_CHUNK_SIZE])
+        pipe.sadd(self.active_key, user_id)
+        await pipe.execute()
+
+    async def pop(self, user_id: int, count: int) -> List[int]:
+        script = get_redis().register_script(POP_LUA)
+        items = await script(keys=[self._key(user_id), self.active_key, self.processing_key], args=[count, user_id])
+        return [int(item) for item in items]
+
+    async def ack(self, user_id: int, task_ids: Sequence[int]):
+        pipe = get_redis().pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.lrem(self.processing_key, 1, f"{user_id}:{task_id}")
+        await pipe.execute()
+
+    async def requeue(self, user_id: int, task_ids: Sequence[int]):
+        script = get_redis().register_script(REQUEUE_LUA)
+        await script(keys=[self._key(user_id), self.active_key, self.processing_key], args=[user_id, *task_ids])
+
+    async def processing(self) -> List[Tuple[int, int]]:
+        items = await get_redis().lrange(self.processing_key, 0, -1)
+        return [(int(user_id), int(task_id)) for user_id, _, task_id in (item.partition(b":") for item in items)]
+
+    async def active_users(self) -> List[int]:
+        return sorted(int(user_id) for user_id in await get_redis().smembers(self.active_key))
+
+
+class FairQueue:
+    """
+    加权轮询调度器。
+
+    :param send: 发送一个任务，例如 ping.send
+    :param depth: 返回下游队列当前积压的消息数
+    """
+
+    def __init__(self, backend, send: Callable[[int], object], depth: Callable[[], Awaitable[int]],
+                 target_depth: int = 200, weights: dict = None, default_weight: int = 10,
+                 quotas: dict = None, default_quota: int = 0):
+        self.backend = backend
+        self.send = send
+        self.depth = depth
+        self.target_depth = target_depth
+        # TOML中的键为字符串
+        self.weights = {int(k): v for k, v in (weights or {}).items()}
+        self.default_weight = default_weight
+        self.quotas = {int(k): v for k, v in (quotas or {}).items()}
+        self.default_quota = default_quota
+        self._offset = 0
+        self._stats = {"pushed": 0, "dispatched": 0, "rounds": 0, "rejected": 0, "active_users": 0, "recovered": 0}
+
+    def weight(self, user_id: int) -> int:
+        return max(1, self.weights.get(user_id, self.default_weight))
+
+    def quota(self, user_id: int) -> int:
+        return self.quotas.get(user_id, self.default_quota)
+
+    async def push(self, user_id: int, task_ids: Sequence[int]):
+        """把任务放入用户的子队列，超过配额时整批拒绝"""
+        if not task_ids:
+            return
+        quota = self.quota(user_id)
+        if quota and await self.backend.backlog(user_id) + len(task_ids) > quota:
+            self._stats["rejected"] += len(task_ids)
+            raise QueueQuotaExceeded(f"User {user_id} has too many queued tasks (quota {quota})")
+        await self.backend.push(user_id, list(task_ids))
+        self._stats["pushed"] += len(task_ids)
+
+    async def dispatch_round(self) -> int:
+        """
+        执行一轮加权轮询，返回发送的任务数。
+        每轮从上一轮的下一个用户开始，每个用户最多发送其权重数量的任务。
+        """
+        capacity = self.target_depth - await self.depth()
+        if capacity <= 0:
+            return 0
+        users = await self.backend.active_users()
+        self._stats["active_users"] = len(users)
+        if not users:
+            return 0
+
+        start = self._offset % len(users)
+        self._offset += 1
+        dispatched = 0
+        for user_id in users[start:] + users[:start]:
+            if dispatched >= capacity:
+                break
+            task_ids = await self.backend.pop(user_id, min(self.weight(user_id), capacity - dispatched))
+            sent = 0
+            try:
+                for task_id in task_ids:
+                    self.send(task_id)
+                    sent += 1
+            finally:
+                # 发送失败时确认已发送的部分，其余放回子队列
+                if sent:
+                    await self.backend.ack(user_id, task_ids[:sent])
+                if sent < len(task_ids):
+                    await self.backend.requeue(user_id, task_ids[sent:])
+                dispatched += sent
+
+        self._stats["rounds"] += 1
+        self._stats["dispatched"] += dispatched
+        return dispatched
+
+    async def recover(self) -> int:
+        """把上一个调度器遗留在处理中列表的任务放回子队列，返回放回的任务数"""
+        pending: Dict[int, List[int]] = {}
+        for user_id, task_id in await self.backend.processing():
+            pending.setdefault(user_id, []).append(task_id)
+        for user_id, task_ids in pending.items():
+            await self.backend.requeue(user_id, task_ids)
+        count = sum(len(task_ids) for task_ids in pending.values())
+        self._stats["recovered"] += count
+        return count
+
+    async def run(self, poll_ms: int = 50, active: Callable[[], bool] = None):
+        """
+        持续调度，没有可发送的任务时等待 poll_ms 毫秒。
+        active 返回False时（没有持有租约）不调度，每次开始调度前先恢复处理中列表。
+        """
+        recovered = False
+        while True:
+            try:
+                if active and not active():
+                    recovered = False
+                    await asyncio.sleep(poll_ms / 1000)
+                    continue
+                if not recovered:
+                    count = await self.recover()
+                    if count:
+                        logger.info("Fair queue requeued %d tasks left by a previous dispatcher", count)
+                    recovered = True
+                if not await self.dispatch_round():
+                    await asyncio.sleep(poll_ms / 1000)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Fair queue dispatch failed: %s", e)
+                await asyncio.sleep(1)
+
+    def stats(self) -> dict:
+        return dict(self._stats)
+
+
+_fair_queue: FairQueue = None
+
+
+def get_fair_queue() -> FairQueue:
+    global _fair_queue
+    if _fair_queue is None:
+        # 避免循环导入：ping 所在模块会导入本模块
+        from scheduler_service.service.request import ping
+
+        if os.getenv("UNIT_TESTS") == "1":
+            backend = MemoryBackend()
+        else:
+            backend = RedisBackend(Config.FAIR_QUEUE_KEY_PREFIX)
+
+        async def depth():
+            return await queue_depth(dramatiq.get_broker(), ping.queue_name)
+
+        _fair_queue = FairQueue(
+            backend,
+            send=ping.send,
+            depth=depth,
+            target_depth=Config.FAIR_QUEUE_TARGET_DEPTH,
+            weights=Config.FAIR_QUEUE_WEIGHTS,
+            default_weight=Config.FAIR_QUEUE_DEFAULT_WEIGHT,
+            quotas=Config.FAIR_QUEUE_QUOTAS,
+            default_quota=Config.FAIR_QUEUE_DEFAULT_QUOTA
+        )
+        register_collector("fair_queue", _fair_queue.stats)
+    return _fair_queue
+
+
+async def enqueue_pings(user_id: int, task_ids: Sequence[int]) -> bool:
+    """
+    公平调度开启时把任务放入用户子队列并返回True；
+    未开启时返回False，由调用方直接发送。
+    """
+    if not Config.FAIR_QUEUE_ENABLED:
+        return False
+    await get_fair_queue().push(user_id, task_ids)
+    return True
+
+
+def create_dispatcher_elector() -> LeaderElector:
+    """调度器的租约，与调度器高可用的选举相互独立，未开启高可用时同样生效"""
+    if os.getenv("UNIT_TESTS") == "1":
+        backend = MemoryLeaseBackend()
+    else:
+        backend = RedisLeaseBackend(f"{Config.FAIR_QUEUE_KEY_PREFIX}:dispatcher")
+    elector = LeaderElector(
+        backend,
+        node_id=f"{socket.gethostname()}:{os.getpid()}",
+        ttl_ms=Config.SCHEDULER_LEADER_TTL_MS,
+        renew_ms=Config.SCHEDULER_LEADER_RENEW_MS
+    )
+    register_collector("fair_queue_dispatcher", elector.stats)
+    return elector
+
+
+async def run_dispatcher(elector: LeaderElector = None):
+    """调度循环，在执行定时任务的进程中运行，只有持有租约的进程调度"""
+    elector = elector or create_dispatcher_elector()
+    election = asyncio.create_task(elector.run())
+    try:
+        await get_fair_queue().run(Config.FAIR_QUEUE_POLL_MS, active=lambda: elector.is_leader)
+    finally:
+        election.cancel()
+        try:
+            await election
+        except asyncio.CancelledError:
+            pass
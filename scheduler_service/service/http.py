@@ -0,0 +1,173 @@
+"""ping 使用的 HTTP 客户端、连接池与响应读取
+
+默认所有请求共用一个连接池。HTTP_POOL_PER_HOST 开启后每个目标主机使用独立的连接池，
+单个慢主机最多占满自己的连接数，不会影响其他主机的请求。
+使用者用 hold_session 持有session，超过 HTTP_MAX_HOST_POOLS 被淘汰的连接池在最后一个使用者释放后才关闭。
+"""
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Set
+from urllib.parse import urlsplit
+
+import httpx
+
+from scheduler_service.config import Config
+from scheduler_service.utils.logger import logger
+from scheduler_service.utils.metrics import register_collector
+
+# 定义全局session
+_session = None
+# 按主机划分的session，超过 HTTP_MAX_HOST_POOLS 时关闭最久未使用的
+_host_sessions: "OrderedDict[str, httpx.AsyncClient]" = OrderedDict()
+# 正在使用的session及使用者数量
+_session_users: Dict[httpx.AsyncClient, int] = {}
+# 已被淘汰但仍在使用的session
+_retired: Set[httpx.AsyncClient] = set()
+
+
+def _new_client(max_connections: int, max_keepalive_connections: int) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=Config.HTTP_KEEPALIVE_EXPIRY
+    )
+    if Config.HTTP2:
+        try:
+            return httpx.AsyncClient(timeout=Config.HTTP_TIMEOUT, limits=limits, http2=True)
+        except ImportError:
+            logger.warning("HTTP/2 requires the 'h2' package (pip install httpx[http2]), using HTTP/1.1")
+    return httpx.AsyncClient(timeout=Config.HTTP_TIMEOUT, limits=limits)
+
+
+def _host_key(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def _get_host_session(url: str) -> httpx.AsyncClient:
+    key = _host_key(url)
+    session = _host_sessions.get(key)
+    if session is None or session.is_closed:
+        session = _new_client(Config.HTTP_HOST_MAX_CONNECTIONS, Config.HTTP_HOST_MAX_KEEPALIVE_CONNECTIONS)
+        _host_sessions[key] = session
+        while len(_host_sessions) > Config.HTTP_MAX_HOST_POOLS:
+            _, evicted = _host_sessions.popitem(last=False)
+            if _session_users.get(evicted):
+                _retired.add(evicted)
+            else:
+                asyncio.ensure_future(evicted.aclose())
+    _host_sessions.move_to_end(key)
+    return session
+
+
+def get_session(url: str = None) -> httpx.AsyncClient:
+    """获取httpx会话，开启按主机分池时根据url选择连接池"""
+    global _session
+    if url and Config.HTTP_POOL_PER_HOST:
+        return _get_host_session(url)
+    if _session is None or _session.is_closed:
+        _session = _new_client(Config.HTTP_MAX_CONNECTIONS, Config.HTTP_MAX_KEEPALIVE_CONNECTIONS)
+    return _session
+
+
+@asynccontextmanager
+async def hold_session(session: httpx.AsyncClient):
+    """在发送请求期间持有session，避免被淘汰的连接池关闭正在进行的请求"""
+    _session_users[session] = _session_users.get(session, 0) + 1
+    try:
+        yield session
+    finally:
+        _session_users[session] -= 1
+        if not _session_users[session]:
+            del _session_users[session]
+            if session in _retired:
+                _retired.discard(session)
+                await session.aclose()
+
+
+async def close_session():
+    """关闭所有httpx会话"""
+    global _session
+    if _session and not _session.is_closed:
+        await _session.aclose()
+    while _host_sessions:
+        _, session = _host_sessions.popitem()
+        if not session.is_closed:
+            await session.aclose()
+    while _retired:
+        await _retired.pop().aclose()
+
+
+async def read_response(session: httpx.AsyncClient, request: httpx.Request):
+    """
+    以流的方式发送请求并读取响应，最多保留 PING_MAX_RESPONSE_BYTES 字节，
+    PING_RESPONSE_MODE 为 "headers" 时不读取响应体。
+
+    :return: (状态码, 响应头, 响应体或None, 是否被截断)
+    """
+    response = await session.send(request, stream=True)
+    try:
+        if Config.PING_RESPONSE_MODE == "headers":
+            return response.status_code, response.headers, None, False
+
+        limit = Config.PING_MAX_RESPONSE_BYTES
+        content, truncated = bytearray(), False
+        async for chunk in response.aiter_bytes():
+            remaining = limit - len(content)
+            if len(chunk) > remaining:
+                content += chunk[:remaining]
+                truncated = True
+                break
+            content += chunk
+        return response.status_code, response.headers, bytes(content), truncated
+    finally:
+        # 提前结束读取时连接不会放回连接池，由 httpx 直接关闭
+        await response.aclose()
+
+
+def decode_content(content: bytes, headers) -> str:
+    """按响应头声明的字符集解码，无法解码的字节替换为 U+FFFD"""
+    content_type = httpx.Headers(headers).get("content-type", "")
+    charset = None
+    for param in content_type.split(";")[1:]:
+        key, _, value = param.strip().partition("=")
+        if key.lower() == "charset":
+            charset = value.strip('"\' ')
+    try:
+        return content.decode(charset or "utf-8", errors="replace")
+    except LookupError:
+        return content.decode("utf-8", errors="replace")
+
+
+def _pool_stats(session: httpx.AsyncClient) -> dict:
+    """
+    连接池使用情况。httpx 没有公开连接池统计接口，这里读取 httpcore 连接池的状态，
+    读取失败时返回空字典。
+    """
+    try:
+        pool = session._transport._pool
+        connections = list(pool.connections)
+        in_use = sum(1 for connection in connections if not connection.is_idle())
+        waiting = sum(1 for request in pool._requests if request.is_queued())
+    except Exception:
+        return {}
+    return {
+        "connections": len(connections),
+        "in_use": in_use,
+        "idle": len(connections) - in_use,
+        "waiting": waiting
+    }
+
+
+def pool_stats() -> dict:
+    stats = {}
+    if _session is not None and not _session.is_closed:
+        stats["default"] = _pool_stats(_session)
+    for key, session in _host_sessions.items():
+        if not session.is_closed:
+            stats[key] = _pool_stats(session)
+    return stats
+
+
+register_collector("http_pool", pool_stats)
@@ -0,0 +1,74 @@
+"""调度器高可用
+
+SCHEDULER_HA_ENABLED = True 时，执行定时任务的进程（beat，或 SCHEDULER_RUN_JOBS 为 True 的 API 进程）
+以暂停状态启动调度器并参与选举，只有领导者恢复调度器并触发任务，其他进程作为热备。
+每次触发前用防护令牌确认领导权，已失去租约的旧领导者不会再发送任务。
+"""
+import asyncio
+import os
+import socket
+
+from scheduler_service.config import Config
+from scheduler_service.utils.cronengine import NativeScheduler
+from scheduler_service.utils.leader import LeaderElector, MemoryBackend, RedisBackend
+from scheduler_service.utils.metrics import register_collector
+
+_elector: LeaderElector = None
+# 本进程是否执行定时任务（start_scheduler 的 run_jobs）
+_run_jobs = True
+
+
+def create_elector(scheduler) -> LeaderElector:
+    """创建选举器，成为领导者时恢复调度器，失去领导权时暂停"""
+    global _elector
+    if os.getenv("UNIT_TESTS") == "1":
+        backend = MemoryBackend()
+    else:
+        backend = RedisBackend(Config.SCHEDULER_LEADER_KEY)
+
+    async def on_elected(token):
+        scheduler.resume()
+
+    async def on_demoted():
+        if scheduler.running:
+            scheduler.pause()
+
+    _elector = LeaderElector(
+        backend,
+        node_id=f"{socket.gethostname()}:{os.getpid()}",
+        ttl_ms=Config.SCHEDULER_LEADER_TTL_MS,
+        renew_ms=Config.SCHEDULER_LEADER_RENEW_MS,
+        on_elected=on_elected,
+        on_demoted=on_demoted
+    )
+    register_collector("scheduler_leader", _elector.stats)
+    return _elector
+
+
+def start_scheduler(scheduler, run_jobs: bool = True):
+    """
+    启动调度器，开启高可用时返回选举任务，由调用方在退出时取消。
+    run_jobs 为 False 时调度器保持暂停，只维护任务存储。
+    """
+    global _run_jobs
+    _run_jobs = run_jobs
+    if not run_jobs or not Config.SCHEDULER_HA_ENABLED:
+        scheduler.start(paused=not run_jobs)
+        return None
+    scheduler.start(paused=True)
+    return asyncio.create_task(create_elector(scheduler).run())
+
+
+async def check_leader() -> bool:
+    """触发任务前确认本进程仍是领导者，未开启高可用时总是返回True"""
+    if not Config.SCHEDULER_HA_ENABLED or _elector is None:
+        return True
+    return await _elector.check()
+
+
+def registers_jobs(scheduler) -> bool:
+    """
+    本进程是否向调度器注册任务。NativeScheduler 的任务只在内存中，不执行任务的进程注册的任务
+    永远不会触发，这时只分配 job_id，由执行任务的进程（service.cronsync）从数据库加载。
+    """
+    return _run_jobs or not isinstance(scheduler, NativeScheduler)
@@ -0,0 +1,448 @@
+"""cron 任务与任务存储的对账
+
+Redis 任务存储丢失或与数据库不一致时，cron 任务会悄无声息地停止触发。
+reconcile_jobs 按ID分批读取设置了 cron 的 RequestTask，与任务存储批量对比，只修复差异：
+
+- 补上任务存储中缺少的调度任务，重新调度存在但没有下一次运行时间的调度任务；
+- job_id 为空的任务（创建时注册调度任务失败）从首次发现起超过 CRON_RECONCILE_ASSIGN_GRACE_MS 仍为空时
+  分配新的调度任务，正在创建的任务有时间保存自己的 job_id，不会出现两个调度任务。
+  未到期的任务推迟：启动时的对账在宽限期后为其补充分配，`scheduler reconcile` 留给下一次运行；
+- 分组任务补上缺少的成员，移除已删除任务的成员；
+- 删除已没有对应任务（或同一任务重复注册）的调度任务，其他调度任务不受影响。
+
+使用 RedisJobStore 时以 pipeline 读写 APScheduler 的哈希表和有序集合，每批只需几次往返；
+写入的任务状态与 RedisJobStore.add_job 相同，由 Job.__getstate__ 生成。其他任务存储通过调度器的接口逐个修复。
+"""
+import asyncio
+import os
+import pickle
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from apscheduler.job import Job
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.jobstores.redis import RedisJobStore
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.util import obj_to_ref
+
+from scheduler_service.config import Config
+from scheduler_service.models import RequestTask
+from scheduler_service.service.crongroup import (GROUP_JOB_PREFIX, get_backend, group_id, group_job_id,
+                                                 is_group_job, member, parse_member, trigger_cron_group)
+from scheduler_service.service.request import trigger_cron_task
+from scheduler_service.utils.cronengine import NativeScheduler
+from scheduler_service.utils.logger import logger
+from scheduler_service.utils.redis import get_redis
+
+CRON_FIELDS = ("id", "user_id", "cron", "lane", "job_id")
+TASK_FUNC_REF = obj_to_ref(trigger_cron_task)
+GROUP_FUNC_REF = obj_to_ref(trigger_cron_group)
+
+# 调度任务在任务存储中的状态
+MISSING, UNSCHEDULED, SCHEDULED = range(3)
+
+
+class MemorySeenBackend:
+    """进程内实现，用于测试"""
+
+    def __init__(self):
+        self._seen: Dict[int, float] = {}
+
+    async def mark(self, task_ids: Sequence[int], now: float) -> Dict[int, float]:
+        """记录首次发现 job_id 为空的时间，返回各任务的首次发现时间"""
+        return {task_id: self._seen.setdefault(task_id, now) for task_id in task_ids}
+
+    async def forget(self, task_ids: Sequence[int]):
+        for task_id in task_ids:
+            self._seen.pop(task_id, None)
+
+
+class RedisSeenBackend:
+    """所有进程共享的有序集合，成员为任务ID，分数为首次发现的时间"""
+
+    # 超过该时间的记录视为残留（任务已删除），对账时清理
+    RETENTION_S = 86400
+
+    def __init__(self, key: str):
+        self.key = key
+
+    async def mark(self, task_ids: Sequence[int], now: float) -> Dict[int, float]:
+        async with get_redis().pipeline(transaction=False) as pipe:
+            pipe.zremrangebyscore(self.key, "-inf", now - self.RETENTION_S)
+            pipe.zadd(self.key, {task_id: now for task_id in task_ids}, nx=True)
+            pipe.zmscore(self.key, list(task_ids))
+            scores = (await pipe.execute())[-1]
+        return {task_id: score if score is not None else now for task_id, score in zip(task_ids, scores)}
+
+    async def forget(self, task_ids: Sequence[int]):
+        if task_ids:
+            await get_redis().zrem(self.key, *task_ids)
+
+
+_seen_backend = None
+
+
+def get_seen_backend():
+    global _seen_backend
+    if _seen_backend is None:
+        if os.getenv("UNIT_TESTS") == "1":
+            _seen_backend = MemorySeenBackend()
+        else:
+            _seen_backend = RedisSeenBackend(Config.CRON_RECONCILE_UNASSIGNED_KEY)
+    return _seen_backend
+
+
+class RedisJobBackend:
+    """直接读写 RedisJobStore 的任务状态（哈希表）和下一次运行时间（有序集合）"""
+
+    def __init__(self, scheduler, jobstore: RedisJobStore):
+        self.scheduler = scheduler
+        self.jobs_key = jobstore.jobs_key
+        self.run_times_key = jobstore.run_times_key
+        self.protocol = jobstore.pickle_protocol
+
+    def serialize(self, job_id: str, func, trigger, args, next_run_time: datetime) -> bytes:
+        """与 RedisJobStore.add_job 相同：按调度器的任务默认值创建 Job，序列化 Job.__getstate__()"""
+        job = Job(self.scheduler, id=job_id, func=func, trigger=trigger, executor="default", args=tuple(args),
+                  kwargs={}, name=None, next_run_time=next_run_time, **self.scheduler._job_defaults)
+        return pickle.dumps(job.__getstate__(), self.protocol)
+
+    async def status(self, job_ids: Sequence[str]) -> Dict[str, int]:
+        async with get_redis().pipeline(transaction=False) as pipe:
+            for job_id in job_ids:
+                pipe.hexists(self.jobs_key, job_id)
+                pipe.zscore(self.run_times_key, job_id)
+            results = await pipe.execute()
+        # 只在有序集合中的任务 APScheduler 读取时会删除，按缺少处理
+        return {
+            job_id: SCHEDULED if exists and score is not None else UNSCHEDULED if exists else MISSING
+            for job_id, exists, score in zip(job_ids, results[::2], results[1::2])
+        }
+
+    async def write(self, jobs: Sequence[Tuple]):
+        """写入 [(job_id, 函数, 触发器, 参数, 下一次运行时间)]，已存在的覆盖"""
+        states = {job[0]: self.serialize(*job) for job in jobs}
+        run_times = {job[0]: job[4].timestamp() for job in jobs}
+        async with get_redis().pipeline(transaction=False) as pipe:
+            pipe.hset(self.jobs_key, mapping=states)
+            pipe.zadd(self.run_times_key, run_times)
+            await pipe.execute()
+
+    async def scan(self, batch_size: int) -> AsyncIterator[List[str]]:
+        """分批返回有下一次运行时间的调度任务ID"""
+        client = get_redis()
+        cursor = 0
+        while True:
+            cursor, items = await client.zscan(self.run_times_key, cursor, count=batch_size)
+            if items:
+                yield [job_id.decode() for job_id, _ in items]
+            if cursor == 0:
+                return
+
+    async def load(self, job_ids: Sequence[str]) -> Dict[str, Tuple[str, tuple]]:
+        """读取调度任务的 (函数引用, 参数)，无法反序列化的任务由 APScheduler 读取时删除"""
+        result = {}
+        for job_id, state in zip(job_ids, await get_redis().hmget(self.jobs_key, job_ids)):
+            if state is None:
+                continue
+            try:
+                state = pickle.loads(state)
+            except Exception:
+                continue
+            result[job_id] = (state["func"], state["args"])
+        return result
+
+    async def remove(self, job_ids: Sequence[str]):
+        async with get_redis().pipeline(transaction=False) as pipe:
+            pipe.hdel(self.jobs_key, *job_ids)
+            pipe.zrem(self.run_times_key, *job_ids)
+            await pipe.execute()
+
+
+class SchedulerJobBackend:
+    """通过调度器的接口逐个修复，用于内存任务存储（测试）和其他任务存储"""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    async def status(self, job_ids: Sequence[str]) -> Dict[str, int]:
+        result = {}
+        for job_id in job_ids:
+            job = self.scheduler.get_job(job_id)
+            if job is None:
+                result[job_id] = MISSING
+            else:
+                result[job_id] = SCHEDULED if getattr(job, "next_run_time", None) else UNSCHEDULED
+        return result
+
+    async def write(self, jobs: Sequence[Tuple]):
+        for job_id, func, trigger, args, next_run_time in jobs:
+            self.scheduler.add_job(func, trigger, args=args, id=job_id, next_run_time=next_run_time,
+                                   replace_existing=True)
+
+    async def scan(self, batch_size: int) -> AsyncIterator[List[str]]:
+        job_ids = [job.id for job in self.scheduler.get_jobs() if getattr(job, "next_run_time", None)]
+        for i in range(0, len(job_ids), batch_size):
+            yield job_ids[i:i + batch_size]
+
+    async def load(self, job_ids: Sequence[str]) -> Dict[str, Tuple[str, tuple]]:
+        result = {}
+        for job_id in job_ids:
+            job = self.scheduler.get_job(job_id)
+            if job is not None:
+                result[job_id] = (job.func_ref, tuple(job.args))
+        return result
+
+    async def remove(self, job_ids: Sequence[str]):
+        for job_id in job_ids:
+            try:
+                self.scheduler.remove_job(job_id)
+            except JobLookupError:
+                pass
+
+
+def job_backend(scheduler):
+    """调度器使用 RedisJobStore 时批量读写Redis，否则通过调度器接口"""
+    jobstore = getattr(scheduler, "_jobstores", {}).get("default")
+    if isinstance(jobstore, RedisJobStore):
+        return RedisJobBackend(scheduler, jobstore)
+    return SchedulerJobBackend(scheduler)
+
+
+class _Reconciler:
+    """一次对账的状态"""
+
+    def __init__(self, scheduler, batch_size: int):
+        self.scheduler = scheduler
+        self.backend = job_backend(scheduler)
+        self.batch_size = batch_size
+        self.now = datetime.now(scheduler.timezone)
+        # 表达式 -> (触发器, 下一次运行时间)，无效或不会再触发的表达式为 None
+        self.triggers: Dict[str, Optional[Tuple[CronTrigger, datetime]]] = {}
+        # 分组ID -> 数据库中的成员
+        self.members: Dict[str, set] = defaultdict(set)
+        self.checked_groups = set()
+        # 扫描时 job_id 为空的任务ID，以及其中尚未超过宽限期、推迟分配的任务ID
+        self.unassigned: List[int] = []
+        self.deferred: List[int] = []
+        self.stats = {
+            "tasks": 0, "skipped": 0, "assigned": 0, "deferred": 0, "added": 0, "rescheduled": 0, "removed": 0,
+            "members_added": 0, "members_removed": 0,
+        }
+
+    def _trigger(self, cron: str) -> Optional[Tuple[CronTrigger, datetime]]:
+        if cron not in self.triggers:
+            try:
+                trigger = CronTrigger.from_crontab(cron)
+            except ValueError as e:
+                logger.warning("Skipping invalid cron expression %r: %s", cron, e)
+                self.triggers[cron] = None
+            else:
+                next_run_time = trigger.get_next_fire_time(None, self.now)
+                self.triggers[cron] = (trigger, next_run_time) if next_run_time else None
+        return self.triggers[cron]
+
+    async def run(self) -> dict:
+        last_id = 0
+        while True:
+            rows = await RequestTask.filter(cron__not_isnull=True, id__gt=last_id).order_by("id") \
+                .limit(self.batch_size).values_list(*CRON_FIELDS)
+            if not rows:
+                break
+            await self._reconcile_rows(rows)
+            last_id = rows[-1][0]
+            self.stats["tasks"] += len(rows)
+            # 大量任务时让出事件循环
+            await asyncio.sleep(0)
+        await self._assign_unassigned()
+
+        for gid, expected in self.members.items():
+            await self._reconcile_members(gid, expected)
+        await self._remove_orphans()
+
+        if (self.stats["added"] or self.stats["rescheduled"]) and self.scheduler.running:
+            # 其他调度任务的下一次运行时间可能早于调度器已知的唤醒时间
+            self.scheduler.wakeup()
+        return self.stats
+
+    async def _reconcile_rows(self, rows: Iterable[tuple]):
+        # job_id -> (函数, 表达式, 参数)
+        jobs = {}
+        for task_id, user_id, cron, lane, job_id in rows:
+            if self._trigger(cron) is None:
+                self.stats["skipped"] += 1
+            elif not job_id:
+                self.unassigned.append(task_id)
+            elif is_group_job(job_id):
+                self._add_member(job_id, task_id, user_id, cron, lane, jobs)
+            else:
+                jobs[job_id] = (trigger_cron_task, cron, [task_id, user_id, lane])
+        await self._repair(jobs)
+
+    async def _repair(self, jobs: Dict[str, tuple]):
+        """补上缺少的调度任务，重新调度没有下一次运行时间的调度任务"""
+        if not jobs:
+            return
+
+        repair = []
+        for job_id, state in (await self.backend.status(list(jobs))).items():
+            if state == SCHEDULED:
+                continue
+            func, cron, args = jobs[job_id]
+            trigger, next_run_time = self.triggers[cron]
+            repair.append((job_id, func, trigger, args, next_run_time))
+            self.stats["added" if state == MISSING else "rescheduled"] += 1
+        if repair:
+            await self.backend.write(repair)
+
+    def _add_member(self, job_id: str, task_id: int, user_id: int, cron: str, lane: Optional[str], jobs: dict):
+        gid = job_id[len(GROUP_JOB_PREFIX):]
+        self.members[gid].add(member(task_id, user_id))
+        # 每个分组的调度任务只检查一次
+        if job_id not in self.checked_groups:
+            self.checked_groups.add(job_id)
+            jobs[job_id] = (trigger_cron_group, cron, [gid, lane])
+
+    async def _assign_unassigned(self):
+        """从首次发现起超过宽限期 job_id 仍为空的任务才分配调度任务，其余的推迟。
+        API 先插入记录、注册调度任务后才保存 job_id，立即分配会被覆盖，留下重复触发的调度任务。"""
+        backend = get_seen_backend()
+        now = time.time()
+        cutoff = now - Config.CRON_RECONCILE_ASSIGN_GRACE_MS / 1000
+        for i in range(0, len(self.unassigned), self.batch_size):
+            chunk = self.unassigned[i:i + self.batch_size]
+            seen = await backend.mark(chunk, now)
+            ready = [task_id for task_id in chunk if seen[task_id] <= cutoff]
+            self.deferred.extend(task_id for task_id in chunk if seen[task_id] > cutoff)
+            if not ready:
+                continue
+            rows = await RequestTask.filter(id__in=ready, job_id__isnull=True, cron__not_isnull=True) \
+                .values_list(*CRON_FIELDS)
+            jobs = {}
+            for task_id, user_id, cron, lane, _ in rows:
+                if self._trigger(cron) is not None:
+                    await self._assign(task_id, user_id, cron, lane, jobs)
+            await self._repair(jobs)
+            await backend.forget(ready)
+        self.stats["deferred"] = len(self.deferred)
+
+    async def assign(self, task_ids: Sequence[int]) -> dict:
+        """只为指定的 job_id 为空的任务分配调度任务（推迟的任务）"""
+        self.unassigned = list(task_ids)
+        await self._assign_unassigned()
+        for gid, expected in self.members.items():
+            await self._reconcile_members(gid, expected)
+        if self.stats["assigned"] and self.scheduler.running:
+            self.scheduler.wakeup()
+        return self.stats
+
+    async def _assign(self, task_id: int, user_id: int, cron: str, lane: Optional[str], jobs: dict):
+        """为 job_id 为空的任务分配调度任务；按当前的 CRON_GROUPED 加入分组或单独注册"""
+        job_id = group_job_id(group_id(cron, lane)) if Config.CRON_GROUPED else uuid.uuid4().hex
+        # 只更新仍为空的 job_id，正在创建的任务保存 job_id 后不会被覆盖
+        if not await RequestTask.filter(id=task_id, job_id__isnull=True).update(job_id=job_id):
+            return
+        self.stats["assigned"] += 1
+        if is_group_job(job_id):
+            self._add_member(job_id, task_id, user_id, cron, lane, jobs)
+        else:
+            jobs[job_id] = (trigger_cron_task, cron, [task_id, user_id, lane])
+
+    async def _scan_members(self, gid: str) -> set:
+        existing = set()
+        async for batch in get_backend().scan(gid, self.batch_size):
+            existing.update(value.decode() if isinstance(value, bytes) else value for value in batch)
+        return existing
+
+    async def _stale_members(self, gid: str, values: Iterable[str]) -> List[str]:
+        """任务已删除或属于其他调度任务的成员；刚创建、尚未保存 job_id 的任务不算"""
+        job_id = group_job_id(gid)
+        by_task = {parse_member(value)[0]: value for value in values}
+        task_ids = list(by_task)
+        alive = set()
+        for i in range(0, len(task_ids), self.batch_size):
+            rows = await RequestTask.filter(id__in=task_ids[i:i + self.batch_size]).values_list("id", "job_id")
+            alive.update(task_id for task_id, task_job_id in rows if task_job_id in (None, job_id))
+        return [value for task_id, value in by_task.items() if task_id not in alive]
+
+    async def _reconcile_members(self, gid: str, expected: set) -> int:
+        """修复分组成员，返回修复后的成员数"""
+        existing = await self._scan_members(gid)
+        backend = get_backend()
+        missing = list(expected - existing)
+        if missing:
+            await backend.add(gid, missing)
+            self.stats["members_added"] += len(missing)
+        stale = await self._stale_members(gid, existing - expected) if existing - expected else []
+        if stale:
+            await backend.remove(gid, stale)
+            self.stats["members_removed"] += len(stale)
+        return len(existing) + len(missing) - len(stale)
+
+    async def _remove_orphans(self):
+        """删除数据库中没有对应任务的调度任务"""
+        async for job_ids in self.backend.scan(self.batch_size):
+            known = set(await RequestTask.filter(job_id__in=job_ids).distinct().values_list("job_id", flat=True))
+            unknown = [job_id for job_id in job_ids if job_id not in known]
+            if not unknown:
+                continue
+
+            tasks, orphans = {}, []
+            for job_id, (func_ref, args) in (await self.backend.load(unknown)).items():
+                if func_ref == TASK_FUNC_REF:
+                    tasks[job_id] = args[0]
+                elif func_ref == GROUP_FUNC_REF and not await self._reconcile_members(args[0], set()):
+                    # 没有任务引用且没有成员的分组
+                    orphans.append(job_id)
+            if tasks:
+                rows = dict(await RequestTask.filter(id__in=list(tasks.values())).values_list("id", "job_id"))
+                # 任务已删除，或任务的 job_id 指向另一个调度任务（重复注册）
+                orphans.extend(job_id for job_id, task_id in tasks.items()
+                               if task_id not in rows or rows[task_id] is not None)
+            if orphans:
+                await self.backend.remove(orphans)
+                self.stats["removed"] += len(orphans)
+
+
+def _log_stats(stats: dict):
+    logger.info("Reconciled %d cron tasks: %s", stats["tasks"],
+                ", ".join(f"{key}={value}" for key, value in stats.items() if key != "tasks"))
+
+
+async def reconcile_jobs(scheduler, batch_size: int = None) -> dict:
+    """对比数据库中的cron任务与任务存储并修复差异，返回各类修复的数量"""
+    stats = await _Reconciler(scheduler, batch_size or Config.CRON_RECONCILE_BATCH_SIZE).run()
+    _log_stats(stats)
+    return stats
+
+
+async def assign_deferred(scheduler, task_ids: Sequence[int], batch_size: int = None) -> dict:
+    """为推迟分配的任务分配调度任务；使用新的对账状态，下一次运行时间按当前时间计算"""
+    stats = await _Reconciler(scheduler, batch_size or Config.CRON_RECONCILE_BATCH_SIZE).assign(task_ids)
+    logger.info("Assigned jobs to %d deferred cron tasks, %d still deferred", stats["assigned"], stats["deferred"])
+    return stats
+
+
+async def _reconcile_in_background(scheduler):
+    try:
+        reconciler = _Reconciler(scheduler, Config.CRON_RECONCILE_BATCH_SIZE)
+        _log_stats(await reconciler.run())
+        deferred = reconciler.deferred
+        # 宽限期后为推迟的任务补充分配，期间 API 保存了 job_id 的任务会被跳过
+        while deferred:
+            await asyncio.sleep(Config.CRON_RECONCILE_ASSIGN_GRACE_MS / 1000)
+            reconciler = _Reconciler(scheduler, Config.CRON_RECONCILE_BATCH_SIZE)
+            await reconciler.assign(deferred)
+            deferred = reconciler.deferred
+    except Exception as e:
+        logger.warning("Failed to reconcile cron jobs: %s", e)
+
+
+def start_reconcile(scheduler) -> Optional[asyncio.Task]:
+    """启动时在后台对账一次，由调用方在退出时取消；NativeScheduler 由 service.cronsync 定期对比"""
+    if isinstance(scheduler, NativeScheduler):
+        return None
+    return asyncio.create_task(_reconcile_in_background(scheduler))
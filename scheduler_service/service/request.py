@@ -1,60 +1,77 @@
+import time
+
 import dramatiq
-import httpx
-from tortoise.expressions import F
+from tortoise import timezone
 
+from scheduler_service.config import Config
 from scheduler_service.constants import RequestStatus, TaskStatus
 from scheduler_service.models import RequestTask
+from scheduler_service.service.callback import deliver_callback, send_callback
+from scheduler_service.service.counters import incr_cron_count
+from scheduler_service.service.fairqueue import QueueQuotaExceeded, enqueue_pings
+from scheduler_service.service.leader import check_leader
+from scheduler_service.service.http import (close_session, decode_content, get_session,
+                                            hold_session, read_response)
+from scheduler_service.service.status import (flush_pending_status, record_run,
+                                               record_status)
+from scheduler_service.service.throttle import acquire_host, release_host
 from scheduler_service.utils.logger import logger
+from scheduler_service.utils.metrics import register_collector
+from scheduler_service.utils.queues import queue_depth, queue_lag_ms
 
-# 定义全局session
-_session = None
-
-
-def get_session():
-    """获取httpx会话"""
-    global _session
-    if _session is None or _session.is_closed:
-        _session = httpx.AsyncClient(timeout=60.0)
-    return _session
-
+HTTP_METHODS = ('GET', 'POST', 'PUT', 'DELETE', 'PATCH')
 
-async def close_session():
-    """关闭httpx会话"""
-    global _session
-    if _session and not _session.is_closed:
-        await _session.aclose()
+DEFAULT_LANE = "default"
+CRON_LANE = "cron"
 
 
-async def trigger_cron_task(task_id):
+async def trigger_cron_task(task_id, user_id=None, lane=None):
     """
     由APScheduler调用的任务触发器。
     发送任务到Dramatiq并更新循环计数。
+    cron任务默认走 cron 通道；指定为默认通道且开启公平调度时进入用户子队列
+    （早期注册的任务没有user_id参数，仍直接发送）。
     """
+    # 已失去领导权的调度器不再触发任务
+    if not await check_leader():
+        logger.warning("Skipping cron run of task %s: not the scheduler leader", task_id)
+        return
+
+    lane = lane or CRON_LANE
     # 发送任务到消息队列
-    ping.send(task_id)
+    try:
+        queued = lane == DEFAULT_LANE and user_id is not None and await enqueue_pings(user_id, [task_id])
+    except QueueQuotaExceeded as e:
+        logger.warning("Skipping cron run of task %s: %s", task_id, e)
+        return
+    if not queued:
+        lane_actor(lane).send(task_id)
 
-    # 更新循环计数
-    # 使用F表达式进行原子更新
-    await RequestTask.filter(id=task_id).update(cron_count=F('cron_count') + 1)
+    # 更新循环计数（默认先累计在Redis中，定期批量写回）
+    await incr_cron_count(task_id)
 
 
-@dramatiq.actor
-async def ping(task_id):
+async def run_ping(task_id, lane=DEFAULT_LANE):
     """执行ping任务"""
-    session = get_session()
     callback_data = None
 
-    # 从数据库获取任务信息
-    task = await RequestTask.get_or_none(id=task_id)
+    # 获取任务并标记为运行中，同时清除之前的错误信息；租约与actor的执行时间上限相同
+    await flush_pending_status(task_id)
+    task = await RequestTask.claim(task_id, Config.PING_TIME_LIMIT_MS)
     if not task:
-        logger.warning("Task with id %s not found", task_id)
+        logger.warning("Task with id %s not found or not runnable", task_id)
         return
 
-    # 更新状态为运行中，并清除之前的错误信息
-    task.status = TaskStatus.RUNNING
-    task.error_message = None
-    await task.save()
+    # 目标主机被限流时恢复为待执行并延迟重新入队，不在worker线程中等待
+    delay_ms, slot = await acquire_host(task.request_url)
+    if delay_ms:
+        await RequestTask.finish(task_id, TaskStatus.PENDING)
+        lane_actor(lane).send_with_options(args=(task_id,), delay=delay_ms)
+        return
 
+    session = get_session(task.request_url)
+    started_at, start = timezone.now(), time.perf_counter()
+    status_code = None
     try:
         # 准备基础请求参数
         request_kwargs = {
@@ -66,32 +83,20 @@ async def ping(task_id):
         if task.body:
             request_kwargs['json'] = task.body
 
-        # 根据method执行相应的HTTP请求（已在保存时转换为大写）
-        match task.method:
-            case 'POST':
-                response = await session.post(**request_kwargs)
-            case 'PUT':
-                response = await session.put(**request_kwargs)
-            case 'DELETE':
-                response = await session.delete(**request_kwargs)
-            case 'PATCH':
-                response = await session.patch(**request_kwargs)
-            case _:
-                # 默认使用GET（包括当method为GET或其他未知方法时）
-                response = await session.get(**request_kwargs)
-
-        # 读取响应内容
-        content = await response.aread()
+        # method已在保存时转换为大写，未知方法按GET处理
+        method = task.method if task.method in HTTP_METHODS else 'GET'
+        request = session.build_request(method, **request_kwargs)
+        async with hold_session(session):
+            status_code, headers, content, truncated = await read_response(session, request)
         callback_data = {
-            'response': content.decode('utf-8'),
-            'code': response.status_code,
+            'response': decode_content(content, headers) if content is not None else None,
+            'code': status_code,
+            'headers': dict(headers),
+            'truncated': truncated,
             'exception': None,
             'status': RequestStatus.COMPLETE
         }
-
-        # 更新状态为完成
-        task.status = TaskStatus.COMPLETED
-        await task.save()
+        task_status, error_message = TaskStatus.COMPLETED, None
 
     except Exception as e:
         # 处理请求异常
@@ -102,28 +107,75 @@ async def ping(task_id):
             'exception': str(e),
             'status': RequestStatus.FAIL
         }
-        # 更新状态为失败，并记录错误信息
-        task.status = TaskStatus.FAILED
-        task.error_message = str(e)
-        await task.save()
+        task_status, error_message = TaskStatus.FAILED, str(e)
 
-    # 发送回调（无论请求成功与否，只要有回调URL和回调数据）
+    latency_ms = (time.perf_counter() - start) * 1000
+    await release_host(slot)
+
+    # 更新状态为完成或失败（只写状态和错误信息两列），并追加一条执行历史
+    await record_status(task_id, task_status, error_message, task.claimed_at)
+    await record_run(task_id, started_at, timezone.now(), task_status, status_code, latency_ms, error_message)
+
+    # 发送回调（无论请求成功与否，只要有回调URL和回调数据），由回调队列异步投递
     if task.callback_url and callback_data:
-        try:
-            await session.post(
-                task.callback_url,
-                json=callback_data
-            )
-        except Exception as e:
-            logger.error("Error sending callback to %s: %s", task.callback_url, e)
+        await send_callback(task.callback_url, callback_data, task.callback_token, task_id)
+
+
+@dramatiq.actor(time_limit=Config.PING_TIME_LIMIT_MS)
+async def ping(task_id):
+    """执行ping任务（默认通道）"""
+    await run_ping(task_id)
+
+
+def _declare_lane_actor(lane: str, queue_name: str):
+    """为通道声明一个绑定到独立队列的ping actor"""
+    async def ping_lane(task_id):
+        await run_ping(task_id, lane)
+
+    return dramatiq.actor(ping_lane, actor_name=f"ping_{lane}", queue_name=queue_name,
+                          time_limit=Config.PING_TIME_LIMIT_MS)
+
+
+# 通道 -> actor，每个通道的消息进入各自的队列，可以分配独立的worker
+lane_actors = {
+    DEFAULT_LANE: ping,
+    **{lane: _declare_lane_actor(lane, queue_name) for lane, queue_name in Config.PING_LANES.items()}
+}
+
+
+def lane_actor(lane: str = None):
+    """获取通道对应的actor，未配置的通道使用默认通道"""
+    return lane_actors.get(lane or DEFAULT_LANE, ping)
+
+
+def lane_queues() -> dict:
+    """通道 -> 队列名，包括回调通道"""
+    queues = {lane: actor.queue_name for lane, actor in lane_actors.items()}
+    queues["callbacks"] = deliver_callback.queue_name
+    return queues
+
+
+async def lane_stats() -> dict:
+    """各通道队列的积压数量和最早消息的等待时间"""
+    broker = dramatiq.get_broker()
+    return {
+        lane: {
+            "queue": queue_name,
+            "depth": await queue_depth(broker, queue_name),
+            "lag_ms": await queue_lag_ms(broker, queue_name),
+        }
+        for lane, queue_name in lane_queues().items()
+    }
+
+
+register_collector("lanes", lane_stats)
 
 
 # 注册启动和关闭钩子
 @dramatiq.actor
 async def startup_worker():
     """worker启动时执行"""
-    global _session
-    _session = httpx.AsyncClient(timeout=60.0)
+    get_session()
 
 
 @dramatiq.actor
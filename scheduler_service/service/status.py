@@ -0,0 +1,106 @@
+"""任务状态与执行历史写入
+
+默认每次执行结束立即更新任务状态。STATUS_WRITE_MODE = "buffered" 时，
+状态先进入写后缓冲区，按 STATUS_FLUSH_INTERVAL_MS / STATUS_FLUSH_MAX_ITEMS
+合并为一条批量UPDATE，worker 关闭时保证刷写。
+状态带有产生它的认领时间（claimed_at），刷写时只更新认领时间未变的任务，
+延迟写入的结果不会覆盖任务被重新认领后的运行中状态。认领任务前先刷写本进程中该任务尚未写入的状态，
+否则cron任务的下一次执行会看到未过期的运行中租约而被跳过；其他进程中的状态最迟在 STATUS_FLUSH_INTERVAL_MS 后写入。
+
+执行历史（TaskRun）总是经过写后缓冲区，合并为多行INSERT。
+"""
+from datetime import datetime
+
+from scheduler_service.config import Config
+from scheduler_service.models import RequestTask, TaskRun
+from scheduler_service.models.run import is_partitioned, maintain_partitions
+from scheduler_service.utils.buffer import WriteBehindBuffer
+from scheduler_service.utils.logger import logger
+
+_status_buffer: WriteBehindBuffer = None
+_run_buffer: WriteBehindBuffer = None
+
+
+async def _flush_statuses(items):
+    # 同一任务在一批中可能出现多次（如cron任务），只保留最后一次的结果
+    latest = {}
+    for task_id, status, error_message, claimed_at in items:
+        latest[task_id] = (task_id, status, error_message, claimed_at)
+    await RequestTask.bulk_finish(list(latest.values()))
+
+
+def get_status_buffer() -> WriteBehindBuffer:
+    global _status_buffer
+    if _status_buffer is None:
+        _status_buffer = WriteBehindBuffer(
+            "task_status",
+            _flush_statuses,
+            interval_ms=Config.STATUS_FLUSH_INTERVAL_MS,
+            max_items=Config.STATUS_FLUSH_MAX_ITEMS,
+            max_pending=Config.STATUS_FLUSH_MAX_PENDING
+        )
+    return _status_buffer
+
+
+async def record_status(task_id: int, status: str, error_message: str = None, claimed_at: datetime = None):
+    """记录任务执行结果，claimed_at 为产生该结果的认领时间"""
+    if Config.STATUS_WRITE_MODE == "buffered":
+        await get_status_buffer().add((task_id, status, error_message, claimed_at))
+    else:
+        await RequestTask.finish(task_id, status, error_message, claimed_at)
+
+
+async def flush_pending_status(task_id: int):
+    """认领任务前，如果本进程中还有该任务尚未写入的状态则立即刷写"""
+    if Config.STATUS_WRITE_MODE != "buffered" or _status_buffer is None:
+        return
+    if any(item[0] == task_id for item in _status_buffer.pending_items()):
+        await _status_buffer.flush()
+
+
+def get_run_buffer() -> WriteBehindBuffer:
+    global _run_buffer
+    if _run_buffer is None:
+        _run_buffer = WriteBehindBuffer(
+            "task_runs",
+            TaskRun.bulk_insert,
+            interval_ms=Config.TASK_RUN_FLUSH_INTERVAL_MS,
+            max_items=Config.TASK_RUN_FLUSH_MAX_ITEMS
+        )
+    return _run_buffer
+
+
+async def record_run(task_id: int, started_at: datetime, finished_at: datetime, status: str,
+                     status_code: int = None, latency_ms: float = 0.0, error_message: str = None):
+    """追加一条执行历史"""
+    if not Config.TASK_RUN_ENABLED:
+        return
+    await get_run_buffer().add(TaskRun(
+        task_id=task_id,
+        started_at=started_at,
+        finished_at=finished_at,
+        status=status,
+        status_code=status_code,
+        latency_ms=latency_ms,
+        error_message=error_message
+    ))
+
+
+async def maintain_run_partitions():
+    """由APScheduler定期执行：预建执行历史分区并删除过期分区"""
+    if not await is_partitioned():
+        # 未执行 `scheduler migrate partition-runs` 时保持普通表
+        return
+    await maintain_partitions(
+        Config.TASK_RUN_PARTITION_DAYS_AHEAD,
+        Config.TASK_RUN_RETENTION_DAYS,
+        echo=logger.info
+    )
+
+
+def schedule_run_partitions(scheduler):
+    """在执行任务的调度器中每小时维护执行历史分区，立即执行一次；多个进程重复执行也是安全的"""
+    return scheduler.add_job(
+        maintain_run_partitions, 'interval', hours=1, id='taskrun_partitions',
+        replace_existing=True, next_run_time=datetime.now(scheduler.timezone)
+    )
@@ -0,0 +1,100 @@
+"""按目标主机限制 ping 的速率和并发
+
+RATE_LIMITS 以主机名通配符（fnmatch）配置限制，例如::
+
+    RATE_LIMITS = {"*.internal.example.com" = {rate = 50, burst = 100, max_in_flight = 20}}
+
+每个主机使用独立的令牌桶和并发槽位，在所有 worker 进程之间共享（测试模式下使用内存实现）。
+被限流的 ping 不在 worker 线程中等待，而是延迟重新入队。
+"""
+import os
+import uuid
+from fnmatch import fnmatch
+from typing import Optional, Tuple
+from urllib.parse import urlsplit
+
+from scheduler_service.config import Config
+from scheduler_service.utils.logger import logger
+from scheduler_service.utils.metrics import register_collector
+from scheduler_service.utils.ratelimit import MemoryBackend, RateLimiter, RedisBackend
+
+_limiter: RateLimiter = None
+_stats = {"allowed": 0, "throttled_rate": 0, "throttled_in_flight": 0, "errors": 0}
+
+
+def get_limiter() -> RateLimiter:
+    global _limiter
+    if _limiter is None:
+        if os.getenv("UNIT_TESTS") == "1":
+            backend = MemoryBackend()
+        else:
+            backend = RedisBackend(Config.RATE_LIMIT_KEY_PREFIX)
+        _limiter = RateLimiter(backend, Config.RATE_LIMIT_LEASE_SIZE, Config.RATE_LIMIT_LEASE_MS)
+    return _limiter
+
+
+def host_limits(url: str) -> Tuple[Optional[str], Optional[dict]]:
+    """返回 (主机名, 限制)，没有匹配的限制时限制为None"""
+    host = (urlsplit(url).hostname or "").lower()
+    if not Config.RATE_LIMIT_ENABLED or not host:
+        return host, None
+    for pattern, limits in Config.RATE_LIMITS.items():
+        if fnmatch(host, pattern.lower()):
+            return host, limits
+    return host, None
+
+
+async def acquire_host(url: str) -> Tuple[int, Optional[tuple]]:
+    """
+    为一次请求申请该主机的并发槽位和令牌。
+
+    :return: (需延迟的毫秒数, 槽位)。延迟为0表示可以立即请求，请求结束后用 release_host 释放槽位；
+             Redis 不可用时放行。
+    """
+    host, limits = host_limits(url)
+    if limits is None:
+        return 0, None
+
+    limiter = get_limiter()
+    slot = None
+    try:
+        max_in_flight = limits.get("max_in_flight")
+        if max_in_flight:
+            slot = (host, uuid.uuid4().hex)
+            ttl_ms = int(Config.HTTP_TIMEOUT * 1000) + Config.RATE_LIMIT_RETRY_DELAY_MS
+            if not await limiter.backend.acquire_slot(host, max_in_flight, ttl_ms, slot[1]):
+                _stats["throttled_in_flight"] += 1
+                return Config.RATE_LIMIT_RETRY_DELAY_MS, None
+
+        rate = limits.get("rate")
+        if rate:
+            wait = await limiter.acquire(host, rate, limits.get("burst") or max(1, int(rate)))
+            if wait:
+                await release_host(slot)
+                _stats["throttled_rate"] += 1
+                return wait, None
+    except Exception as e:
+        logger.warning("Rate limiter unavailable for %s, allowing request: %s", host, e)
+        _stats["errors"] += 1
+        return 0, None
+
+    _stats["allowed"] += 1
+    return 0, slot
+
+
+async def release_host(slot: Optional[tuple]):
+    """释放 acquire_host 占用的并发槽位"""
+    if slot is None:
+        return
+    try:
+        await get_limiter().backend.release_slot(*slot)
+    except Exception as e:
+        # 槽位会在超时后自动失效
+        logger.warning("Failed to release rate limit slot for %s: %s", slot[0], e)
+
+
+def throttle_stats() -> dict:
+    return dict(_stats)
+
+
+register_collector("rate_limit", throttle_stats)
@@ -0,0 +1,138 @@
+"""写后缓冲（write-behind）
+
+worker 中的高频写操作先进入缓冲区，按时间间隔或数量批量刷写。
+所有缓冲区都运行在 Dramatiq AsyncIO 中间件的事件循环中，worker 关闭时统一刷写。
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, List
+
+import dramatiq
+from dramatiq.asyncio import get_event_loop_thread
+
+from scheduler_service.utils.logger import logger
+from scheduler_service.utils.metrics import register_collector
+
+_buffers: List["WriteBehindBuffer"] = []
+
+
+class WriteBehindBuffer:
+    """
+    累积数据项，每 interval_ms 毫秒或满 max_items 条时调用 flush_func 批量写入。
+    刷写失败的数据项放回缓冲区重试，最多保留 max_pending 条（默认 max_items 的10倍），超出时丢弃最旧的数据项。
+    """
+
+    def __init__(self, name: str, flush_func: Callable[[list], Awaitable[None]],
+                 interval_ms: int = 200, max_items: int = 500, max_pending: int = None,
+                 metrics: bool = True):
+        self.name = name
+        self.flush_func = flush_func
+        self.interval = interval_ms / 1000
+        self.max_items = max_items
+        self.max_pending = max_pending or max_items * 10
+        self._items = []
+        self._loop = None
+        self._timer = None
+        self._stats = {
+            "flushes": 0,
+            "failures": 0,
+            "dropped": 0,
+            "items": 0,
+            "last_size": 0,
+            "max_size": 0,
+            "last_latency_ms": 0.0,
+            "max_latency_ms": 0.0,
+            "total_latency_ms": 0.0,
+        }
+        _buffers.append(self)
+        if metrics:
+            register_collector(f"buffer.{name}", self.stats)
+
+    def stats(self) -> dict:
+        return {**self._stats, "pending": len(self._items)}
+
+    def pending_items(self) -> list:
+        """尚未刷写的数据项"""
+        return list(self._items)
+
+    def discard(self):
+        """不再需要时（例如按key临时创建的缓冲区已刷写完）从全局列表中移除"""
+        if self in _buffers:
+            _buffers.remove(self)
+
+    async def add(self, item):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # 事件循环变化（例如worker重启）时，旧的定时器已失效
+            self._loop, self._timer = loop, None
+
+        self._items.append(item)
+        if len(self._items) >= self.max_items:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.interval, self._schedule_flush)
+
+    def _schedule_flush(self):
+        self._timer = None
+        asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        """立即刷写缓冲区中的所有数据项"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        items, self._items = self._items, []
+        if not items:
+            return
+
+        start = time.perf_counter()
+        try:
+            await self.flush_func(items)
+        except Exception as e:
+            # 放回缓冲区，等待下次刷写重试
+            logger.error("Failed to flush %d items from %s: %s", len(items), self.name, e)
+            self._stats["failures"] += 1
+            self._items[:0] = items
+            overflow = len(self._items) - self.max_pending
+            if overflow > 0:
+                logger.error("Dropping %d items from %s after repeated flush failures", overflow, self.name)
+                self._stats["dropped"] += overflow
+                del self._items[:overflow]
+            if self._timer is None and self._loop is not None:
+                self._timer = self._loop.call_later(self.interval, self._schedule_flush)
+            return
+
+        latency_ms = (time.perf_counter() - start) * 1000
+        stats = self._stats
+        stats["flushes"] += 1
+        stats["items"] += len(items)
+        stats["last_size"] = len(items)
+        stats["max_size"] = max(stats["max_size"], len(items))
+        stats["last_latency_ms"] = latency_ms
+        stats["max_latency_ms"] = max(stats["max_latency_ms"], latency_ms)
+        stats["total_latency_ms"] += latency_ms
+        logger.debug("Flushed %d items from %s in %.1fms", len(items), self.name, latency_ms)
+
+
+async def flush_all():
+    """刷写所有缓冲区"""
+    # 刷写时可能移除临时缓冲区（见 discard），遍历副本
+    for buffer in list(_buffers):
+        await buffer.flush()
+
+
+class BufferFlushMiddleware(dramatiq.Middleware):
+    """
+    worker 关闭时刷写所有缓冲区。
+    必须排在 AsyncIO 中间件之前，以便在事件循环停止前执行。
+    """
+
+    def after_worker_shutdown(self, broker, worker):
+        event_loop_thread = get_event_loop_thread()
+        if event_loop_thread is None:
+            return
+        try:
+            event_loop_thread.run_coroutine(flush_all())
+        except Exception as e:
+            logger.error("Failed to flush write-behind buffers on shutdown: %s", e)
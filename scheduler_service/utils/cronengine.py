@@ -0,0 +1,502 @@
+"""按位掩码批量计算的 cron 调度引擎
+
+APScheduler 的 CronTrigger 用纯 Python 逐个任务计算下一次触发时间，RedisJobStore 每次唤醒都要
+反序列化所有到期任务，单个调度进程在百万级任务时跟不上。NativeScheduler：
+
+- 把每个不同的 cron 触发器（字段相同、时区相同）编译为分钟、小时、日、月、星期五个位掩码；
+- 下一次触发时间相同的任务放在同一个桶中，桶的时间保存在最小堆里；
+- 桶到期后按表达式去重，用 NumPy 对所有表达式一次算出下一次触发时间，整桶重新入堆。
+
+它实现了本服务用到的 AsyncIOScheduler 接口（add_job/get_job/get_jobs/remove_job、
+start/pause/resume/wakeup/shutdown）。无法编译为位掩码的触发器（interval、date，
+以及带秒、年、周数、last、# 的 cron）仍由触发器本身逐个计算。
+错过的触发在 misfire_grace_time 内补发一次（总是合并），超过则跳过。
+任务只保存在内存中，由 scheduler_service.service.cronsync 从数据库加载。
+
+需要安装 numpy（native 可选依赖）。
+"""
+import asyncio
+import functools
+import heapq
+import time
+import uuid
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from apscheduler.jobstores.base import ConflictingIdError, JobLookupError
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.cron.expressions import AllExpression, RangeExpression
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.util import astimezone
+
+from scheduler_service.utils.logger import logger
+
+# 编译后的字段，每个取值对应掩码中的同序号位
+MASK_FIELDS = ("minute", "hour", "day", "month", "day_of_week")
+FIELD_RANGES = {"minute": (0, 59), "hour": (0, 23), "day": (1, 31), "month": (1, 12), "day_of_week": (0, 6)}
+# 逐日查找的天数，之后仍未找到的表达式（如指定日期落在指定星期）在整个公历周期中查找
+SEARCH_DAYS = 366
+GREGORIAN_CYCLE_DAYS = 146097
+TRIGGERS = {"cron": CronTrigger, "interval": IntervalTrigger, "date": DateTrigger}
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError('SCHEDULER_ENGINE = "native" requires numpy') from None
+    return numpy
+
+
+def compile_trigger(trigger) -> Optional[Tuple[int, ...]]:
+    """把 cron 触发器编译为 (分钟, 小时, 日, 月, 星期) 位掩码，无法编译时返回None"""
+    if not isinstance(trigger, CronTrigger) or trigger.start_date or trigger.end_date or trigger.jitter:
+        return None
+    fields = {field.name: field for field in trigger.fields}
+    if str(fields["year"]) != "*" or str(fields["week"]) != "*" or str(fields["second"]) != "0":
+        return None
+
+    masks = []
+    for name in MASK_FIELDS:
+        low, high = FIELD_RANGES[name]
+        mask = 0
+        for expr in fields[name].expressions:
+            if type(expr) is AllExpression:
+                first, last = low, high
+            elif isinstance(expr, RangeExpression):
+                first = max(low, expr.first)
+                last = high if expr.last is None else min(high, expr.last)
+            else:
+                # last、第几个星期几等与具体月份有关的表达式
+                return None
+            for value in range(first, last + 1, expr.step or 1):
+                mask |= 1 << value
+        if not mask:
+            return None
+        masks.append(mask)
+    return tuple(masks)
+
+
+def _lowest_bit(np, masks):
+    """每个（非0）掩码最低位的序号"""
+    return np.log2(masks & (~masks + np.uint64(1))).astype(np.int64)
+
+
+def _day_matches(np, day, month, dow, d):
+    """d 是日期，或 _calendar 返回的 (日, 月, 星期) 数组"""
+    if isinstance(d, date):
+        d = (np.uint64(d.day), np.uint64(d.month), np.uint64(d.weekday()))
+    bits = (day >> d[0]) & (month >> d[1]) & (dow >> d[2])
+    return (bits & np.uint64(1)).astype(bool)
+
+
+def _calendar(np, start: date):
+    """从 start 开始一个公历周期（400年）中每天的 (日, 月, 星期)"""
+    days = np.arange(np.datetime64(start, "D"), np.datetime64(start, "D") + GREGORIAN_CYCLE_DAYS)
+    months = days.astype("datetime64[M]")
+    day = (days - months).astype(np.uint64) + np.uint64(1)
+    month = (months.astype(np.int64) % 12 + 1).astype(np.uint64)
+    # 1970-01-01 是星期四
+    weekday = ((days.astype(np.int64) + 3) % 7).astype(np.uint64)
+    return day, month, weekday
+
+
+def _next_in_zone(np, masks, after: float, tz):
+    """同一时区的一组表达式在 after 之后的下一次触发时间戳，永不触发时为 NaN"""
+    minute, hour, day, month, dow = masks
+    n = len(minute)
+    start = datetime.fromtimestamp(after, tz).replace(second=0, microsecond=0) + timedelta(minutes=1)
+    base = start.date()
+    days = np.full(n, -1, dtype=np.int64)
+    hours = np.zeros(n, dtype=np.int64)
+    minutes = np.zeros(n, dtype=np.int64)
+    full = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+    # 当天：先找当前小时剩余的分钟，再找之后的小时
+    today = _day_matches(np, day, month, dow, base)
+    rest = minute & (full << np.uint64(start.minute))
+    same = today & ((hour >> np.uint64(start.hour)) & np.uint64(1)).astype(bool) & (rest != 0)
+    days[same] = 0
+    hours[same] = start.hour
+    minutes[same] = _lowest_bit(np, rest[same])
+    later_hours = hour & (full << np.uint64(start.hour + 1))
+    later = today & ~same & (later_hours != 0)
+    days[later] = 0
+    hours[later] = _lowest_bit(np, later_hours[later])
+    minutes[later] = _lowest_bit(np, minute[later])
+
+    # 之后的日期：每次只检查还没找到的表达式
+    pending = np.flatnonzero(days < 0)
+    offset = 1
+    while len(pending) and offset <= SEARCH_DAYS:
+        matched = _day_matches(np, day[pending], month[pending], dow[pending], base + timedelta(days=offset))
+        hit = pending[matched]
+        days[hit] = offset
+        hours[hit] = _lowest_bit(np, hour[hit])
+        minutes[hit] = _lowest_bit(np, minute[hit])
+        pending = pending[~matched]
+        offset += 1
+    if len(pending):
+        calendar = _calendar(np, base + timedelta(days=offset))
+        for i in pending.tolist():
+            matched = _day_matches(np, day[i], month[i], dow[i], calendar)
+            if matched.any():
+                days[i] = offset + int(matched.argmax())
+                hours[i] = _lowest_bit(np, hour[i:i + 1])[0]
+                minutes[i] = _lowest_bit(np, minute[i:i + 1])[0]
+
+    # 墙上时间转换为时间戳，每个不同的时间只转换一次
+    result = np.full(n, np.nan)
+    found = days >= 0
+    keys, inverse = np.unique((days * 1440 + hours * 60 + minutes)[found], return_inverse=True)
+    stamps = []
+    for key in keys.tolist():
+        d = base + timedelta(days=key // 1440)
+        stamps.append(datetime(d.year, d.month, d.day, key % 1440 // 60, key % 60, tzinfo=tz).timestamp())
+    result[found] = np.array(stamps, dtype=np.float64)[inverse]
+    return result
+
+
+class CronTable:
+    """已编译表达式的位掩码表，每行是一个不同的 (掩码, 时区)"""
+
+    def __init__(self):
+        self._index: Dict[tuple, int] = {}
+        self._rows: List[Tuple[int, ...]] = []
+        self.timezones = []
+        self.triggers = []
+        self._arrays = None
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add(self, trigger) -> Optional[int]:
+        """编译触发器，返回行号，无法编译时返回None"""
+        masks = compile_trigger(trigger)
+        if masks is None:
+            return None
+        key = (masks, trigger.timezone)
+        row = self._index.get(key)
+        if row is None:
+            row = self._index[key] = len(self._rows)
+            self._rows.append(masks)
+            self.timezones.append(trigger.timezone)
+            self.triggers.append(trigger)
+            self._arrays = None
+        return row
+
+    def next_fire_times(self, rows: Sequence[int], after: float):
+        """批量计算 rows 在 after（时间戳）之后的下一次触发时间，永不触发时为 NaN"""
+        np = _numpy()
+        if self._arrays is None:
+            self._arrays = np.array(self._rows, dtype=np.uint64).reshape(-1, len(MASK_FIELDS)).T.copy()
+        rows = np.asarray(rows, dtype=np.int64)
+        result = np.full(len(rows), np.nan)
+        by_zone = defaultdict(list)
+        for i, row in enumerate(rows.tolist()):
+            by_zone[self.timezones[row]].append(i)
+        for tz, positions in by_zone.items():
+            positions = np.array(positions, dtype=np.int64)
+            selected = rows[positions]
+            result[positions] = _next_in_zone(np, [column[selected] for column in self._arrays], after, tz)
+        return result
+
+
+class Job:
+    """NativeScheduler 中的任务，常用属性与 APScheduler 的 Job 一致"""
+
+    __slots__ = ("id", "func", "args", "kwargs", "row", "misfire_grace_time", "next_run", "_trigger", "_scheduler")
+
+    def __init__(self, scheduler, job_id: str, func: Callable, trigger, args, kwargs, misfire_grace_time):
+        self._scheduler = scheduler
+        self.id = job_id
+        self.func = func
+        self.args = tuple(args or ())
+        self.kwargs = kwargs or {}
+        self.misfire_grace_time = misfire_grace_time
+        self.row = None
+        self._trigger = trigger
+        self.next_run: Optional[float] = None
+
+    @property
+    def trigger(self):
+        if self.row is not None:
+            return self._scheduler.table.triggers[self.row]
+        return self._trigger
+
+    @property
+    def next_run_time(self) -> Optional[datetime]:
+        if self.next_run is None:
+            return None
+        return datetime.fromtimestamp(self.next_run, self._scheduler.timezone)
+
+    def __repr__(self):
+        return f"<Job (id={self.id} trigger={self.trigger} next_run_time={self.next_run_time})>"
+
+
+class NativeScheduler:
+    """位掩码 + 最小堆的调度器，可替代 AsyncIOScheduler"""
+
+    def __init__(self, job_defaults: dict = None, timezone="UTC", fire_batch_size: int = 1000):
+        _numpy()
+        self.timezone = astimezone(timezone)
+        self.misfire_grace_time = (job_defaults or {}).get("misfire_grace_time", 1)
+        self.fire_batch_size = fire_batch_size
+        self.table = CronTable()
+        self._jobs: Dict[str, Job] = {}
+        self._buckets: Dict[float, List[Job]] = {}
+        self._heap: List[float] = []
+        self._garbage = 0
+        self._next_cache: Dict[int, float] = {}
+        self._next_cache_minute = None
+        self._paused = False
+        self._task = None
+        self._wakeup = None
+        self._firing = set()
+        self._stats = {"fired": 0, "missed": 0, "failures": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    # --- 任务 ---
+
+    def add_job(self, func: Callable, trigger=None, args=None, kwargs=None, id: str = None, name: str = None,
+                misfire_grace_time: int = None, coalesce: bool = True, next_run_time: datetime = None,
+                replace_existing: bool = False, **trigger_args) -> Job:
+        """与 AsyncIOScheduler.add_job 相同，trigger 可以是触发器或 "cron"/"interval"/"date\""""
+        if isinstance(trigger, str):
+            trigger_args.setdefault("timezone", self.timezone)
+            trigger = TRIGGERS[trigger](**trigger_args)
+        job = self._new_job(id or uuid.uuid4().hex, func, trigger, args, kwargs, misfire_grace_time)
+        existing = self._jobs.get(job.id)
+        if existing is not None:
+            if not replace_existing:
+                raise ConflictingIdError(job.id)
+            self._discard(existing)
+        self._jobs[job.id] = job
+        if next_run_time is not None:
+            self._push(next_run_time.timestamp(), [job])
+        else:
+            self._schedule([job], time.time())
+        return job
+
+    def add_jobs(self, jobs: Iterable[Tuple[str, Callable, object, Sequence]]) -> int:
+        """批量添加 (任务ID, 函数, 触发器, 参数)，已存在的任务ID跳过，返回添加的数量。
+        同一个触发器对象只编译一次，下一次触发时间按表达式批量计算。"""
+        rows = {}
+        added = []
+        for job_id, func, trigger, args in jobs:
+            if job_id in self._jobs:
+                continue
+            key = id(trigger)
+            if key not in rows:
+                rows[key] = (self.table.add(trigger), trigger)
+            job = Job(self, job_id, func, trigger, args, None, self.misfire_grace_time)
+            job.row = rows[key][0]
+            if job.row is not None:
+                job._trigger = None
+            self._jobs[job_id] = job
+            added.append(job)
+        self._schedule(added, time.time())
+        return len(added)
+
+    def get_job(self, job_id: str, jobstore: str = None) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def get_jobs(self, jobstore: str = None) -> List[Job]:
+        return list(self._jobs.values())
+
+    def remove_job(self, job_id: str, jobstore: str = None):
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise JobLookupError(job_id)
+        self._discard(job)
+
+    def _new_job(self, job_id, func, trigger, args, kwargs, misfire_grace_time) -> Job:
+        if misfire_grace_time is None:
+            misfire_grace_time = self.misfire_grace_time
+        job = Job(self, job_id, func, trigger, args, kwargs, misfire_grace_time)
+        job.row = self.table.add(trigger)
+        if job.row is not None:
+            # 编译过的任务共用表中的触发器
+            job._trigger = None
+        return job
+
+    def _discard(self, job: Job):
+        """删除任务；桶中的引用在到期或整理时丢弃"""
+        del self._jobs[job.id]
+        if job.next_run is not None:
+            job.next_run = None
+            self._garbage += 1
+            if self._garbage > max(len(self._jobs), 10000):
+                self._compact()
+
+    def _compact(self):
+        for ts in list(self._buckets):
+            jobs = [job for job in self._buckets[ts] if job.next_run == ts]
+            if jobs:
+                self._buckets[ts] = jobs
+            else:
+                del self._buckets[ts]
+        self._heap = list(self._buckets)
+        heapq.heapify(self._heap)
+        self._garbage = 0
+
+    # --- 计算触发时间 ---
+
+    def _push(self, ts: float, jobs: List[Job]):
+        bucket = self._buckets.get(ts)
+        if bucket is None:
+            if not self._heap or ts < self._heap[0]:
+                self._notify()
+            bucket = self._buckets[ts] = []
+            heapq.heappush(self._heap, ts)
+        bucket.extend(jobs)
+        for job in jobs:
+            job.next_run = ts
+
+    def _next_fire_times(self, rows: List[int], after: float) -> List[float]:
+        """rows 在 after 所在分钟之后的下一次触发时间。
+        结果只取决于 after 所在的分钟，每分钟第一次计算时一并算出表中所有表达式并缓存。"""
+        minute = int(after // 60)
+        if minute != self._next_cache_minute:
+            self._next_cache = {}
+            self._next_cache_minute = minute
+        if any(row not in self._next_cache for row in rows):
+            missing = [row for row in range(len(self.table)) if row not in self._next_cache]
+            stamps = self.table.next_fire_times(missing, after)
+            self._next_cache.update(zip(missing, stamps.tolist()))
+        return [self._next_cache[row] for row in rows]
+
+    def _schedule(self, jobs: Sequence[Job], after: float):
+        """把 jobs 放入 after 之后下一次触发时间的桶，不会再触发的任务被删除"""
+        groups = defaultdict(list)
+        for job in jobs:
+            if job.row is not None:
+                groups[job.row].append(job)
+            else:
+                self._schedule_trigger(job, after)
+        if not groups:
+            return
+        rows = list(groups)
+        for row, ts in zip(rows, self._next_fire_times(rows, after)):
+            if ts != ts:  # NaN
+                self._finish(groups[row])
+            else:
+                self._push(ts, groups[row])
+
+    def _schedule_trigger(self, job: Job, after: float):
+        previous = datetime.fromtimestamp(job.next_run, self.timezone) if job.next_run is not None else None
+        next_time = job._trigger.get_next_fire_time(previous, datetime.fromtimestamp(after, self.timezone))
+        if next_time is None:
+            self._finish([job])
+        else:
+            self._push(next_time.timestamp(), [job])
+
+    def _finish(self, jobs: List[Job]):
+        for job in jobs:
+            job.next_run = None
+            if self._jobs.get(job.id) is job:
+                del self._jobs[job.id]
+
+    def run_due(self, now: float = None) -> List[Job]:
+        """取出 now 之前到期的桶并计算下一次触发时间，返回需要执行的任务"""
+        now = now or time.time()
+        due = []
+        while self._heap and self._heap[0] <= now:
+            ts = heapq.heappop(self._heap)
+            jobs = [job for job in self._buckets.pop(ts) if job.next_run == ts]
+            if not jobs:
+                continue
+            late = now - ts
+            missed = 0
+            for job in jobs:
+                if late <= job.misfire_grace_time:
+                    due.append(job)
+                else:
+                    missed += 1
+            if missed:
+                self._stats["missed"] += missed
+                logger.warning("Run time of %d jobs was missed by %.1fs", missed, late)
+            # 从 now 开始计算，暂停期间错过的多次触发合并为一次
+            self._schedule(jobs, now)
+        return due
+
+    # --- 运行 ---
+
+    def start(self, paused: bool = False):
+        if self._task is not None:
+            raise RuntimeError("Scheduler is already running")
+        self._paused = paused
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def pause(self):
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+        self._notify()
+
+    def wakeup(self):
+        self._notify()
+
+    def shutdown(self, wait: bool = True):
+        if self._task is None:
+            return
+        self._task.cancel()
+        for task in list(self._firing):
+            task.cancel()
+        self._task = None
+
+    def _notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            timeout = None
+            if not self._paused and self._heap:
+                timeout = self._heap[0] - time.time()
+                if timeout <= 0:
+                    jobs = self.run_due()
+                    if jobs:
+                        task = asyncio.create_task(self._run_jobs(jobs))
+                        self._firing.add(task)
+                        task.add_done_callback(self._firing.discard)
+                    await asyncio.sleep(0)
+                    continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run_jobs(self, jobs: List[Job]):
+        """分批执行到期任务，每批最多 fire_batch_size 个并发"""
+        for i in range(0, len(jobs), self.fire_batch_size):
+            await asyncio.gather(*(self._run_job(job) for job in jobs[i:i + self.fire_batch_size]))
+
+    async def _run_job(self, job: Job):
+        try:
+            if asyncio.iscoroutinefunction(job.func):
+                await job.func(*job.args, **job.kwargs)
+            else:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, functools.partial(job.func, *job.args, **job.kwargs))
+            self._stats["fired"] += 1
+        except Exception:
+            self._stats["failures"] += 1
+            logger.exception("Job %s raised an exception", job.id)
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "jobs": len(self._jobs),
+            "expressions": len(self.table),
+            "buckets": len(self._heap),
+            "running": sum(not task.done() for task in self._firing),
+        }
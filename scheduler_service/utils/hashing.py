@@ -0,0 +1,73 @@
+"""密码哈希执行器
+
+pbkdf2 哈希一次需要几十毫秒，直接在请求处理函数中调用会阻塞整个事件循环。
+这里把哈希计算放到线程池（或进程池）中执行，并限制排队数量。
+"""
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from passlib.hash import pbkdf2_sha256
+
+from scheduler_service.config import Config
+
+
+class HashingBusy(Exception):
+    """哈希任务排队已满"""
+
+
+_executor: Executor = None
+_max_pending = 0
+_pending = 0
+
+
+def _hash(password: str) -> str:
+    return pbkdf2_sha256.hash(password)
+
+
+def _verify(password: str, password_hash: str) -> bool:
+    return pbkdf2_sha256.verify(password, password_hash)
+
+
+def setup_hashing(config=None):
+    """根据配置创建哈希执行器"""
+    global _executor, _max_pending
+    config = config or Config.to_dict()
+    shutdown_hashing()
+
+    workers = config.get("HASH_WORKERS", Config.HASH_WORKERS)
+    if config.get("HASH_EXECUTOR", Config.HASH_EXECUTOR) == "process":
+        _executor = ProcessPoolExecutor(max_workers=workers)
+    else:
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hashing")
+    # 正在执行的 + 排队中的任务总数上限
+    _max_pending = workers + config.get("HASH_QUEUE_SIZE", Config.HASH_QUEUE_SIZE)
+
+
+def shutdown_hashing():
+    """关闭哈希执行器"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def _run(func, *args):
+    global _pending
+    if _executor is None:
+        setup_hashing()
+    if _pending >= _max_pending:
+        raise HashingBusy("Too many pending password hashing jobs")
+
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+    finally:
+        _pending -= 1
+
+
+async def hash_password(password: str) -> str:
+    return await _run(_hash, password)
+
+
+async def verify_password(password: str, password_hash: str) -> bool:
+    return await _run(_verify, password, password_hash)
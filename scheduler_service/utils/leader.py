@@ -0,0 +1,196 @@
+"""基于租约的领导者选举
+
+候选者每 renew_ms 尝试获取或续期一个 ttl_ms 的租约，持有租约者为领导者。
+每次新获得租约时递增全局的防护令牌（fencing token），旧领导者在网络分区或长时间停顿后
+即使仍认为自己是领导者，其令牌也会因落后而被 check 拒绝。
+
+领导者在本地按单调时钟记录租约到期时间，续期失败且超过到期时间后立即降级，
+不会等到下一次访问 Redis；正常退出时主动释放租约，备用节点在一个 renew_ms 内接管。
+"""
+import asyncio
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Optional
+
+from scheduler_service.utils.logger import logger
+from scheduler_service.utils.redis import get_redis
+
+# 返回持有租约的令牌，租约被其他节点持有时返回0
+ACQUIRE_LUA = """
+local owner = redis.call('HGET', KEYS[1], 'owner')
+if owner == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return tonumber(redis.call('HGET', KEYS[1], 'token'))
+end
+if owner then
+    return 0
+end
+local token = redis.call('INCR', KEYS[2])
+redis.call('HSET', KEYS[1], 'owner', ARGV[1], 'token', token)
+redis.call('PEXPIRE', KEYS[1], ARGV[2])
+return token
+"""
+
+RELEASE_LUA = """
+if redis.call('HGET', KEYS[1], 'owner') == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+CHECK_LUA = """
+local state = redis.call('HMGET', KEYS[1], 'owner', 'token')
+if state[1] == ARGV[1] and tonumber(state[2]) == tonumber(ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+
+class MemoryBackend:
+    """进程内实现，用于测试和故障转移基准测试"""
+
+    def __init__(self):
+        self._owner: Optional[str] = None
+        self._token_value = 0
+        self._expires = 0.0
+        self._fence = 0
+
+    def _current_owner(self) -> Optional[str]:
+        if self._owner is not None and time.monotonic() >= self._expires:
+            self._owner = None
+        return self._owner
+
+    async def acquire(self, node_id: str, ttl_ms: int) -> int:
+        owner = self._current_owner()
+        if owner is not None and owner != node_id:
+            return 0
+        if owner is None:
+            self._fence += 1
+            self._owner, self._token_value = node_id, self._fence
+        self._expires = time.monotonic() + ttl_ms / 1000
+        return self._token_value
+
+    async def release(self, node_id: str):
+        if self._current_owner() == node_id:
+            self._owner = None
+
+    async def check(self, node_id: str, token: int) -> bool:
+        return self._current_owner() == node_id and self._token_value == token
+
+
+class RedisBackend:
+    """所有节点共享的Redis实现"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.fence_key = f"{key}:fence"
+
+    async def acquire(self, node_id: str, ttl_ms: int) -> int:
+        script = get_redis().register_script(ACQUIRE_LUA)
+        return int(await script(keys=[self.key, self.fence_key], args=[node_id, ttl_ms]))
+
+    async def release(self, node_id: str):
+        script = get_redis().register_script(RELEASE_LUA)
+        await script(keys=[self.key], args=[node_id])
+
+    async def check(self, node_id: str, token: int) -> bool:
+        script = get_redis().register_script(CHECK_LUA)
+        return bool(await script(keys=[self.key], args=[node_id, token]))
+
+
+class LeaderElector:
+    """
+    租约选举。
+
+    :param on_elected: 成为领导者时调用，参数为防护令牌
+    :param on_demoted: 失去领导权时调用
+    """
+
+    def __init__(self, backend, node_id: str = None, ttl_ms: int = 2000, renew_ms: int = 500,
+                 on_elected: Callable[[int], Awaitable[None]] = None,
+                 on_demoted: Callable[[], Awaitable[None]] = None):
+        self.backend = backend
+        self.node_id = node_id or uuid.uuid4().hex
+        self.ttl_ms = ttl_ms
+        self.renew_ms = renew_ms
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.token = 0
+        # 本地记录的租约到期时间（单调时钟），为0表示不是领导者
+        self._lease_deadline = 0.0
+        self._stats: Dict[str, int] = {"elections": 0, "demotions": 0, "errors": 0, "token": 0}
+
+    @property
+    def is_leader(self) -> bool:
+        return self.token > 0 and time.monotonic() < self._lease_deadline
+
+    async def check(self) -> bool:
+        """确认当前令牌仍然有效，执行有副作用的操作前调用"""
+        if not self.is_leader:
+            return False
+        try:
+            return await self.backend.check(self.node_id, self.token)
+        except Exception as e:
+            logger.warning("Leader fencing check failed: %s", e)
+            return False
+
+    async def step(self):
+        """尝试获取或续期一次租约，并在领导权变化时触发回调"""
+        started = time.monotonic()
+        try:
+            token = await asyncio.wait_for(self.backend.acquire(self.node_id, self.ttl_ms), self.ttl_ms / 1000)
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.warning("Leader lease renewal failed: %s", e)
+            # 无法续期时保持领导权直到本地记录的租约到期
+            if self.token and not self.is_leader:
+                await self._demoted()
+            return
+
+        if not token:
+            if self.token:
+                await self._demoted()
+            return
+        # 以发起请求的时间计算到期时间，保证本地视图不晚于Redis中的租约
+        self._lease_deadline = started + self.ttl_ms / 1000
+        if token != self.token:
+            if self.token:
+                # 租约在两次续期之间过期后又被本节点重新获得
+                await self._demoted()
+                self._lease_deadline = started + self.ttl_ms / 1000
+            await self._elected(token)
+
+    async def _elected(self, token: int):
+        self.token = token
+        self._stats["token"] = token
+        self._stats["elections"] += 1
+        logger.info("Node %s elected leader with token %s", self.node_id, token)
+        if self.on_elected:
+            await self.on_elected(token)
+
+    async def _demoted(self):
+        self.token = 0
+        self._lease_deadline = 0.0
+        self._stats["demotions"] += 1
+        logger.warning("Node %s lost leadership", self.node_id)
+        if self.on_demoted:
+            await self.on_demoted()
+
+    async def run(self, release: bool = True):
+        """持续参与选举，取消时释放租约（release 为 False 时模拟进程崩溃，等待租约过期）"""
+        try:
+            while True:
+                await self.step()
+                await asyncio.sleep(self.renew_ms / 1000)
+        finally:
+            if self.token:
+                await self._demoted()
+            if release:
+                try:
+                    await self.backend.release(self.node_id)
+                except Exception as e:
+                    logger.warning("Failed to release leader lease: %s", e)
+
+    def stats(self) -> dict:
+        return {**self._stats, "node_id": self.node_id, "is_leader": self.is_leader}
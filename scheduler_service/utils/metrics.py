@@ -0,0 +1,21 @@
+"""进程内运行指标收集"""
+import inspect
+from typing import Callable, Dict
+
+_collectors: Dict[str, Callable[[], dict]] = {}
+
+
+def register_collector(name: str, collector: Callable[[], dict]):
+    """注册一个指标收集函数（可以是协程函数），返回值需为可JSON序列化的dict"""
+    _collectors[name] = collector
+
+
+async def collect() -> dict:
+    """收集当前进程内所有已注册的指标"""
+    metrics = {}
+    for name, collector in _collectors.items():
+        value = collector()
+        if inspect.isawaitable(value):
+            value = await value
+        metrics[name] = value
+    return metrics
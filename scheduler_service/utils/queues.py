@@ -0,0 +1,46 @@
+"""Dramatiq 队列状态"""
+import time
+
+from dramatiq import Message
+from dramatiq.brokers.redis import RedisBroker
+from dramatiq.brokers.stub import StubBroker
+
+from scheduler_service.utils.redis import get_redis
+
+
+async def queue_depth(broker, queue_name: str) -> int:
+    """队列中等待消费的消息数（不含延迟队列）"""
+    if isinstance(broker, StubBroker):
+        queue = broker.queues.get(queue_name)
+        return queue.qsize() if queue is not None else 0
+    if isinstance(broker, RedisBroker):
+        # RedisBroker 把待消费的消息ID保存在 <namespace>:<queue_name> 列表中
+        return await get_redis().llen(f"{broker.namespace}:{queue_name}")
+    return 0
+
+
+def _message_lag_ms(message: Message, now_ms: int) -> int:
+    # 延迟消息从到期时间开始计算等待时间
+    ready_ms = max(message.message_timestamp, message.options.get("eta") or 0)
+    return max(0, now_ms - ready_ms)
+
+
+async def queue_lag_ms(broker, queue_name: str) -> int:
+    """队列中最早的消息已等待的毫秒数，队列为空时为0"""
+    now_ms = int(time.time() * 1000)
+    if isinstance(broker, StubBroker):
+        queue = broker.queues.get(queue_name)
+        if queue is None or not queue.queue:
+            return 0
+        return _message_lag_ms(Message.decode(queue.queue[0]), now_ms)
+    if isinstance(broker, RedisBroker):
+        client = get_redis()
+        key = f"{broker.namespace}:{queue_name}"
+        message_id = await client.lindex(key, 0)
+        if message_id is None:
+            return 0
+        data = await client.hget(f"{key}.msgs", message_id)
+        if data is None:
+            return 0
+        return _message_lag_ms(Message.decode(data), now_ms)
+    return 0
@@ -0,0 +1,126 @@
+"""跨进程的令牌桶与并发槽位
+
+RedisBackend 用 Lua 脚本保证令牌桶和并发槽位在所有 worker 进程之间原子更新，
+时间取自 Redis 服务器，避免各机器时钟不一致。MemoryBackend 语义相同，用于单进程和测试。
+
+RateLimiter 每次从后端租借一批令牌在本地消耗，租借的令牌在 lease_ms 后作废，
+热点路径上大多数请求不需要访问 Redis。
+"""
+import math
+import time
+from typing import Dict, Tuple
+
+from scheduler_service.utils.redis import get_redis
+
+TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate / 1000)
+local granted = math.min(requested, math.floor(tokens))
+tokens = tokens - granted
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+local wait = 0
+if granted == 0 then
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+return {granted, wait}
+"""
+
+ACQUIRE_SLOT_LUA = """
+local limit = tonumber(ARGV[1])
+local ttl = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= limit then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + ttl, ARGV[3])
+redis.call('PEXPIRE', KEYS[1], ttl)
+return 1
+"""
+
+
+class MemoryBackend:
+    """进程内实现，用于测试和单进程部署"""
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._slots: Dict[str, Dict[str, float]] = {}
+
+    async def take(self, key: str, rate: float, burst: int, requested: int) -> Tuple[int, int]:
+        """从令牌桶中最多取出 requested 个令牌，返回 (取到的数量, 没有令牌时需等待的毫秒数)"""
+        now = time.monotonic() * 1000
+        tokens, ts = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - ts) * rate / 1000)
+        granted = min(requested, int(tokens))
+        tokens -= granted
+        self._buckets[key] = (tokens, now)
+        wait = 0 if granted else math.ceil((1 - tokens) * 1000 / rate)
+        return granted, wait
+
+    async def acquire_slot(self, key: str, limit: int, ttl_ms: int, member: str) -> bool:
+        """占用一个并发槽位，超过 ttl_ms 未释放的槽位视为已释放"""
+        now = time.monotonic() * 1000
+        slots = {m: expires for m, expires in self._slots.get(key, {}).items() if expires > now}
+        self._slots[key] = slots
+        if len(slots) >= limit:
+            return False
+        slots[member] = now + ttl_ms
+        return True
+
+    async def release_slot(self, key: str, member: str):
+        self._slots.get(key, {}).pop(member, None)
+
+
+class RedisBackend:
+    """所有进程共享的Redis实现"""
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+
+    async def take(self, key: str, rate: float, burst: int, requested: int) -> Tuple[int, int]:
+        script = get_redis().register_script(TOKEN_BUCKET_LUA)
+        granted, wait = await script(keys=[f"{self.prefix}:bucket:{key}"], args=[rate, burst, requested])
+        return int(granted), int(wait)
+
+    async def acquire_slot(self, key: str, limit: int, ttl_ms: int, member: str) -> bool:
+        script = get_redis().register_script(ACQUIRE_SLOT_LUA)
+        return bool(await script(keys=[f"{self.prefix}:slots:{key}"], args=[limit, ttl_ms, member]))
+
+    async def release_slot(self, key: str, member: str):
+        await get_redis().zrem(f"{self.prefix}:slots:{key}", member)
+
+
+class RateLimiter:
+    """带本地租借的令牌桶限流器"""
+
+    def __init__(self, backend, lease_size: int = 10, lease_ms: int = 1000):
+        self.backend = backend
+        self.lease_size = lease_size
+        self.lease_ms = lease_ms
+        # key -> [剩余令牌数, 过期时间]
+        self._leases: Dict[str, list] = {}
+
+    async def acquire(self, key: str, rate: float, burst: int) -> int:
+        """取一个令牌，成功返回0，否则返回建议等待的毫秒数"""
+        now = time.monotonic()
+        lease = self._leases.get(key)
+        if lease and lease[0] > 0 and lease[1] > now:
+            lease[0] -= 1
+            return 0
+
+        # 一次租借的令牌不超过租期内按速率能用完的数量，避免单个进程囤积令牌
+        size = max(1, min(self.lease_size, burst, int(rate * self.lease_ms / 1000)))
+        granted, wait = await self.backend.take(key, rate, burst, size)
+        if not granted:
+            return max(wait, 1)
+        self._leases[key] = [granted - 1, now + self.lease_ms / 1000]
+        return 0
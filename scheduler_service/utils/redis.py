@@ -0,0 +1,29 @@
+"""Redis 异步客户端管理"""
+import asyncio
+import weakref
+
+import redis.asyncio as aioredis
+
+from scheduler_service.config import Config
+
+# 异步客户端的连接绑定在创建它的事件循环上，
+# API 进程和 Dramatiq worker 的事件循环线程各自持有一份
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aioredis.Redis]" = weakref.WeakKeyDictionary()
+
+
+def get_redis(url: str = None) -> aioredis.Redis:
+    """获取当前事件循环对应的异步 Redis 客户端"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = aioredis.Redis.from_url(url or Config.REDIS_URL)
+        _clients[loop] = client
+    return client
+
+
+async def close_redis():
+    """关闭当前事件循环对应的 Redis 客户端"""
+    loop = asyncio.get_running_loop()
+    client = _clients.pop(loop, None)
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,64 @@
+import asyncio
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+import pytest
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from scheduler_service.beat import beat_loop
+from scheduler_service.service.status import maintain_run_partitions, schedule_run_partitions
+
+
+@pytest.mark.asyncio
+class TestBeat:
+    """测试独立的定时任务进程"""
+
+    async def test_paused_scheduler_does_not_run_jobs(self):
+        """API进程的调度器暂停时只保存任务，不执行"""
+        calls = []
+
+        async def job():
+            calls.append(1)
+
+        scheduler = AsyncIOScheduler(jobstores={'default': MemoryJobStore()}, timezone="Asia/Shanghai")
+        scheduler.start(paused=True)
+        try:
+            run_date = datetime.now(scheduler.timezone) + timedelta(milliseconds=50)
+            scheduler.add_job(job, 'date', run_date=run_date, misfire_grace_time=60)
+            await asyncio.sleep(0.2)
+            assert calls == []
+            assert len(scheduler.get_jobs()) == 1
+
+            # beat 进程中的调度器正常执行
+            scheduler.resume()
+            await asyncio.sleep(0.2)
+            assert calls == [1]
+        finally:
+            scheduler.shutdown(wait=False)
+
+    async def test_beat_loop_wakes_scheduler(self):
+        """beat循环定期唤醒调度器，直到收到停止信号"""
+        scheduler = MagicMock()
+        stop = asyncio.Event()
+
+        task = asyncio.create_task(beat_loop(scheduler, stop, poll_ms=10))
+        await asyncio.sleep(0.1)
+        stop.set()
+        await asyncio.wait_for(task, 1)
+
+        assert scheduler.wakeup.call_count >= 3
+
+    async def test_schedule_run_partitions(self):
+        """执行任务的调度器注册分区维护任务，重复注册只保留一个"""
+        scheduler = AsyncIOScheduler(jobstores={'default': MemoryJobStore()}, timezone="Asia/Shanghai")
+        scheduler.start(paused=True)
+        try:
+            schedule_run_partitions(scheduler)
+            schedule_run_partitions(scheduler)
+            jobs = scheduler.get_jobs()
+            assert [job.id for job in jobs] == ['taskrun_partitions']
+            assert jobs[0].func is maintain_run_partitions
+            assert jobs[0].next_run_time <= datetime.now(scheduler.timezone)
+        finally:
+            scheduler.shutdown(wait=False)
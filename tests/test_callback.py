@@ -0,0 +1,77 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from scheduler_service.config import Config
+from scheduler_service.service import callback
+from scheduler_service.utils.buffer import flush_all
+
+
+@pytest.mark.asyncio
+class TestCallbackBatch:
+    """测试回调批量投递"""
+
+    async def test_batch_policy(self, mocker):
+        mocker.patch.object(Config, "CALLBACK_BATCH_ENABLED", False)
+        mocker.patch.object(Config, "CALLBACK_BATCH_POLICIES", {
+            "http://batch.com/": {"enabled": True, "max_items": 50},
+            "http://batch.com/slow/": {"enabled": True, "interval_ms": 5000},
+        })
+
+        assert callback.batch_policy("http://single.com/cb") is None
+        assert callback.batch_policy("http://batch.com/cb")["max_items"] == 50
+        # 最长前缀优先，未覆盖的值沿用默认
+        policy = callback.batch_policy("http://batch.com/slow/cb")
+        assert policy["interval_ms"] == 5000
+        assert policy["max_items"] == Config.CALLBACK_BATCH_MAX_ITEMS
+
+    async def test_send_callback_single(self, mocker):
+        mocker.patch.object(Config, "CALLBACK_BATCH_ENABLED", False)
+        single = mocker.patch.object(callback.deliver_callback, "send")
+
+        await callback.send_callback("http://cb.com", {"code": 200}, "token", 1)
+
+        single.assert_called_once_with("http://cb.com", {"code": 200}, "token")
+
+    async def test_send_callback_batched(self, mocker):
+        mocker.patch.object(Config, "CALLBACK_BATCH_ENABLED", True)
+        mocker.patch.object(Config, "CALLBACK_BATCH_MAX_ITEMS", 2)
+        mocker.patch.object(Config, "CALLBACK_BATCH_INTERVAL_MS", 60000)
+        batch = mocker.patch.object(callback.deliver_callback_batch, "send")
+
+        for task_id in range(1, 4):
+            await callback.send_callback("http://cb.com", {"code": 200}, "token", task_id)
+        await callback.send_callback("http://other.com", {"code": 500}, None, 9)
+
+        batch.assert_called_once_with(
+            "http://cb.com", [{"task_id": 1, "code": 200}, {"task_id": 2, "code": 200}], "token")
+        assert callback.batch_stats()["pending_urls"] == 2
+
+        # worker关闭时刷写剩余的回调
+        await flush_all()
+        assert batch.call_count == 3
+        assert callback.batch_stats()["pending_urls"] == 0
+
+    async def test_batch_rejected_falls_back(self, mocker):
+        session = MagicMock()
+        session.post = AsyncMock(return_value=MagicMock(status_code=415))
+        mocker.patch("scheduler_service.service.callback.get_session", return_value=session)
+        single = mocker.patch.object(callback.deliver_callback, "send")
+        items = [{"task_id": 1, "code": 200}, {"task_id": 2, "code": 200}]
+
+        await callback.post_callback_batch("http://rejects.com", items, "token")
+        assert single.call_count == 2
+        single.assert_called_with("http://rejects.com", {"code": 200}, "token")
+
+        # 之后发往该URL的批次直接逐条投递
+        await callback.post_callback_batch("http://rejects.com", items, "token")
+        assert session.post.call_count == 1
+        assert single.call_count == 4
+
+    async def test_batch_retryable(self, mocker):
+        session = MagicMock()
+        session.post = AsyncMock(return_value=MagicMock(status_code=503))
+        mocker.patch("scheduler_service.service.callback.get_session", return_value=session)
+
+        with pytest.raises(callback.CallbackError):
+            await callback.post_callback_batch("http://down.com", [{"task_id": 1}])
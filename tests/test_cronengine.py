@@ -0,0 +1,181 @@
+import asyncio
+import math
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import pytest
+from apscheduler.jobstores.base import ConflictingIdError, JobLookupError
+from apscheduler.triggers.cron import CronTrigger
+
+from scheduler_service.models import RequestTask
+from scheduler_service.service import cronsync
+from scheduler_service.service.crongroup import group_job_id
+from scheduler_service.utils.cronengine import CronTable, NativeScheduler, compile_trigger
+from tests import const
+
+TZ = ZoneInfo("Asia/Shanghai")
+EXPRESSIONS = [
+    "* * * * *", "*/7 * * * *", "0 9-18/3 * * mon-fri", "30 2 1,15 * *", "0 0 29 2 *",
+    "15 10 13 * 4", "59 23 31 12 *", "5 4 * 1-3 sat,sun",
+]
+
+
+async def noop(*args):
+    pass
+
+
+@pytest.mark.asyncio
+class TestCronEngine:
+    """测试位掩码cron引擎"""
+
+    async def test_next_fire_times_match_apscheduler(self):
+        table = CronTable()
+        triggers = [CronTrigger.from_crontab(expr, timezone=TZ) for expr in EXPRESSIONS]
+        rows = [table.add(trigger) for trigger in triggers]
+        for after in (datetime(2024, 2, 28, 23, 59, 30, tzinfo=TZ), datetime(2025, 12, 31, 23, 59, tzinfo=TZ),
+                      datetime(2026, 3, 13, 10, 14, 59, tzinfo=TZ)):
+            stamps = table.next_fire_times(rows, after.timestamp())
+            start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+            expected = [trigger.get_next_fire_time(None, start).timestamp() for trigger in triggers]
+            assert stamps.tolist() == expected
+
+        # 永不触发的表达式
+        never = table.add(CronTrigger.from_crontab("0 0 31 2 *", timezone=TZ))
+        assert math.isnan(table.next_fire_times([never], time.time())[0])
+
+    async def test_uncompiled_triggers(self):
+        """无法编译的触发器仍由触发器本身计算"""
+        assert compile_trigger(CronTrigger(second="*/10")) is None
+        assert compile_trigger(CronTrigger(day="last")) is None
+        scheduler = NativeScheduler(timezone=TZ)
+        job = scheduler.add_job(noop, "interval", seconds=10, id="interval")
+        assert job.row is None
+        assert 0 < job.next_run - time.time() <= 10
+
+    async def test_run_due(self):
+        scheduler = NativeScheduler(job_defaults={"misfire_grace_time": 30}, timezone=TZ)
+        job = scheduler.add_job(noop, CronTrigger.from_crontab("* * * * *", timezone=TZ), args=[1], id="a")
+        other = scheduler.add_job(noop, CronTrigger.from_crontab("* * * * *", timezone=TZ), args=[2], id="b")
+        # 相同表达式编译为同一行，放在同一个桶中
+        assert job.row == other.row and len(scheduler.table) == 1
+        assert job.next_run % 60 == 0 and job.next_run > time.time()
+        with pytest.raises(ConflictingIdError):
+            scheduler.add_job(noop, "interval", seconds=1, id="a")
+
+        fire_time = job.next_run
+        assert [j.id for j in scheduler.run_due(fire_time)] == ["a", "b"]
+        assert job.next_run == fire_time + 60
+
+        scheduler.remove_job("b")
+        assert scheduler.get_job("b") is None
+        with pytest.raises(JobLookupError):
+            scheduler.remove_job("b")
+        assert [j.id for j in scheduler.run_due(fire_time + 60)] == ["a"]
+
+        # 超过 misfire_grace_time 的触发被跳过，下一次触发时间从当前时间算起
+        assert scheduler.run_due(fire_time + 1000) == []
+        assert job.next_run > fire_time + 1000
+
+    async def test_start_pause_resume(self):
+        fired = []
+
+        async def fire(value):
+            fired.append(value)
+
+        scheduler = NativeScheduler(timezone=TZ)
+        scheduler.start(paused=True)
+        try:
+            scheduler.add_job(fire, "date", run_date=datetime.now(TZ), args=[1])
+            await asyncio.sleep(0.05)
+            assert fired == []
+
+            scheduler.resume()
+            await asyncio.sleep(0.05)
+            assert fired == [1]
+            # date 触发器执行后任务被删除
+            assert scheduler.get_jobs() == []
+        finally:
+            scheduler.shutdown()
+        assert not scheduler.running
+
+    async def test_load_and_reconcile(self, user, monkeypatch):
+        """从数据库加载cron任务，其他进程删除的任务在连续两次对比后移除"""
+        monkeypatch.setattr(cronsync, "_suspects", set())
+        monkeypatch.setattr(cronsync, "_pending", set())
+        tasks = [
+            await RequestTask.create(name=f"t{i}", user_id=user.id, request_url="http://example.com",
+                                     cron="*/5 * * * *", job_id=f"job-{i}")
+            for i in range(3)
+        ]
+        grouped = await RequestTask.create(name="g", user_id=user.id, request_url="http://example.com",
+                                           cron="0 * * * *", lane="cron", job_id=group_job_id("abc"))
+        await RequestTask.create(name="once", user_id=user.id, request_url="http://example.com")
+
+        scheduler = NativeScheduler(timezone=TZ)
+        assert await cronsync.load_cron_jobs(scheduler) == grouped.id
+        assert sorted(job.id for job in scheduler.get_jobs()) == [group_job_id("abc"), "job-0", "job-1", "job-2"]
+        assert scheduler.get_job("job-1").args == (tasks[1].id, user.id, None)
+        assert len(scheduler.table) == 2
+
+        await tasks[0].delete()
+        scheduler.remove_job("job-1")
+        assert await cronsync.reconcile_cron_jobs(scheduler) == (1, 0)
+        assert scheduler.get_job("job-0") is not None
+        assert await cronsync.reconcile_cron_jobs(scheduler) == (0, 1)
+        assert scheduler.get_job("job-0") is None
+
+    async def test_load_pending_and_remove(self, user, monkeypatch):
+        """job_id 尚未保存的任务在之后的同步中加载，删除通知立即移除任务"""
+        monkeypatch.setattr(cronsync, "_suspects", set())
+        monkeypatch.setattr(cronsync, "_pending", set())
+        saved = await RequestTask.create(name="saved", user_id=user.id, request_url="http://example.com",
+                                         cron="*/5 * * * *", job_id="job-saved")
+        unsaved = await RequestTask.create(name="unsaved", user_id=user.id, request_url="http://example.com",
+                                           cron="*/5 * * * *")
+        gone = await RequestTask.create(name="gone", user_id=user.id, request_url="http://example.com",
+                                        cron="*/5 * * * *")
+
+        scheduler = NativeScheduler(timezone=TZ)
+        last_id = await cronsync.load_cron_jobs(scheduler)
+        assert last_id == gone.id
+        assert [job.id for job in scheduler.get_jobs()] == ["job-saved"]
+        assert cronsync._pending == {unsaved.id, gone.id}
+
+        # API 保存 job_id 之后，游标已经越过的任务也会被加载
+        await RequestTask.filter(id=unsaved.id).update(job_id="job-unsaved")
+        await gone.delete()
+        assert await cronsync.load_pending_jobs(scheduler) == 1
+        assert await cronsync.load_cron_jobs(scheduler, last_id) == last_id
+        assert scheduler.get_job("job-unsaved").args == (unsaved.id, user.id, None)
+        assert cronsync._pending == set()
+
+        await saved.delete()
+        assert cronsync.remove_jobs(scheduler, ["job-saved", "job-missing"]) == 1
+        assert [job.id for job in scheduler.get_jobs()] == ["job-unsaved"]
+
+    async def test_api_without_run_jobs(self, client, headers, user, monkeypatch):
+        """不执行任务的API进程只保存 job_id，由执行任务的进程从数据库加载"""
+        from scheduler_service.api.v1 import task as task_api
+        from scheduler_service.service import leader
+
+        local = NativeScheduler(timezone=TZ)
+        monkeypatch.setattr(task_api, "get_scheduler", lambda: local)
+        monkeypatch.setattr(leader, "_run_jobs", False)
+        monkeypatch.setattr(cronsync, "_pending", set())
+        cron_task = {"name": "native", "start_time": time.time(), "request_url": "http://example.com",
+                     "cron": "*/5 * * * *"}
+
+        resp = await client.post(const.TASK_URL, headers=headers, json=cron_task)
+        single = await RequestTask.get(id=resp.json()["task_id"])
+        resp = await client.post(f"{const.TASK_URL}/bulk", headers=headers, json=[cron_task, cron_task])
+        assert resp.status_code == 200
+        bulk_ids = resp.json()["task_ids"]
+        assert local.get_jobs() == []
+
+        runner = NativeScheduler(timezone=TZ)
+        await cronsync.load_cron_jobs(runner)
+        job = runner.get_job(single.job_id)
+        assert job.args == (single.id, user.id, None)
+        assert len(runner.get_jobs()) == 3
+        assert {job.args[0] for job in runner.get_jobs()} == {single.id, *bulk_ids}
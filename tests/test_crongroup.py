@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+from scheduler_service.config import Config
+from scheduler_service.models import RequestTask
+from scheduler_service.service import counters, crongroup
+from tests import const
+
+
+@pytest.fixture
+def grouped(monkeypatch):
+    """开启分组模式，使用独立的内存集合和计数"""
+    monkeypatch.setattr(Config, "CRON_GROUPED", True)
+    monkeypatch.setattr(crongroup, "_backend", crongroup.MemoryBackend())
+    monkeypatch.setattr(counters, "_backend", counters.MemoryBackend())
+    return crongroup._backend
+
+
+def cron_task(name, cron, **kwargs):
+    return {"name": name, "start_time": time.time(), "request_url": "http://example.com", "cron": cron, **kwargs}
+
+
+@pytest.mark.asyncio
+class TestCronGroup:
+    """测试按表达式分组的cron任务"""
+
+    async def test_group_id(self):
+        assert crongroup.group_id("0  * * * MON") == crongroup.group_id("0 * * * mon")
+        assert crongroup.group_id("0 * * * *") != crongroup.group_id("0 * * * *", "priority")
+        assert crongroup.is_group_job(crongroup.group_job_id("abc"))
+        assert not crongroup.is_group_job("4f3c2a")
+        assert not crongroup.is_group_job(None)
+
+    async def test_create_and_delete(self, client, headers, grouped):
+        """相同表达式的任务共用一个调度任务，删除任务只移出分组"""
+        from scheduler_service import get_scheduler
+
+        ids = []
+        for i, cron in enumerate(["*/5 * * * *", "*/5  *  * * *"]):
+            resp = await client.post(const.TASK_URL, headers=headers, json=cron_task(f"g{i}", cron))
+            assert resp.status_code == 200
+            ids.append(resp.json()["task_id"])
+        resp = await client.post(f"{const.TASK_URL}/bulk", headers=headers,
+                                 json=[cron_task("g2", "*/5 * * * *"), cron_task("other", "0 0 * * *")])
+        assert resp.status_code == 200
+        ids.extend(resp.json()["task_ids"])
+
+        tasks = [await RequestTask.get(id=task_id) for task_id in ids]
+        job_id = tasks[0].job_id
+        assert crongroup.is_group_job(job_id)
+        assert [task.job_id for task in tasks[:3]] == [job_id] * 3
+        assert tasks[3].job_id != job_id
+
+        scheduler = get_scheduler()
+        group_jobs = [job for job in scheduler.get_jobs() if crongroup.is_group_job(job.id)]
+        assert len(group_jobs) == 2
+        gid = crongroup.group_id("*/5 * * * *")
+        assert await grouped.count(gid) == 3
+
+        resp = await client.delete(f"{const.TASK_URL}/{ids[0]}", headers=headers)
+        assert resp.status_code == 200
+        assert await grouped.count(gid) == 2
+        assert scheduler.get_job(job_id) is not None
+
+    async def test_trigger_group_in_batches(self, grouped, stub_broker, monkeypatch):
+        """分组触发时分批发送所有成员并累计循环计数"""
+        monkeypatch.setattr(Config, "CRON_GROUP_BATCH_SIZE", 2)
+        gid = crongroup.group_id("* * * * *")
+        await grouped.add(gid, [crongroup.member(task_id, 1) for task_id in range(1, 6)])
+
+        await crongroup.trigger_cron_group(gid)
+        assert stub_broker.queues["cron"].qsize() == 5
+        assert await counters.pending_cron_counts(range(1, 6)) == {i: 1 for i in range(1, 6)}
+
+        # 指定通道的分组
+        await crongroup.trigger_cron_group(gid, "priority")
+        assert stub_broker.queues["priority"].qsize() == 5
@@ -0,0 +1,137 @@
+import time
+from unittest.mock import patch
+
+import pytest
+from dramatiq import Message
+
+from scheduler_service.models import RequestTask
+from scheduler_service.service import delayqueue
+from tests import const
+
+DAY = 24 * 3600
+
+
+def queued_etas(stub_broker, queue_name: str) -> list:
+    """队列中消息的eta（未设置时为None）"""
+    return [Message.decode(data).options.get("eta") for data in stub_broker.queues[queue_name].queue]
+
+
+@pytest.fixture
+def delay_backend(monkeypatch):
+    backend = delayqueue.MemoryBackend()
+    monkeypatch.setattr(delayqueue, "_backend", backend)
+    return backend
+
+
+@pytest.mark.asyncio
+class TestDelayQueue:
+    """测试远期任务的延迟队列"""
+
+    async def test_far_future_task_not_sent(self, client, headers, stub_broker, delay_backend):
+        """远期任务只写入延迟队列，删除任务时从延迟队列移除"""
+        start_time = time.time() + DAY
+        resp = await client.post(const.TASK_URL, headers=headers, json={
+            "name": "far_task", "start_time": start_time, "request_url": "http://example.com"
+        })
+        assert resp.status_code == 200
+        task_id = resp.json()["task_id"]
+
+        assert stub_broker.queues["default"].qsize() == 0
+        assert stub_broker.queues["default.DQ"].qsize() == 0
+        task = await RequestTask.get(id=task_id)
+        assert task.message_id is None
+        assert await delay_backend.size() == 1
+
+        resp = await client.delete(f"{const.TASK_URL}/{task_id}", headers=headers)
+        assert resp.status_code == 200
+        assert await delay_backend.size() == 0
+
+    async def test_near_future_task_uses_eta(self, client, headers, stub_broker, delay_backend):
+        """阈值以内的延迟任务仍直接以eta发送"""
+        start_time = time.time() + 30
+        resp = await client.post(const.TASK_URL, headers=headers, json={
+            "name": "near_task", "start_time": start_time, "request_url": "http://example.com"
+        })
+        assert resp.status_code == 200
+        assert queued_etas(stub_broker, "default") == [int(start_time * 1000)]
+        assert await delay_backend.size() == 0
+
+    async def test_dispatch_due(self, client, headers, stub_broker, delay_backend):
+        """到期前 DELAY_QUEUE_LOOKAHEAD_MS 内的任务按通道发送，未到期的任务保留"""
+        now = time.time()
+        tasks_data = [
+            {"name": "soon", "start_time": now + DAY, "request_url": "http://example.com"},
+            {"name": "soon_priority", "start_time": now + DAY, "request_url": "http://example.com",
+             "lane": "priority"},
+            {"name": "later", "start_time": now + 2 * DAY, "request_url": "http://example.com"},
+        ]
+        resp = await client.post(f"{const.TASK_URL}/bulk", headers=headers, json=tasks_data)
+        assert resp.status_code == 200
+        assert await delay_backend.size() == 3
+
+        # 到期时间之后：直接发送
+        assert await delayqueue.dispatch_due(int((now + DAY + 1) * 1000)) == 2
+        assert queued_etas(stub_broker, "default") == [None]
+        assert queued_etas(stub_broker, "priority") == [None]
+        assert await delay_backend.size() == 1
+
+        # 提前量之内：带eta发送
+        assert await delayqueue.dispatch_due(int((now + 2 * DAY) * 1000) - 1000) == 1
+        assert queued_etas(stub_broker, "default") == [None, int((now + 2 * DAY) * 1000)]
+        assert await delayqueue.dispatch_due() == 0
+
+    async def test_dispatch_failure_requeues(self, delay_backend):
+        await delayqueue.schedule_pings([(1, None, 100.0), (2, "cron", 101.0)])
+
+        with patch("scheduler_service.service.delayqueue.lane_actor", side_effect=ConnectionError("broker down")):
+            with pytest.raises(ConnectionError):
+                await delayqueue.dispatch_due(200 * 1000)
+
+        assert sorted(await delay_backend.lease_due(200 * 1000, 10, 0)) == [("1:default", 100000), ("2:cron", 101000)]
+
+    async def test_dispatch_writes_message_id(self, client, headers, stub_broker, delay_backend):
+        """发送后写回消息ID，之后删除任务会中止消息"""
+        now = time.time()
+        resp = await client.post(const.TASK_URL, headers=headers, json={
+            "name": "far_task", "start_time": now + DAY, "request_url": "http://example.com"
+        })
+        task_id = resp.json()["task_id"]
+        assert await delayqueue.dispatch_due(int((now + DAY + 1) * 1000)) == 1
+
+        task = await RequestTask.get(id=task_id)
+        message = Message.decode(stub_broker.queues["default"].queue[0])
+        assert task.message_id == message.message_id
+        with patch("scheduler_service.api.v1.task.abort") as mock_abort:
+            resp = await client.delete(f"{const.TASK_URL}/{task_id}", headers=headers)
+        assert resp.status_code == 200
+        mock_abort.assert_called_once_with(message.message_id)
+
+    async def test_lease_survives_crash(self, app, stub_broker, delay_backend):
+        """取出后进程崩溃、没有发送的任务在租约到期后重新发送"""
+        from scheduler_service.config import Config
+
+        await delayqueue.schedule_pings([(1, None, 100.0)])
+        assert await delay_backend.lease_due(100 * 1000, 10, 100 * 1000 + Config.DELAY_QUEUE_LEASE_MS) == [
+            ("1:default", 100000)]
+        assert await delayqueue.dispatch_due(101 * 1000) == 0
+        assert await delay_backend.size() == 1
+
+        assert await delayqueue.dispatch_due(100 * 1000 + Config.DELAY_QUEUE_LEASE_MS) == 1
+        assert stub_broker.queues["default"].qsize() == 1
+        assert await delay_backend.size() == 0
+
+    async def test_cancelled_during_send_is_aborted(self, app, stub_broker, delay_backend, monkeypatch):
+        """发送期间任务被删除时，确认阶段中止已发送的消息"""
+        await delayqueue.schedule_pings([(1, None, 100.0), (2, None, 100.0)])
+        ack = delay_backend.ack
+
+        async def cancel_then_ack(members):
+            await delayqueue.cancel_pings([(1, None)])
+            return await ack(members)
+
+        monkeypatch.setattr(delay_backend, "ack", cancel_then_ack)
+        with patch("scheduler_service.service.delayqueue.abort") as mock_abort:
+            assert await delayqueue.dispatch_due(200 * 1000) == 2
+        first = Message.decode(stub_broker.queues["default"].queue[0])
+        assert first.args == (1,)
+        mock_abort.assert_called_once_with(first.message_id)
@@ -0,0 +1,174 @@
+import asyncio
+import time
+
+import pytest
+
+from scheduler_service.config import Config
+from scheduler_service.service import fairqueue
+from scheduler_service.service.fairqueue import FairQueue, MemoryBackend, QueueQuotaExceeded
+from scheduler_service.utils.leader import LeaderElector
+from scheduler_service.utils.leader import MemoryBackend as MemoryLeaseBackend
+from tests import const
+
+
+def make_queue(depth=0, **kwargs):
+    sent = []
+
+    async def current_depth():
+        return depth
+
+    queue = FairQueue(MemoryBackend(), send=sent.append, depth=current_depth, **kwargs)
+    return queue, sent
+
+
+@pytest.mark.asyncio
+class TestFairQueue:
+    """测试按用户加权轮询"""
+
+    async def test_round_robin(self):
+        queue, sent = make_queue(target_depth=100, default_weight=2)
+        await queue.push(1, list(range(100, 110)))
+        await queue.push(2, [200, 201, 202])
+
+        await queue.dispatch_round()
+        assert sent == [100, 101, 200, 201]
+        # 下一轮从下一个用户开始
+        await queue.dispatch_round()
+        assert sent[4:] == [202, 102, 103]
+        await queue.dispatch_round()
+        assert sent[7:] == [104, 105]
+
+    async def test_weights(self):
+        queue, sent = make_queue(target_depth=100, default_weight=1, weights={"2": 3})
+        await queue.push(1, [100, 101, 102])
+        await queue.push(2, [200, 201, 202])
+
+        await queue.dispatch_round()
+        assert sent == [100, 200, 201, 202]
+
+    async def test_target_depth(self):
+        queue, sent = make_queue(depth=8, target_depth=10, default_weight=5)
+        await queue.push(1, list(range(10)))
+
+        assert await queue.dispatch_round() == 2
+        queue.depth = make_queue(depth=10)[0].depth
+        assert await queue.dispatch_round() == 0
+
+    async def test_send_failure_requeues(self):
+        """发送失败时已发送的任务被确认，其余任务按原顺序放回子队列头部"""
+        sent = []
+
+        def send(task_id):
+            if task_id == 102:
+                raise ConnectionError("broker down")
+            sent.append(task_id)
+
+        queue, _ = make_queue(target_depth=100, default_weight=5)
+        queue.send = send
+        await queue.push(1, list(range(100, 106)))
+        with pytest.raises(ConnectionError):
+            await queue.dispatch_round()
+        assert sent == [100, 101]
+        assert await queue.backend.processing() == []
+
+        queue.send = sent.append
+        await queue.dispatch_round()
+        assert sent == [100, 101, 102, 103, 104, 105]
+
+    async def test_recover_and_leader_gate(self):
+        """调度器崩溃后遗留在处理中列表的任务在下一个调度器开始调度时放回；不是领导者时不调度"""
+        queue, sent = make_queue(target_depth=100, default_weight=2)
+        await queue.push(1, [100, 101, 102])
+        # 取出后、发送前崩溃
+        assert await queue.backend.pop(1, 2) == [100, 101]
+        assert await queue.backend.processing() == [(1, 100), (1, 101)]
+
+        leader = False
+        task = asyncio.create_task(queue.run(poll_ms=1, active=lambda: leader))
+        await asyncio.sleep(0.02)
+        assert sent == []
+
+        leader = True
+        await asyncio.sleep(0.02)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert sent == [100, 101, 102]
+        assert queue.stats()["recovered"] == 2
+        assert await queue.backend.processing() == []
+
+    async def test_single_dispatcher(self, monkeypatch):
+        """未开启高可用时多个进程的调度器也只有持有租约的一个调度，其他调度器不恢复处理中列表"""
+        queue, sent = make_queue(target_depth=100)
+        monkeypatch.setattr(fairqueue, "_fair_queue", queue)
+        monkeypatch.setattr(Config, "SCHEDULER_HA_ENABLED", False)
+        monkeypatch.setattr(Config, "FAIR_QUEUE_POLL_MS", 1)
+        lease = MemoryLeaseBackend()
+        a = LeaderElector(lease, node_id="a", ttl_ms=1000, renew_ms=10)
+        b = LeaderElector(lease, node_id="b", ttl_ms=1000, renew_ms=10)
+        await queue.push(1, [100, 101])
+        await queue.backend.pop(1, 1)
+
+        task_a = asyncio.create_task(fairqueue.run_dispatcher(a))
+        await asyncio.sleep(0.05)
+        task_b = asyncio.create_task(fairqueue.run_dispatcher(b))
+        await asyncio.sleep(0.05)
+        assert a.is_leader and not b.is_leader
+        assert sorted(sent) == [100, 101]
+        assert queue.stats()["recovered"] == 1
+
+        # 持有租约的调度器退出后由另一个接管
+        task_a.cancel()
+        await asyncio.gather(task_a, return_exceptions=True)
+        await asyncio.sleep(0.05)
+        assert b.is_leader
+        task_b.cancel()
+        await asyncio.gather(task_b, return_exceptions=True)
+
+    async def test_quota(self):
+        queue, _ = make_queue(default_quota=3, quotas={"2": 0})
+        await queue.push(1, [1, 2])
+        with pytest.raises(QueueQuotaExceeded):
+            await queue.push(1, [3, 4])
+        assert await queue.backend.backlog(1) == 2
+        # 配额为0表示不限制
+        await queue.push(2, list(range(10)))
+
+    async def test_bulk_create_fair(self, client, headers, user, mocker):
+        """开启公平调度时立即执行的任务进入用户子队列"""
+        from scheduler_service import broker
+
+        mocker.patch.object(Config, "FAIR_QUEUE_ENABLED", True)
+        mocker.patch.object(fairqueue, "_fair_queue", None)
+        broker.flush_all()
+
+        tasks_data = [
+            {"name": f"fair_{i}", "start_time": time.time(), "request_url": "http://example.com"}
+            for i in range(3)
+        ]
+        resp = await client.post(f"{const.TASK_URL}/bulk", headers=headers, json=tasks_data)
+        assert resp.status_code == 200
+        task_ids = resp.json()["task_ids"]
+        assert broker.queues["default"].qsize() == 0
+
+        queue = fairqueue.get_fair_queue()
+        assert await queue.backend.backlog(user.id) == 3
+        assert await queue.dispatch_round() == 3
+        assert broker.queues["default"].qsize() == 3
+
+        resp = await client.get(f"{const.TASK_URL}/{task_ids[0]}", headers=headers)
+        assert resp.json()["message_id"] is None
+        # 不把发送的消息留给后面的测试
+        broker.flush_all()
+
+    async def test_create_task_quota(self, client, headers, user, mocker):
+        mocker.patch.object(Config, "FAIR_QUEUE_ENABLED", True)
+        mocker.patch.object(Config, "FAIR_QUEUE_DEFAULT_QUOTA", 1)
+        mocker.patch.object(fairqueue, "_fair_queue", None)
+
+        task_data = {"name": "quota", "start_time": time.time(), "request_url": "http://example.com"}
+        resp = await client.post(const.TASK_URL, headers=headers, json=task_data)
+        assert resp.status_code == 200
+        resp = await client.post(const.TASK_URL, headers=headers, json=task_data)
+        assert resp.status_code == 429
+        resp = await client.get(const.TASK_URL, headers=headers)
+        assert len(resp.json()["tasks"]) == 1
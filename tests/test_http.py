@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from scheduler_service.config import Config
+from scheduler_service.service import http
+from scheduler_service.utils.metrics import collect
+
+
+@pytest.mark.asyncio
+class TestHttpPool:
+    """测试ping使用的连接池"""
+
+    async def test_shared_pool(self, mocker):
+        mocker.patch.object(Config, "HTTP_POOL_PER_HOST", False)
+        await http.close_session()
+        session = http.get_session("http://a.example.com/ping")
+        assert http.get_session("http://b.example.com/ping") is session
+        assert http.get_session() is session
+        await http.close_session()
+        assert session.is_closed
+
+    async def test_per_host_pool(self, mocker):
+        mocker.patch.object(Config, "HTTP_POOL_PER_HOST", True)
+        mocker.patch.object(Config, "HTTP_MAX_HOST_POOLS", 2)
+        await http.close_session()
+
+        a = http.get_session("http://a.example.com/ping")
+        assert http.get_session("http://A.example.com/other") is a
+        b = http.get_session("https://b.example.com/ping")
+        assert b is not a
+        # 超过上限时关闭最久未使用的连接池
+        http.get_session("http://c.example.com/ping")
+        assert "http://a.example.com" not in http._host_sessions
+        assert len(http._host_sessions) == 2
+
+        stats = (await collect())["http_pool"]
+        assert set(stats) == {"https://b.example.com", "http://c.example.com"}
+        assert stats["https://b.example.com"] == {"connections": 0, "in_use": 0, "idle": 0, "waiting": 0}
+        await http.close_session()
+        assert b.is_closed
+
+    async def test_evicted_pool_closed_after_release(self, mocker):
+        """被淘汰时仍在使用的连接池在最后一个使用者释放后关闭"""
+        mocker.patch.object(Config, "HTTP_POOL_PER_HOST", True)
+        mocker.patch.object(Config, "HTTP_MAX_HOST_POOLS", 1)
+        await http.close_session()
+
+        a = http.get_session("http://a.example.com/ping")
+        async with http.hold_session(a):
+            async with http.hold_session(a):
+                http.get_session("http://b.example.com/ping")
+                assert "http://a.example.com" not in http._host_sessions
+                assert not a.is_closed
+            assert not a.is_closed
+        assert a.is_closed
+        assert a not in http._retired and a not in http._session_users
+
+        # 没有使用者的连接池被淘汰时直接关闭
+        b = http._host_sessions["http://b.example.com"]
+        http.get_session("http://c.example.com/ping")
+        await asyncio.sleep(0)
+        assert b.is_closed
+        await http.close_session()
+
+    async def test_http2_fallback(self, mocker):
+        mocker.patch.object(Config, "HTTP2", True)
+        client = mocker.patch("scheduler_service.service.http.httpx.AsyncClient",
+                              side_effect=[ImportError("h2"), mocker.MagicMock()])
+        http._new_client(10, 5)
+        assert client.call_count == 2
+        assert "http2" not in client.call_args.kwargs
@@ -0,0 +1,111 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from scheduler_service.utils.leader import LeaderElector, MemoryBackend
+
+
+@pytest.mark.asyncio
+class TestLeaderElection:
+    """测试租约选举"""
+
+    async def test_single_leader(self):
+        backend = MemoryBackend()
+        a = LeaderElector(backend, "a", ttl_ms=1000)
+        b = LeaderElector(backend, "b", ttl_ms=1000)
+
+        await a.step()
+        await b.step()
+        assert a.is_leader and a.token == 1
+        assert not b.is_leader
+        assert await a.check()
+        assert not await b.check()
+
+        # 续期不改变令牌
+        await a.step()
+        assert a.token == 1
+
+    async def test_takeover_after_lease_expires(self):
+        """领导者停止续期后，租约过期由备用节点接管，旧令牌失效"""
+        backend = MemoryBackend()
+        demoted = AsyncMock()
+        a = LeaderElector(backend, "a", ttl_ms=50, on_demoted=demoted)
+        elected = AsyncMock()
+        b = LeaderElector(backend, "b", ttl_ms=50, on_elected=elected)
+
+        await a.step()
+        await asyncio.sleep(0.06)
+        await b.step()
+        assert b.is_leader and b.token == 2
+        elected.assert_awaited_once_with(2)
+
+        # 旧领导者本地租约已到期，防护检查失败
+        assert not a.is_leader
+        assert not await a.check()
+
+        # 旧领导者恢复后续期失败并降级
+        await a.step()
+        assert a.token == 0
+        demoted.assert_awaited_once()
+
+    async def test_release_on_shutdown(self):
+        """正常退出时释放租约，备用节点立即接管"""
+        backend = MemoryBackend()
+        a = LeaderElector(backend, "a", ttl_ms=10000, renew_ms=10)
+        b = LeaderElector(backend, "b", ttl_ms=10000)
+
+        task = asyncio.create_task(a.run())
+        await asyncio.sleep(0.02)
+        assert a.is_leader
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert not a.is_leader
+
+        await b.step()
+        assert b.is_leader and b.token == 2
+
+    async def test_renewal_error_keeps_leadership_until_deadline(self):
+        backend = MemoryBackend()
+        a = LeaderElector(backend, "a", ttl_ms=50)
+        await a.step()
+
+        with patch.object(backend, "acquire", AsyncMock(side_effect=ConnectionError("redis down"))):
+            await a.step()
+            assert a.is_leader
+            await asyncio.sleep(0.06)
+            await a.step()
+        assert a.token == 0
+        assert a.stats()["errors"] == 2
+
+    async def test_scheduler_follows_leadership(self, monkeypatch):
+        """成为领导者时恢复调度器，失去领导权时暂停"""
+        from scheduler_service.config import Config
+        from scheduler_service.service import leader
+
+        monkeypatch.setattr(Config, "SCHEDULER_HA_ENABLED", True)
+        monkeypatch.setattr(Config, "SCHEDULER_LEADER_RENEW_MS", 10)
+        monkeypatch.setattr(leader, "_elector", None)
+        scheduler = MagicMock(running=True)
+
+        task = leader.start_scheduler(scheduler)
+        scheduler.start.assert_called_once_with(paused=True)
+        await asyncio.sleep(0.03)
+        scheduler.resume.assert_called_once()
+        assert await leader.check_leader()
+
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        scheduler.pause.assert_called_once()
+        assert not await leader.check_leader()
+
+    async def test_trigger_skipped_when_not_leader(self, stub_broker):
+        from scheduler_service.service.request import trigger_cron_task
+
+        with patch("scheduler_service.service.request.check_leader", AsyncMock(return_value=False)), \
+                patch("scheduler_service.service.request.incr_cron_count", AsyncMock()) as incr:
+            await trigger_cron_task(1, 1)
+        assert stub_broker.queues["cron"].qsize() == 0
+        incr.assert_not_awaited()
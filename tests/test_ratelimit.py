@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from scheduler_service.config import Config
+from scheduler_service.service import throttle
+from scheduler_service.utils.ratelimit import MemoryBackend, RateLimiter
+
+
+class CountingBackend(MemoryBackend):
+    def __init__(self):
+        super().__init__()
+        self.takes = 0
+
+    async def take(self, key, rate, burst, requested):
+        self.takes += 1
+        return await super().take(key, rate, burst, requested)
+
+
+@pytest.mark.asyncio
+class TestRateLimiter:
+    """测试令牌桶与本地租借"""
+
+    async def test_token_bucket(self):
+        backend = MemoryBackend()
+        assert await backend.take("host", rate=10, burst=5, requested=3) == (3, 0)
+        assert await backend.take("host", rate=10, burst=5, requested=3) == (2, 0)
+        granted, wait = await backend.take("host", rate=10, burst=5, requested=1)
+        assert granted == 0
+        assert 0 < wait <= 100
+
+        await asyncio.sleep(0.12)
+        assert (await backend.take("host", rate=10, burst=5, requested=1))[0] == 1
+
+    async def test_lease(self):
+        backend = CountingBackend()
+        limiter = RateLimiter(backend, lease_size=10, lease_ms=1000)
+
+        for _ in range(10):
+            assert await limiter.acquire("host", rate=100, burst=100) == 0
+        # 10个令牌只访问了一次后端
+        assert backend.takes == 1
+        assert await limiter.acquire("host", rate=100, burst=100) == 0
+        assert backend.takes == 2
+
+    async def test_lease_exhausted(self):
+        limiter = RateLimiter(MemoryBackend(), lease_size=10, lease_ms=1000)
+        results = [await limiter.acquire("host", rate=2, burst=2) for _ in range(3)]
+        assert results[:2] == [0, 0]
+        assert results[2] > 0
+
+    async def test_slots(self):
+        backend = MemoryBackend()
+        assert await backend.acquire_slot("host", 2, 1000, "a")
+        assert await backend.acquire_slot("host", 2, 1000, "b")
+        assert not await backend.acquire_slot("host", 2, 1000, "c")
+        await backend.release_slot("host", "a")
+        assert await backend.acquire_slot("host", 2, 1000, "c")
+        # 未释放的槽位超时后失效
+        assert await backend.acquire_slot("expiring", 1, 10, "a")
+        await asyncio.sleep(0.02)
+        assert await backend.acquire_slot("expiring", 1, 10, "b")
+
+
+@pytest.mark.asyncio
+class TestHostThrottle:
+    """测试按主机限流"""
+
+    @pytest.fixture(autouse=True)
+    def limits(self, mocker):
+        mocker.patch.object(Config, "RATE_LIMIT_ENABLED", True)
+        mocker.patch.object(Config, "RATE_LIMITS", {
+            "*.slow.internal": {"rate": 1, "burst": 1},
+            "busy.internal": {"max_in_flight": 1},
+        })
+        mocker.patch.object(throttle, "_limiter", None)
+
+    async def test_host_limits(self):
+        assert throttle.host_limits("http://API.slow.internal/x") == ("api.slow.internal", {"rate": 1, "burst": 1})
+        assert throttle.host_limits("http://other.com/x") == ("other.com", None)
+
+    async def test_rate(self):
+        assert await throttle.acquire_host("http://a.slow.internal/x") == (0, None)
+        delay, slot = await throttle.acquire_host("http://a.slow.internal/x")
+        assert delay > 0
+        # 每个主机单独计数
+        assert await throttle.acquire_host("http://b.slow.internal/x") == (0, None)
+        assert await throttle.acquire_host("http://other.com/x") == (0, None)
+
+    async def test_in_flight(self):
+        delay, slot = await throttle.acquire_host("http://busy.internal/x")
+        assert delay == 0 and slot is not None
+        assert (await throttle.acquire_host("http://busy.internal/y")) == (Config.RATE_LIMIT_RETRY_DELAY_MS, None)
+
+        await throttle.release_host(slot)
+        delay, slot = await throttle.acquire_host("http://busy.internal/x")
+        assert delay == 0
@@ -0,0 +1,161 @@
+import pickle
+import time
+from datetime import datetime
+
+import pytest
+from apscheduler.job import Job
+from apscheduler.jobstores.redis import RedisJobStore
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
+
+from scheduler_service.config import Config
+from scheduler_service.models import RequestTask
+from scheduler_service.service import crongroup, reconcile
+from scheduler_service.service.request import trigger_cron_task
+from tests import const
+
+
+def cron_task(name, cron="*/5 * * * *", **kwargs):
+    return {"name": name, "start_time": time.time(), "request_url": "http://example.com", "cron": cron, **kwargs}
+
+
+@pytest.fixture
+async def scheduler(app):
+    """启动（暂停的）调度器，待添加的任务才会写入任务存储"""
+    from scheduler_service import get_scheduler
+
+    scheduler = get_scheduler()
+    scheduler.start(paused=True)
+    yield scheduler
+    scheduler.shutdown(wait=False)
+
+
+@pytest.fixture
+def grouped(monkeypatch):
+    monkeypatch.setattr(Config, "CRON_GROUPED", True)
+    monkeypatch.setattr(crongroup, "_backend", crongroup.MemoryBackend())
+    return crongroup._backend
+
+
+@pytest.mark.asyncio
+class TestReconcile:
+    """测试cron任务与任务存储的对账"""
+
+    async def test_reconcile_jobs(self, client, headers, user, scheduler, monkeypatch):
+        monkeypatch.setattr(Config, "CRON_RECONCILE_ASSIGN_GRACE_MS", 0)
+        resp = await client.post(f"{const.TASK_URL}/bulk", headers=headers,
+                                 json=[cron_task(f"t{i}") for i in range(3)])
+        tasks = [await RequestTask.get(id=task_id) for task_id in resp.json()["task_ids"]]
+        # 注册调度任务失败的任务
+        unassigned = await RequestTask.create(name="no_job", user_id=user.id, request_url="http://example.com",
+                                              cron="0 * * * *")
+        deleted = await RequestTask.create(name="deleted", user_id=user.id, request_url="http://example.com",
+                                           cron="0 * * * *", job_id="deleted-job")
+        scheduler.add_job(trigger_cron_task, CronTrigger.from_crontab("0 * * * *"),
+                          args=[deleted.id, user.id, None], id="deleted-job")
+        await deleted.delete()
+        # 同一任务重复注册的调度任务
+        scheduler.add_job(trigger_cron_task, CronTrigger.from_crontab("*/5 * * * *"),
+                          args=[tasks[1].id, user.id, None], id="duplicate-job")
+        scheduler.add_job(time.time, "interval", hours=1, id="other")
+
+        scheduler.remove_job(tasks[0].job_id)
+        scheduler.get_job(tasks[2].job_id).pause()
+
+        stats = await reconcile.reconcile_jobs(scheduler, batch_size=2)
+        assert stats == {"tasks": 4, "skipped": 0, "assigned": 1, "deferred": 0, "added": 2, "rescheduled": 1, "removed": 2,
+                         "members_added": 0, "members_removed": 0}
+
+        job = scheduler.get_job(tasks[0].job_id)
+        assert job.args == (tasks[0].id, user.id, None)
+        assert job.next_run_time is not None
+        assert scheduler.get_job(tasks[2].job_id).next_run_time is not None
+        await unassigned.refresh_from_db()
+        assert scheduler.get_job(unassigned.job_id).args == (unassigned.id, user.id, None)
+        assert scheduler.get_job("deleted-job") is None
+        assert scheduler.get_job("duplicate-job") is None
+        assert scheduler.get_job("other") is not None
+
+        # 没有差异时不做任何修改
+        stats = await reconcile.reconcile_jobs(scheduler)
+        assert stats["tasks"] == 4
+        assert not any(value for key, value in stats.items() if key != "tasks")
+
+    async def test_assign_grace(self, user, scheduler, monkeypatch):
+        """首次发现未超过宽限期的任务推迟分配，期间保存了 job_id 的任务不再分配"""
+        monkeypatch.setattr(reconcile, "_seen_backend", reconcile.MemorySeenBackend())
+        monkeypatch.setattr(Config, "CRON_RECONCILE_ASSIGN_GRACE_MS", 60000)
+        creating = await RequestTask.create(name="creating", user_id=user.id, request_url="http://example.com",
+                                            cron="* * * * *")
+        failed = await RequestTask.create(name="failed", user_id=user.id, request_url="http://example.com",
+                                          cron="* * * * *")
+
+        start = time.monotonic()
+        stats = await reconcile.reconcile_jobs(scheduler)
+        # 不等待宽限期
+        assert time.monotonic() - start < 5
+        assert (stats["assigned"], stats["deferred"]) == (0, 2)
+        assert scheduler.get_jobs() == []
+
+        # API注册调度任务后保存 job_id
+        scheduler.add_job(trigger_cron_task, CronTrigger.from_crontab("* * * * *"),
+                          args=[creating.id, user.id, None], id="api-job")
+        await RequestTask.filter(id=creating.id).update(job_id="api-job")
+
+        # 宽限期已过：只为仍没有 job_id 的任务分配，下一次运行时间按分配时计算
+        monkeypatch.setattr(Config, "CRON_RECONCILE_ASSIGN_GRACE_MS", 0)
+        stats = await reconcile.assign_deferred(scheduler, [creating.id, failed.id])
+        assert (stats["assigned"], stats["deferred"]) == (1, 0)
+        await creating.refresh_from_db()
+        await failed.refresh_from_db()
+        assert creating.job_id == "api-job"
+        assert sorted(job.id for job in scheduler.get_jobs()) == sorted(["api-job", failed.job_id])
+        assert scheduler.get_job(failed.job_id).next_run_time > datetime.now(scheduler.timezone)
+
+    async def test_reconcile_groups(self, client, headers, user, scheduler, grouped):
+        resp = await client.post(f"{const.TASK_URL}/bulk", headers=headers,
+                                 json=[cron_task("g0"), cron_task("g1"), cron_task("other", "0 0 * * *")])
+        tasks = [await RequestTask.get(id=task_id) for task_id in resp.json()["task_ids"]]
+        gid = crongroup.group_id("*/5 * * * *")
+        other_gid = crongroup.group_id("0 0 * * *")
+
+        # 分组调度任务和成员丢失，另一个分组中残留已删除任务的成员
+        scheduler.remove_job(tasks[0].job_id)
+        await grouped.remove(gid, [crongroup.member(tasks[1].id, user.id)])
+        await grouped.add(gid, [crongroup.member(999, user.id)])
+        await tasks[2].delete()
+
+        stats = await reconcile.reconcile_jobs(scheduler)
+        assert stats["added"] == 1
+        assert stats["members_added"] == 1
+        assert stats["members_removed"] == 2
+        # 没有任务和成员的分组被删除
+        assert stats["removed"] == 1
+        assert scheduler.get_job(crongroup.group_job_id(gid)).args == (gid, None)
+        assert scheduler.get_job(crongroup.group_job_id(other_gid)) is None
+        assert await grouped.count(gid) == 2
+        assert await grouped.count(other_gid) == 0
+
+    async def test_redis_job_state(self):
+        """写入Redis的任务状态与 RedisJobStore.add_job 相同，可以被 APScheduler 还原"""
+        jobstore = RedisJobStore()
+        scheduler = AsyncIOScheduler(timezone="Asia/Shanghai",
+                                     job_defaults={"misfire_grace_time": 30, "coalesce": True})
+        backend = reconcile.RedisJobBackend(scheduler, jobstore)
+        trigger = CronTrigger.from_crontab("*/5 * * * *")
+        next_run_time = trigger.get_next_fire_time(None, datetime.now(trigger.timezone))
+
+        state = backend.serialize("job-1", trigger_cron_task, trigger, [1, 1, None], next_run_time)
+        expected = Job(scheduler, id="job-1", func=trigger_cron_task, trigger=trigger, executor="default",
+                       args=(1, 1, None), kwargs={}, name=None, misfire_grace_time=30, coalesce=True,
+                       max_instances=1, next_run_time=next_run_time)
+        assert state == pickle.dumps(expected.__getstate__(), jobstore.pickle_protocol)
+
+        job = Job.__new__(Job)
+        job.__setstate__(pickle.loads(state))
+        assert job.id == "job-1"
+        assert job.func is trigger_cron_task
+        assert job.args == (1, 1, None)
+        assert str(job.trigger) == str(trigger)
+        assert job.next_run_time == next_run_time
+        assert job.misfire_grace_time == 30
@@ -0,0 +1,204 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from scheduler_service.constants import TaskStatus
+from scheduler_service.models import RequestTask, TaskRun
+from scheduler_service.utils.buffer import WriteBehindBuffer
+
+
+@pytest.mark.asyncio
+class TestWriteBehindBuffer:
+    """测试写后缓冲区"""
+
+    async def test_flush_when_full(self):
+        flushed = []
+
+        async def flush(items):
+            flushed.append(items)
+
+        buffer = WriteBehindBuffer("test_full", flush, interval_ms=60000, max_items=3)
+        for i in range(7):
+            await buffer.add(i)
+
+        assert flushed == [[0, 1, 2], [3, 4, 5]]
+        assert buffer.stats()["pending"] == 1
+
+        await buffer.flush()
+        assert flushed[-1] == [6]
+        stats = buffer.stats()
+        assert stats["flushes"] == 3
+        assert stats["items"] == 7
+        assert stats["max_size"] == 3
+        assert stats["pending"] == 0
+
+    async def test_flush_after_interval(self):
+        flushed = []
+
+        async def flush(items):
+            flushed.append(items)
+
+        buffer = WriteBehindBuffer("test_interval", flush, interval_ms=10, max_items=100)
+        await buffer.add("a")
+        await buffer.add("b")
+        assert flushed == []
+
+        await asyncio.sleep(0.05)
+        assert flushed == [["a", "b"]]
+
+    async def test_failed_flush_keeps_items(self):
+        calls = []
+
+        async def flush(items):
+            calls.append(list(items))
+            if len(calls) == 1:
+                raise RuntimeError("db down")
+
+        buffer = WriteBehindBuffer("test_retry", flush, interval_ms=60000, max_items=100)
+        await buffer.add(1)
+        await buffer.flush()
+        assert buffer.stats()["failures"] == 1
+        assert buffer.stats()["pending"] == 1
+
+        await buffer.add(2)
+        await buffer.flush()
+        assert calls[-1] == [1, 2]
+        assert buffer.stats()["pending"] == 0
+
+    async def test_failed_flush_drops_oldest(self):
+        async def flush(items):
+            raise RuntimeError("db down")
+
+        buffer = WriteBehindBuffer("test_cap", flush, interval_ms=60000, max_items=2, max_pending=3)
+        for i in range(5):
+            await buffer.add(i)
+        await buffer.flush()
+
+        assert buffer.pending_items() == [2, 3, 4]
+        assert buffer.stats()["dropped"] == 2
+
+
+@pytest.mark.asyncio
+class TestStatusSink:
+    """测试任务状态批量写入"""
+
+    async def test_bulk_finish(self, user):
+        tasks = [
+            await RequestTask.create(
+                name=f"status_{i}",
+                start_time=datetime.now(),
+                user_id=user.id,
+                request_url="http://example.com",
+                body={"i": i}
+            )
+            for i in range(3)
+        ]
+
+        await RequestTask.bulk_finish([
+            (tasks[0].id, TaskStatus.COMPLETED, None, None),
+            (tasks[1].id, TaskStatus.FAILED, "timeout", None),
+        ])
+
+        for task in tasks:
+            await task.refresh_from_db()
+        assert (tasks[0].status, tasks[0].error_message) == (TaskStatus.COMPLETED, None)
+        assert (tasks[1].status, tasks[1].error_message) == (TaskStatus.FAILED, "timeout")
+        assert tasks[2].status == TaskStatus.PENDING
+        assert tasks[1].body == {"i": 1}
+
+    async def test_record_status_buffered(self, user, mocker):
+        from scheduler_service.service import status
+
+        mocker.patch.object(status.Config, "STATUS_WRITE_MODE", "buffered")
+        mocker.patch.object(status, "_status_buffer", None)
+        task = await RequestTask.create(
+            name="buffered",
+            start_time=datetime.now(),
+            user_id=user.id,
+            request_url="http://example.com"
+        )
+
+        await status.record_status(task.id, TaskStatus.FAILED, "first")
+        await status.record_status(task.id, TaskStatus.COMPLETED)
+        await task.refresh_from_db()
+        assert task.status == TaskStatus.PENDING
+
+        await status.get_status_buffer().flush()
+        await task.refresh_from_db()
+        assert task.status == TaskStatus.COMPLETED
+        assert task.error_message is None
+
+    async def test_stale_status_after_reclaim(self, user, mocker):
+        """租约过期后任务被重新认领，旧认领的执行结果不会覆盖新的运行中状态"""
+        from scheduler_service.service import status
+
+        mocker.patch.object(status.Config, "STATUS_WRITE_MODE", "buffered")
+        mocker.patch.object(status, "_status_buffer", None)
+        task = await RequestTask.create(
+            name="reclaimed",
+            start_time=datetime.now(),
+            user_id=user.id,
+            request_url="http://example.com"
+        )
+
+        first = await RequestTask.claim(task.id, 60000)
+        await status.record_status(task.id, TaskStatus.FAILED, "late", first.claimed_at)
+        await asyncio.sleep(0.01)
+        second = await RequestTask.claim(task.id, 1)
+        assert second is not None and second.claimed_at != first.claimed_at
+
+        await status.get_status_buffer().flush()
+        await task.refresh_from_db()
+        assert (task.status, task.error_message) == (TaskStatus.RUNNING, None)
+
+        await status.record_status(task.id, TaskStatus.COMPLETED, None, second.claimed_at)
+        await status.get_status_buffer().flush()
+        await task.refresh_from_db()
+        assert task.status == TaskStatus.COMPLETED
+
+    async def test_flush_before_claim(self, user, mocker):
+        """认领前先写入本进程中尚未刷写的状态，cron任务的下一次执行不会被运行中租约挡住"""
+        from scheduler_service.service import status
+
+        mocker.patch.object(status.Config, "STATUS_WRITE_MODE", "buffered")
+        mocker.patch.object(status, "_status_buffer", None)
+        task = await RequestTask.create(
+            name="next_run",
+            start_time=datetime.now(),
+            user_id=user.id,
+            request_url="http://example.com"
+        )
+
+        claimed = await RequestTask.claim(task.id, 60000)
+        await status.record_status(task.id, TaskStatus.COMPLETED, None, claimed.claimed_at)
+        assert await RequestTask.claim(task.id, 60000) is None
+
+        await status.flush_pending_status(task.id)
+        assert status.get_status_buffer().stats()["pending"] == 0
+        assert await RequestTask.claim(task.id, 60000) is not None
+
+    async def test_record_run(self, app, mocker):
+        from scheduler_service.service import status
+
+        mocker.patch.object(status, "_run_buffer", None)
+        started_at = datetime(2026, 1, 1, 12, 0, 0)
+        await status.record_run(1, started_at, started_at, TaskStatus.COMPLETED, 200, 12.5)
+        await status.record_run(1, started_at, started_at, TaskStatus.FAILED, None, 30.0, "timeout")
+        assert await TaskRun.filter(task_id=1).count() == 0
+
+        await status.get_run_buffer().flush()
+        runs = await TaskRun.filter(task_id=1).order_by("id")
+        assert [(run.status, run.status_code, run.error_message) for run in runs] == [
+            (TaskStatus.COMPLETED, 200, None),
+            (TaskStatus.FAILED, None, "timeout"),
+        ]
+
+    async def test_partition_names(self):
+        from datetime import date
+
+        from scheduler_service.models.run import _partition_day, partition_name
+
+        assert partition_name(date(2026, 1, 2)) == "taskrun_p20260102"
+        assert _partition_day("taskrun_p20260102") == date(2026, 1, 2)
+        assert _partition_day("taskrun_default") is None
@@ -1,14 +1,18 @@
+import json
 import time
-from datetime import datetime
-from unittest.mock import AsyncMock, patch
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import httpx
 import pytest
 
+from scheduler_service.config import Config
 from scheduler_service.constants import RequestStatus, TaskStatus
-from scheduler_service.models import RequestTask
+from scheduler_service.models import RequestTask, TaskRun
 from tests import const
 
+LEASE_MS = 60 * 1000
+
 
 @pytest.mark.asyncio
 class TestTaskModel:
@@ -71,6 +75,84 @@ class TestTaskModel:
         assert task_dict["body"] == {"data": "test"}
         await task.delete()
 
+    async def test_task_indexes(self, app):
+        """测试任务表索引不由 generate_schemas 创建，只由在线建索引语句创建"""
+        from scheduler_service.models import TASK_INDEXES
+        from scheduler_service.models.sql import index_sql
+
+        db = RequestTask._meta.db
+        _, rows = await db.execute_query(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'requesttask'"
+        )
+        names = {row["name"] for row in rows}
+        for index in TASK_INDEXES:
+            assert index.name not in names
+
+        assert index_sql(RequestTask, TASK_INDEXES[0]) == (
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_requesttask_user_id_id" '
+            'ON "requesttask" ("user_id", "id")'
+        )
+
+    async def test_task_claim_and_finish(self, user):
+        """测试任务的认领与完成状态流转"""
+        task = await RequestTask.create(
+            name="claim_test",
+            start_time=datetime.now(),
+            user_id=user.id,
+            request_url="http://example.com",
+            body={"data": "test"},
+            error_message="previous error"
+        )
+
+        claimed = await RequestTask.claim(task.id, LEASE_MS)
+        assert claimed.id == task.id
+        assert claimed.body == {"data": "test"}
+        assert claimed.status == TaskStatus.RUNNING
+        assert claimed.error_message is None
+        assert claimed.claimed_at is not None
+
+        # 正在运行的任务不能被再次认领
+        assert await RequestTask.claim(task.id, LEASE_MS) is None
+        assert await RequestTask.claim(99999, LEASE_MS) is None
+
+        await RequestTask.finish(task.id, TaskStatus.FAILED, "boom")
+        await task.refresh_from_db()
+        assert task.status == TaskStatus.FAILED
+        assert task.error_message == "boom"
+
+        # 结束后的cron任务可以再次被认领
+        assert await RequestTask.claim(task.id, LEASE_MS) is not None
+
+        await RequestTask.filter(id=task.id).update(status=TaskStatus.CANCELLED)
+        assert await RequestTask.claim(task.id, LEASE_MS) is None
+
+
+    async def test_claim_expired_lease(self, user):
+        """worker在执行中退出后，任务超过租约可以被下一次触发重新认领并执行"""
+        from scheduler_service.service.request import run_ping
+
+        task = await RequestTask.create(
+            name="lease_test", user_id=user.id, request_url="http://example.com", cron="* * * * *"
+        )
+        # worker认领任务后退出，没有写回结束状态
+        lease_ms = Config.PING_TIME_LIMIT_MS
+        assert await RequestTask.claim(task.id, lease_ms) is not None
+        assert await RequestTask.claim(task.id, lease_ms) is None
+
+        expired = datetime.now(timezone.utc) - timedelta(milliseconds=lease_ms + 1000)
+        await RequestTask.filter(id=task.id).update(claimed_at=expired)
+        session = mock_session(mock_response())
+        with patch('scheduler_service.service.request.get_session', return_value=session):
+            await run_ping(task.id)
+
+        session.send.assert_awaited_once()
+        await task.refresh_from_db()
+        assert task.status == TaskStatus.COMPLETED
+        assert task.claimed_at > expired
+
+        # 升级前就处于运行中、没有认领时间的任务同样可以被认领
+        await RequestTask.filter(id=task.id).update(status=TaskStatus.RUNNING, claimed_at=None)
+        assert await RequestTask.claim(task.id, lease_ms) is not None
 
 @pytest.mark.asyncio
 class TestTaskAPI:
@@ -148,6 +230,91 @@ class TestTaskAPI:
         for task_id in response_data["task_ids"]:
             await client.delete(f"{const.TASK_URL}/{task_id}", headers=headers)
 
+    async def test_bulk_create_task_mixed(self, client, headers, user):
+        """测试批量创建一次性任务和cron任务，并回写 message_id / job_id"""
+        from scheduler_service import get_scheduler
+
+        tasks_data = [
+            {
+                "name": "bulk_once",
+                "start_time": time.time(),
+                "request_url": "http://example.com/once",
+                "method": "PUT"
+            },
+            {
+                "name": "bulk_cron",
+                "start_time": time.time(),
+                "request_url": "http://example.com/cron",
+                "cron": "*/5 * * * *"
+            }
+        ]
+
+        resp = await client.post(f"{const.TASK_URL}/bulk", headers=headers, json=tasks_data)
+        assert resp.status_code == 200
+        once_id, cron_id = resp.json()["task_ids"]
+        assert once_id < cron_id
+
+        once = await RequestTask.get(id=once_id)
+        assert once.name == "bulk_once"
+        assert once.method == "PUT"
+        assert once.user_id == user.id
+        assert once.body == {}
+        assert once.message_id is not None
+        assert once.job_id is None
+
+        cron = await RequestTask.get(id=cron_id)
+        assert cron.message_id is None
+        assert get_scheduler().get_job(cron.job_id) is not None
+
+        for task_id in (once_id, cron_id):
+            await client.delete(f"{const.TASK_URL}/{task_id}", headers=headers)
+
+    async def test_bulk_create_task_invalid_cron(self, client, headers):
+        """测试批量创建时任一cron无效则不创建任何任务"""
+        tasks_data = [
+            {"name": "valid", "start_time": time.time(), "request_url": "http://example.com"},
+            {"name": "invalid", "start_time": time.time(), "request_url": "http://example.com",
+             "cron": "invalid * * *"}
+        ]
+
+        resp = await client.post(f"{const.TASK_URL}/bulk", headers=headers, json=tasks_data)
+        assert resp.status_code == 400
+        assert "Invalid cron expression" in resp.json()["detail"]
+        assert await RequestTask.all().count() == 0
+
+    async def test_bulk_create_task_rollback(self, client, headers, mocker):
+        """测试批量创建中途失败时撤销已创建的任务和定时任务"""
+        from scheduler_service import get_scheduler
+
+        mocker.patch("scheduler_service.api.v1.task._send_ping", side_effect=RuntimeError("broker down"))
+        tasks_data = [
+            {"name": "cron", "start_time": time.time(), "request_url": "http://example.com",
+             "cron": "* * * * *"},
+            {"name": "once", "start_time": time.time(), "request_url": "http://example.com"}
+        ]
+
+        with pytest.raises(RuntimeError, match="broker down"):
+            await client.post(f"{const.TASK_URL}/bulk", headers=headers, json=tasks_data)
+
+        assert await RequestTask.all().count() == 0
+        assert get_scheduler().get_jobs() == []
+
+    async def test_bulk_create_task_job_id_in_transaction(self, client, headers, mocker):
+        """测试 job_id 与任务在同一个事务中写入，回写失败时不留下 job_id 为空的任务"""
+        from scheduler_service import get_scheduler
+
+        mocker.patch.object(RequestTask, "bulk_update", side_effect=RuntimeError("db down"))
+        tasks_data = [
+            {"name": "cron", "start_time": time.time(), "request_url": "http://example.com",
+             "cron": "* * * * *"}
+        ]
+
+        with pytest.raises(RuntimeError, match="db down"):
+            await client.post(f"{const.TASK_URL}/bulk", headers=headers, json=tasks_data)
+
+        assert await RequestTask.all().count() == 0
+        assert get_scheduler().get_jobs() == []
+
     async def test_create_task_delayed(self, client, headers, mocker):
         """测试创建延迟任务"""
         # 模拟当前时间为 T
@@ -192,6 +359,56 @@ class TestTaskAPI:
         mock_ping.send.assert_called_once()
         mock_ping.send_with_options.assert_not_called()
 
+    async def test_create_task_lane(self, client, headers, stub_broker):
+        """指定通道的任务进入该通道的队列"""
+        task_data = {
+            "name": "priority_task",
+            "start_time": time.time(),
+            "request_url": "http://example.com",
+            "lane": "priority"
+        }
+        resp = await client.post(const.TASK_URL, headers=headers, json=task_data)
+        assert resp.status_code == 200
+        assert stub_broker.queues["priority"].qsize() == 1
+        assert stub_broker.queues["default"].qsize() == 0
+
+        resp = await client.get(f"{const.TASK_URL}/{resp.json()['task_id']}", headers=headers)
+        assert resp.json()["lane"] == "priority"
+
+        resp = await client.get("/api/v1/metrics", headers=headers)
+        lanes = resp.json()["lanes"]
+        assert lanes["priority"]["depth"] == 1
+        assert lanes["priority"]["lag_ms"] >= 0
+        assert lanes["default"]["depth"] == 0
+        assert "callbacks" in lanes
+
+        # 未配置的通道
+        task_data["lane"] = "unknown"
+        resp = await client.post(const.TASK_URL, headers=headers, json=task_data)
+        assert resp.status_code == 422
+
+    async def test_trigger_cron_task_lane(self, user, stub_broker, monkeypatch):
+        """cron任务默认进入cron通道，也可以指定其他通道"""
+        from scheduler_service.service import counters
+        from scheduler_service.service.request import trigger_cron_task
+
+        monkeypatch.setattr(counters, "_backend", counters.MemoryBackend())
+
+        task = await RequestTask.create(
+            name="cron_lane_task", start_time=datetime.now(), request_url="http://example.com",
+            method="GET", body={}, cron="* * * * *", user=user
+        )
+        await trigger_cron_task(task.id, user.id)
+        assert stub_broker.queues["cron"].qsize() == 1
+
+        await trigger_cron_task(task.id, user.id, "priority")
+        assert stub_broker.queues["priority"].qsize() == 1
+        assert stub_broker.queues["default"].qsize() == 0
+
+        await counters.flush_cron_counts()
+        await task.refresh_from_db()
+        assert task.cron_count == 2
+
     async def test_get_tasks(self, client, headers, user):
         """测试获取任务列表"""
         task1 = await RequestTask.create(
@@ -216,6 +433,91 @@ class TestTaskAPI:
         await task1.delete()
         await task2.delete()
 
+    async def test_get_tasks_pagination(self, client, headers, user):
+        """测试按游标分页获取任务"""
+        for i in range(5):
+            await RequestTask.create(
+                name=f"page_{i}",
+                start_time=datetime.now(),
+                user_id=user.id,
+                request_url=f"http://example.com/{i}"
+            )
+
+        names = []
+        cursor = None
+        while True:
+            params = {"limit": 2}
+            if cursor is not None:
+                params["cursor"] = cursor
+            resp = await client.get(const.TASK_URL, headers=headers, params=params)
+            assert resp.status_code == 200
+            data = resp.json()
+            assert len(data["tasks"]) <= 2
+            names.extend(t["name"] for t in data["tasks"])
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+
+        assert names == [f"page_{i}" for i in range(5)]
+
+        resp = await client.get(const.TASK_URL, headers=headers, params={"limit": 2, "all": "true"})
+        assert len(resp.json()["tasks"]) == 5
+
+    async def test_get_tasks_filters_and_fields(self, client, headers, user):
+        """测试任务列表的过滤与字段投影"""
+        now = time.time()
+        await RequestTask.create(
+            name="done_once",
+            start_time=datetime.fromtimestamp(now - 3600),
+            user_id=user.id,
+            request_url="http://example.com/1",
+            status=TaskStatus.COMPLETED
+        )
+        await RequestTask.create(
+            name="pending_cron",
+            start_time=datetime.fromtimestamp(now),
+            user_id=user.id,
+            request_url="http://example.com/2",
+            cron="* * * * *"
+        )
+
+        resp = await client.get(const.TASK_URL, headers=headers, params={"status": "completed"})
+        assert [t["name"] for t in resp.json()["tasks"]] == ["done_once"]
+
+        resp = await client.get(const.TASK_URL, headers=headers, params={"has_cron": "true"})
+        assert [t["name"] for t in resp.json()["tasks"]] == ["pending_cron"]
+
+        resp = await client.get(const.TASK_URL, headers=headers, params={"start_time_to": now - 60})
+        assert [t["name"] for t in resp.json()["tasks"]] == ["done_once"]
+
+        resp = await client.get(const.TASK_URL, headers=headers, params={"fields": "name,status"})
+        assert resp.json()["tasks"][0].keys() == {"id", "name", "status"}
+
+        resp = await client.get(const.TASK_URL, headers=headers, params={"fields": "name,password"})
+        assert resp.status_code == 400
+
+    @pytest.mark.parametrize("gzip", [False, True])
+    async def test_export_tasks(self, gzip, client, headers, user):
+        """测试以NDJSON流式导出任务"""
+        for i in range(5):
+            await RequestTask.create(
+                name=f"export_{i}",
+                start_time=datetime.now(),
+                user_id=user.id,
+                request_url=f"http://example.com/{i}",
+                body={"index": i}
+            )
+
+        resp = await client.get(f"{const.TASK_URL}/export", headers=headers,
+                                params={"chunk_size": 2, "gzip": gzip})
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("application/x-ndjson")
+        assert (resp.headers.get("content-encoding") == "gzip") is gzip
+
+        rows = [json.loads(line) for line in resp.text.splitlines()]
+        assert [row["name"] for row in rows] == [f"export_{i}" for i in range(5)]
+        assert rows[3]["body"] == {"index": 3}
+
     async def test_get_task(self, client, headers, user):
         """测试获取单个任务"""
         task = await RequestTask.create(
@@ -318,151 +620,259 @@ class TestTaskAPI:
         await client.delete(f"{const.TASK_URL}/{task1_id}", headers=headers)
 
 
+    async def test_get_task_runs(self, client, headers, user):
+        """测试分页获取任务执行历史"""
+        task = await RequestTask.create(
+            name="runs_test",
+            start_time=datetime.now(),
+            user_id=user.id,
+            request_url="http://example.com"
+        )
+        base = datetime(2026, 1, 1, 12, 0, 0)
+        await TaskRun.bulk_insert([
+            TaskRun(task_id=task.id, started_at=base + timedelta(minutes=i),
+                    finished_at=base + timedelta(minutes=i, seconds=1),
+                    status=TaskStatus.COMPLETED if i % 2 else TaskStatus.FAILED,
+                    status_code=200 if i % 2 else None, latency_ms=10.0 + i,
+                    error_message=None if i % 2 else "timeout")
+            for i in range(5)
+        ] + [
+            TaskRun(task_id=task.id + 1000, started_at=base, finished_at=base,
+                    status=TaskStatus.COMPLETED, latency_ms=1.0)
+        ])
+
+        url = f"{const.TASK_URL}/{task.id}/runs"
+        resp = await client.get(url, headers=headers, params={"limit": 3})
+        assert resp.status_code == 200
+        page = resp.json()
+        assert [run["latency_ms"] for run in page["runs"]] == [14.0, 13.0, 12.0]
+        assert [run["status_code"] for run in page["runs"]] == [None, 200, None]
+        assert page["next_cursor"] == page["runs"][-1]["id"]
+
+        resp = await client.get(url, headers=headers, params={"limit": 3, "cursor": page["next_cursor"]})
+        page = resp.json()
+        assert [run["latency_ms"] for run in page["runs"]] == [11.0, 10.0]
+        assert page["runs"][-1]["error_message"] == "timeout"
+        assert page["next_cursor"] is None
+
+        resp = await client.get(url, headers=headers, params={
+            "started_from": (base + timedelta(minutes=3)).timestamp()
+        })
+        assert len(resp.json()["runs"]) == 2
+
+        resp = await client.get(f"{const.TASK_URL}/99999/runs", headers=headers)
+        assert resp.status_code == 404
+
+
+def mock_response(chunks=(b'{"status": "success"}',), status_code=200, headers=None):
+    """构造以流的方式读取的响应"""
+    async def aiter_bytes():
+        for chunk in chunks:
+            yield chunk
+
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = httpx.Headers(headers or {"content-type": "application/json"})
+    response.aiter_bytes = aiter_bytes
+    response.aclose = AsyncMock()
+    return response
+
+
+def mock_session(response=None, error=None):
+    session = MagicMock()
+    session.build_request.side_effect = lambda method, **kwargs: httpx.Request(method, kwargs['url'])
+    session.send = AsyncMock(return_value=response, side_effect=error)
+    session.post = AsyncMock(return_value=MagicMock(status_code=200))
+    return session
+
+
+def mock_ping_task(task_id, method="GET", body=None, header=None):
+    task = AsyncMock(spec=RequestTask)
+    task.id = task_id
+    task.request_url = "http://test.com/api"
+    task.method = method
+    task.body = body
+    task.header = header or {}
+    task.callback_url = "http://callback.com/status"
+    task.callback_token = None
+    task.claimed_at = datetime(2026, 1, 1, 12, 0, 0)
+    return task
+
+
 @pytest.mark.asyncio
 class TestDramatiqActors:
     """测试Dramatiq Actors"""
 
-    async def test_ping_actor_success(self, stub_broker, stub_worker): # 恢复fixture
-        mock_task = AsyncMock(spec=RequestTask)
-        mock_task.id = 1
-        mock_task.request_url = "http://test.com/api"
-        mock_task.method = "GET"
-        mock_task.body = None
-        mock_task.header = {}
-        mock_task.callback_url = "http://callback.com/status"
-        # Mock status and error_message fields as they are not in specs by default in AsyncMock
-        mock_task.status = TaskStatus.PENDING
-        mock_task.error_message = None
-
+    async def run_ping(self, stub_broker, task, session):
+        """执行一次ping，返回 RequestTask.finish 的mock"""
         with patch(
-            'scheduler_service.models.RequestTask.get_or_none',
-            AsyncMock(return_value=mock_task)
+            'scheduler_service.models.RequestTask.claim',
+            AsyncMock(return_value=task)
+        ), patch(
+            'scheduler_service.models.RequestTask.finish', AsyncMock()
+        ) as mock_finish, patch(
+            'scheduler_service.service.request.get_session', return_value=session
+        ), patch(
+            'scheduler_service.service.callback.get_session', return_value=session
         ):
-            mock_response = AsyncMock()
-            mock_response.status_code = 200
-            mock_response.aread.return_value = b'{"status": "success"}'
-
-            mock_session = AsyncMock()
-            mock_session.get.return_value = mock_response
-            mock_session.post.return_value = AsyncMock()
-
-            with patch('scheduler_service.service.request.get_session', return_value=mock_session):
-                from scheduler_service.service.request import ping
-                ping.send(mock_task.id)
-
-                # 等待任务完成
-                stub_broker.join(queue_name=ping.queue_name)
-
-                mock_session.get.assert_called_once_with(url=mock_task.request_url, headers={})
-                mock_session.post.assert_called_once_with(
-                    mock_task.callback_url,
-                    json={
-                        'response': '{"status": "success"}',
-                        'code': 200,
-                        'exception': None,
-                        'status': RequestStatus.COMPLETE
-                    }
-                )
-                # 验证状态流转
-                assert mock_task.status == TaskStatus.COMPLETED
-                assert mock_task.error_message is None
-                assert mock_task.save.call_count >= 2 # Running + Completed
+            from scheduler_service.service.callback import deliver_callback
+            from scheduler_service.service.request import ping
+            ping.send(task.id)
+
+            # 等待任务完成，回调在独立队列中投递
+            stub_broker.join(queue_name=ping.queue_name)
+            stub_broker.join(queue_name=deliver_callback.queue_name)
+        return mock_finish
+
+    async def test_ping_actor_success(self, stub_broker, stub_worker): # 恢复fixture
+        mock_task = mock_ping_task(1)
+        response = mock_response()
+        session = mock_session(response)
+
+        mock_finish = await self.run_ping(stub_broker, mock_task, session)
+
+        session.build_request.assert_called_once_with("GET", url=mock_task.request_url, headers={})
+        assert session.send.call_args.kwargs == {"stream": True}
+        response.aclose.assert_awaited_once()
+        session.post.assert_called_once_with(
+            mock_task.callback_url,
+            json={
+                'response': '{"status": "success"}',
+                'code': 200,
+                'headers': {'content-type': 'application/json'},
+                'truncated': False,
+                'exception': None,
+                'status': RequestStatus.COMPLETE
+            },
+            headers={},
+            timeout=Config.CALLBACK_TIMEOUT
+        )
+        # 验证状态流转：只更新状态和错误信息，不再保存整行
+        mock_finish.assert_awaited_once_with(mock_task.id, TaskStatus.COMPLETED, None, mock_task.claimed_at)
+        mock_task.save.assert_not_called()
 
     async def test_ping_actor_http_error(self, stub_broker, stub_worker): # 恢复fixture
-        mock_task = AsyncMock(spec=RequestTask)
-        mock_task.id = 2
+        mock_task = mock_ping_task(2)
         mock_task.request_url = "http://nonexistent.com/api"
-        mock_task.method = "GET"
-        mock_task.body = None
-        mock_task.header = {}
-        mock_task.callback_url = "http://callback.com/status"
-        mock_task.status = TaskStatus.PENDING
-        mock_task.error_message = None
-
-        with patch(
-            'scheduler_service.models.RequestTask.get_or_none',
-            AsyncMock(return_value=mock_task)
-        ):
-            mock_session = AsyncMock()
-            mock_session.get.side_effect = httpx.RequestError(
-                "Network error",
-                request=httpx.Request("GET", mock_task.request_url)
-            )
-            mock_session.post.return_value = AsyncMock()
-
-            with patch('scheduler_service.service.request.get_session', return_value=mock_session):
-                from scheduler_service.service.request import ping
-                ping.send(mock_task.id)
-
-                # 等待任务完成
-                stub_broker.join(queue_name=ping.queue_name)
-
-                mock_session.get.assert_called_once_with(url=mock_task.request_url, headers={})
-                mock_session.post.assert_called_once()
-                args, kwargs = mock_session.post.call_args
-                assert kwargs['json']['status'] == RequestStatus.FAIL
-                assert 'Network error' in kwargs['json']['exception']
-                
-                # 验证状态流转
-                assert mock_task.status == TaskStatus.FAILED
-                assert "Network error" in str(mock_task.error_message)
-                assert mock_task.save.call_count >= 2 # Running + Failed
+        session = mock_session(error=httpx.RequestError(
+            "Network error",
+            request=httpx.Request("GET", mock_task.request_url)
+        ))
+
+        mock_finish = await self.run_ping(stub_broker, mock_task, session)
+
+        session.build_request.assert_called_once_with("GET", url=mock_task.request_url, headers={})
+        session.post.assert_called_once()
+        args, kwargs = session.post.call_args
+        assert kwargs['json']['status'] == RequestStatus.FAIL
+        assert 'Network error' in kwargs['json']['exception']
+
+        # 验证状态流转
+        task_id, task_status, error_message, claimed_at = mock_finish.call_args.args
+        assert task_id == mock_task.id
+        assert task_status == TaskStatus.FAILED
+        assert "Network error" in error_message
+        assert claimed_at == mock_task.claimed_at
+        mock_task.save.assert_not_called()
 
     @pytest.mark.parametrize("method", ["POST", "PUT", "DELETE", "PATCH", "GET"])
     async def test_ping_actor_methods(self, method, stub_broker, stub_worker):
         """测试不同HTTP方法的ping actor"""
-        mock_task = AsyncMock(spec=RequestTask)
-        mock_task.id = 3
-        mock_task.request_url = "http://test.com/api"
-        mock_task.method = method
-        mock_task.body = {"data": "test"} if method in ["POST", "PUT", "PATCH"] else None
-        mock_task.header = {"Content-Type": "application/json"}
-        mock_task.callback_url = "http://callback.com/status"
+        body = {"data": "test"} if method in ["POST", "PUT", "PATCH"] else None
+        mock_task = mock_ping_task(3, method, body, {"Content-Type": "application/json"})
+        session = mock_session(mock_response())
 
+        mock_finish = await self.run_ping(stub_broker, mock_task, session)
+
+        expected_kwargs = {
+            'url': mock_task.request_url,
+            'headers': mock_task.header
+        }
+        if mock_task.body:
+            expected_kwargs['json'] = mock_task.body
+        session.build_request.assert_called_once_with(method, **expected_kwargs)
+        # 请求本身不再使用 session.post，post 只用于回调
+        session.post.assert_called_once()
+        assert session.post.call_args.kwargs['json']['response'] == '{"status": "success"}'
+        mock_finish.assert_awaited_once_with(mock_task.id, TaskStatus.COMPLETED, None, mock_task.claimed_at)
+
+    async def test_ping_actor_truncates_response(self, stub_broker, stub_worker, mocker):
+        """响应体超过上限时只保留前 PING_MAX_RESPONSE_BYTES 字节"""
+        mocker.patch.object(Config, "PING_MAX_RESPONSE_BYTES", 10)
+        response = mock_response([b"0123456", b"789abc", b"never read"])
+        session = mock_session(response)
+
+        await self.run_ping(stub_broker, mock_ping_task(4), session)
+
+        callback = session.post.call_args.kwargs['json']
+        assert callback['response'] == "0123456789"
+        assert callback['truncated'] is True
+        response.aclose.assert_awaited_once()
+
+    async def test_ping_actor_headers_only(self, stub_broker, stub_worker, mocker):
+        mocker.patch.object(Config, "PING_RESPONSE_MODE", "headers")
+        response = mock_response([b"body"], status_code=204, headers={"x-request-id": "abc"})
+        session = mock_session(response)
+
+        await self.run_ping(stub_broker, mock_ping_task(5), session)
+
+        callback = session.post.call_args.kwargs['json']
+        assert callback['response'] is None
+        assert callback['code'] == 204
+        assert callback['headers'] == {"x-request-id": "abc"}
+        assert callback['truncated'] is False
+
+    async def test_decode_content(self):
+        from scheduler_service.service.http import decode_content
+        assert decode_content("héllo".encode("latin-1"), {"content-type": "text/plain; charset=ISO-8859-1"}) == "héllo"
+        assert decode_content(b"ok\xff", {}) == "ok\ufffd"
+        assert decode_content(b"ok", {"content-type": "text/plain; charset=unknown"}) == "ok"
+
+    async def test_ping_actor_callback_token(self, stub_broker, stub_worker):
+        """回调在独立队列中投递，并携带callback_token"""
+        mock_task = mock_ping_task(6)
+        mock_task.callback_token = "secret"
+        session = mock_session(mock_response())
+
+        await self.run_ping(stub_broker, mock_task, session)
+
+        assert session.post.call_args.kwargs['headers'] == {"Authorization": "Bearer secret"}
+
+    async def test_post_callback_retryable(self, mocker):
+        from scheduler_service.service.callback import CallbackError, post_callback
+
+        session = mock_session()
+        mocker.patch('scheduler_service.service.callback.get_session', return_value=session)
+
+        for code in (500, 503, 429):
+            session.post.return_value = MagicMock(status_code=code)
+            with pytest.raises(CallbackError):
+                await post_callback("http://callback.com/status", {})
+
+        # 其他4xx说明回调本身有问题，重试也不会成功
+        session.post.return_value = MagicMock(status_code=404)
+        await post_callback("http://callback.com/status", {})
+
+    async def test_ping_actor_throttled(self, stub_broker, stub_worker):
+        """目标主机被限流时恢复为待执行并延迟重新入队"""
+        mock_task = mock_ping_task(7)
+        session = mock_session(mock_response())
+
+        from scheduler_service.service.request import ping
         with patch(
-            'scheduler_service.models.RequestTask.get_or_none',
+            'scheduler_service.models.RequestTask.claim',
             AsyncMock(return_value=mock_task)
-        ):
-            mock_response = AsyncMock()
-            mock_response.status_code = 200
-            mock_response.aread.return_value = b'{"status": "success"}'
-
-            mock_session = AsyncMock()
-            # 先设置默认的post返回值（用于回调）
-            mock_session.post.return_value = AsyncMock()
-
-            # 设置特定方法的返回值（如果是POST，这会覆盖上面的设置）
-            mock_method = getattr(mock_session, method.lower())
-            mock_method.return_value = mock_response
-
-            with patch('scheduler_service.service.request.get_session', return_value=mock_session):
-                from scheduler_service.service.request import ping
-                ping.send(mock_task.id)
-
-                stub_broker.join(queue_name=ping.queue_name)
-
-                expected_kwargs = {
-                    'url': mock_task.request_url,
-                    'headers': mock_task.header
-                }
-                if mock_task.body:
-                    expected_kwargs['json'] = mock_task.body
-
-                # 对于POST方法，session.post会被调用两次（一次请求，一次回调）
-                if method == "POST":
-                    mock_method.assert_any_call(**expected_kwargs)
-                else:
-                    mock_method.assert_called_once_with(**expected_kwargs)
-
-                # 验证回调
-                # 注意：如果method是POST，mock_session.post已经被上面的逻辑验证过一部分了
-                # 这里我们专门验证回调的那次调用
-                mock_session.post.assert_called_with(
-                    mock_task.callback_url,
-                    json={
-                        'response': '{"status": "success"}',
-                        'code': 200,
-                        'exception': None,
-                        'status': RequestStatus.COMPLETE
-                    }
-                )
+        ), patch(
+            'scheduler_service.models.RequestTask.finish', AsyncMock()
+        ) as mock_finish, patch(
+            'scheduler_service.service.request.get_session', return_value=session
+        ), patch(
+            'scheduler_service.service.request.acquire_host', AsyncMock(return_value=(250, None))
+        ), patch.object(ping, 'send_with_options') as mock_resend:
+            # send 内部也调用 send_with_options，这里直接入队
+            stub_broker.enqueue(ping.message(mock_task.id))
+            stub_broker.join(queue_name=ping.queue_name)
+
+        session.send.assert_not_called()
+        mock_finish.assert_awaited_once_with(mock_task.id, TaskStatus.PENDING)
+        mock_resend.assert_called_once_with(args=(mock_task.id,), delay=250)
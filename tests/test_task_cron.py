@@ -2,7 +2,7 @@ import time
 import pytest
 from scheduler_service.models import RequestTask
 from tests import const
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock, patch
 
 @pytest.mark.asyncio
 class TestTaskCron:
@@ -114,3 +114,99 @@ class TestTaskCron:
         # Verify task was not created (or deleted)
         tasks = await RequestTask.filter(name="invalid_cron_task")
         assert len(tasks) == 0
+
+    async def test_cron_count_buffered(self, client, headers, user, stub_broker, monkeypatch):
+        """cron循环计数先累计，读取时合并未写回的增量，刷写后写入数据库"""
+        from scheduler_service.service import counters
+        from scheduler_service.service.request import trigger_cron_task
+
+        monkeypatch.setattr(counters, "_backend", counters.MemoryBackend())
+        tasks = [
+            await RequestTask.create(name=f"count_{i}", request_url="http://example.com",
+                                     cron="* * * * *", cron_count=10, user=user)
+            for i in range(2)
+        ]
+        for _ in range(3):
+            await trigger_cron_task(tasks[0].id, user.id)
+        await trigger_cron_task(tasks[1].id, user.id)
+
+        # 触发时不更新数据库
+        await tasks[0].refresh_from_db()
+        assert tasks[0].cron_count == 10
+
+        resp = await client.get(f"{const.TASK_URL}/{tasks[0].id}", headers=headers)
+        assert resp.json()["cron_count"] == 13
+        resp = await client.get(const.TASK_URL, headers=headers, params={"fields": "cron_count"})
+        assert [task["cron_count"] for task in resp.json()["tasks"]] == [13, 11]
+
+        assert await counters.flush_cron_counts() == 2
+        await tasks[0].refresh_from_db()
+        await tasks[1].refresh_from_db()
+        assert (tasks[0].cron_count, tasks[1].cron_count) == (13, 11)
+        assert await counters.pending_cron_counts([tasks[0].id, tasks[1].id]) == {}
+
+        resp = await client.get(f"{const.TASK_URL}/{tasks[0].id}", headers=headers)
+        assert resp.json()["cron_count"] == 13
+
+    async def test_cron_count_flush_failure(self, user, monkeypatch):
+        """写库失败的增量保留到下次刷写"""
+        from scheduler_service.service import counters
+
+        monkeypatch.setattr(counters, "_backend", counters.MemoryBackend())
+        task = await RequestTask.create(name="count_retry", request_url="http://example.com",
+                                        cron="* * * * *", user=user)
+        await counters.incr_cron_count(task.id)
+
+        with patch.object(RequestTask, "add_cron_counts", AsyncMock(side_effect=RuntimeError("db down"))):
+            with pytest.raises(RuntimeError):
+                await counters.flush_cron_counts()
+
+        # 写库失败的增量与之后新增的计数一起写回
+        await counters.incr_cron_count(task.id)
+        assert await counters.pending_cron_counts([task.id]) == {task.id: 2}
+        assert await counters.flush_cron_counts() == 1
+        await task.refresh_from_db()
+        assert task.cron_count == 2
+
+    async def test_cron_count_flush_idempotent(self, user, monkeypatch):
+        """写库后删除批次失败时，下次刷写跳过已写回的批次"""
+        from scheduler_service.service import counters
+
+        backend = counters.MemoryBackend()
+        monkeypatch.setattr(counters, "_backend", backend)
+        task = await RequestTask.create(name="count_once", request_url="http://example.com",
+                                        cron="* * * * *", user=user)
+        await counters.incr_cron_counts([task.id, task.id])
+
+        with patch.object(backend, "commit_flush", AsyncMock(side_effect=RuntimeError("redis down"))):
+            with pytest.raises(RuntimeError):
+                await counters.flush_cron_counts()
+        await task.refresh_from_db()
+        assert task.cron_count == 2
+
+        # 残留的批次不再累加，之后新增的计数正常写回
+        await counters.incr_cron_count(task.id)
+        assert await counters.flush_cron_counts() == 1
+        await task.refresh_from_db()
+        assert task.cron_count == 3
+        assert await counters.pending_cron_counts([task.id]) == {}
+
+    async def test_cron_count_flush_lock_lost(self, user, monkeypatch):
+        """写库期间刷写锁过期时回滚，批次保留到下次刷写"""
+        from scheduler_service.service import counters
+
+        backend = counters.MemoryBackend()
+        monkeypatch.setattr(counters, "_backend", backend)
+        task = await RequestTask.create(name="count_lock", request_url="http://example.com",
+                                        cron="* * * * *", user=user)
+        await counters.incr_cron_count(task.id)
+
+        with patch.object(backend, "extend_lock", AsyncMock(return_value=False)):
+            with pytest.raises(counters.FlushLockLost):
+                await counters.flush_cron_counts()
+        await task.refresh_from_db()
+        assert task.cron_count == 0
+
+        assert await counters.flush_cron_counts() == 1
+        await task.refresh_from_db()
+        assert task.cron_count == 1
@@ -44,6 +44,22 @@ class TestUserModel:
         # 清理
         await user.delete()
 
+    async def test_password_hashing_async(self, app):
+        """测试在执行器中计算和验证密码哈希"""
+        password_hash = await User.hash_password_async("password")
+        user = await User.create(
+            name="async_hash_test",
+            password_hash=password_hash,
+            email="async_hash_test@test.com"
+        )
+
+        assert await user.verify_password_async("password") is True
+        assert await user.verify_password_async("wrong_password") is False
+        assert user.verify_password("password") is True
+
+        # 清理
+        await user.delete()
+
     async def test_ping(self, app):
         """测试更新登录时间"""
         user = await User.create(
@@ -352,6 +368,17 @@ class TestUserAPI:
         })
         assert resp.status_code == 401
 
+    async def test_get_token_hashing_busy(self, client, user, mocker):
+        """测试哈希排队已满时返回503"""
+        mocker.patch("scheduler_service.utils.hashing._max_pending", 0)
+
+        resp = await client.post(const.AUTH_TOKEN_URL, json={
+            "name": "test",
+            "password": "password"
+        })
+        assert resp.status_code == 503
+        assert resp.headers["Retry-After"] == "1"
+
     async def test_unauthorized_access(self, client):
         """测试未授权访问"""
         # 不带认证头访问
@@ -391,3 +418,91 @@ class TestUserAPI:
             "email": "invalid_email"
         })
         assert resp.status_code == 422
+
+
+class TestUserCache:
+    """测试已认证用户缓存"""
+
+    def test_ttl_cache_expire_and_lru(self, mocker):
+        """测试缓存过期与LRU淘汰"""
+        from scheduler_service.utils.cache import TTLCache
+
+        now = mocker.patch("scheduler_service.utils.cache.time.monotonic", return_value=100.0)
+        cache = TTLCache(maxsize=2, ttl=10)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1
+
+        # "b" 最久未使用，被淘汰
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+
+        now.return_value = 111.0
+        assert cache.get("a") is None
+        assert cache.stats() == {"size": 1, "maxsize": 2, "hits": 2, "misses": 2}
+
+    async def test_login_require_uses_cache(self, client, headers, user):
+        """测试重复请求只查询一次用户表"""
+        from scheduler_service.api.user_cache import user_cache
+
+        resp = await client.get(const.USER_ME_URL, headers=headers)
+        assert resp.status_code == 200
+        misses = user_cache.misses
+
+        resp = await client.get(const.USER_ME_URL, headers=headers)
+        assert resp.status_code == 200
+        assert user_cache.misses == misses
+        assert user_cache.hits >= 1
+
+        resp = await client.get("/api/v1/metrics", headers=headers)
+        assert resp.status_code == 200
+        assert resp.json()["user_cache"]["hits"] >= 1
+
+        # 指标包含按用户和按主机的统计，未登录时不可访问
+        resp = await client.get("/api/v1/metrics")
+        assert resp.status_code == 401
+
+    async def test_cached_user_is_copied(self, user):
+        """测试缓存命中时每次返回新的用户实例，修改不会影响其他请求"""
+        from scheduler_service.api.user_cache import get_user
+
+        first = await get_user(user.id, "token")
+        first.name = "changed"
+        second = await get_user(user.id, "token")
+        assert second is not first
+        assert second.name == "test"
+        assert second.id == user.id and second._saved_in_db
+
+    async def test_user_cache_config(self):
+        """测试缓存容量和过期时间在应用启动时从应用配置读取"""
+        from scheduler_service.api.user_cache import setup_user_cache, user_cache
+
+        maxsize, ttl = user_cache.maxsize, user_cache.ttl
+        try:
+            setup_user_cache({"USER_CACHE_SIZE": 5, "USER_CACHE_TTL": 1})
+            assert (user_cache.maxsize, user_cache.ttl) == (5, 1)
+        finally:
+            user_cache.maxsize, user_cache.ttl = maxsize, ttl
+
+    async def test_update_user_invalidates_cache(self, client, headers, user):
+        """测试更新用户后缓存失效"""
+        resp = await client.get(const.USER_ME_URL, headers=headers)
+        assert resp.json()["name"] == "test"
+
+        resp = await client.put(const.USER_ME_URL, headers=headers, json={"name": "renamed"})
+        assert resp.status_code == 200
+
+        resp = await client.get(const.USER_ME_URL, headers=headers)
+        assert resp.json()["name"] == "renamed"
+
+    async def test_delete_user_invalidates_cache(self, client, headers, user):
+        """测试删除用户后token立即失效"""
+        resp = await client.get(const.USER_ME_URL, headers=headers)
+        assert resp.status_code == 200
+
+        resp = await client.delete(const.USER_ME_URL, headers=headers)
+        assert resp.status_code == 200
+
+        resp = await client.get(const.USER_ME_URL, headers=headers)
+        assert resp.status_code == 401